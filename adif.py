@@ -0,0 +1,140 @@
+"""
+ADIF (ADI格式) 解析模块
+功能：从ADI文件中逐条读取QSO记录，以及逐条生成ADI文本
+
+按块读取字节流并严格按照 <TAG:长度[:类型]> 中声明的长度截取字段值，
+值中可以包含 '<' 等任意字符；内存占用只与单条记录大小有关，与文件大小无关。
+长度按编码后的字节数计算。
+"""
+
+import os
+import re
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# 字段头: <名称[:长度[:类型]]>，名称中不能出现 '<'，从而跳过孤立的 '<'
+_TAG_PATTERN = re.compile(rb'<([^<>:]+)(?::(\d+)(?::[^<>]*)?)?>')
+
+
+def _iter_fields(stream, chunk_size, initial=b''):
+    """
+    ADI字段分词器
+    :param initial: 已从流中读出的开头部分
+    :return: 生成器，产出 (字段名大写, 值字节串或None)；EOR/EOH 等无长度的标记值为 None
+    """
+    buf = initial
+    pos = 0
+    eof = False
+    # 字段名种类很少，缓存解码结果
+    names = {}
+
+    while True:
+        match = _TAG_PATTERN.search(buf, pos)
+        if match is not None:
+            raw_name, length = match.groups()
+            name = names.get(raw_name)
+            if name is None:
+                name = names[raw_name] = raw_name.strip().upper().decode('ascii', 'replace')
+            if length is None:
+                pos = match.end()
+                yield name, None
+                continue
+            start = match.end()
+            end = start + int(length)
+            if end <= len(buf):
+                pos = end
+                yield name, buf[start:end]
+                continue
+            # 值尚未完整读入，读入更多数据后从该字段开头重新解析
+            pos = match.start()
+        else:
+            # 保留可能未读完整的最后一个标记，其余字段间文本直接忽略
+            lt = buf.rfind(b'<', pos)
+            pos = lt if lt >= 0 else len(buf)
+
+        if eof:
+            return
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            eof = True
+            continue
+        buf = buf[pos:] + chunk
+        pos = 0
+
+
+def iter_adi_records(stream, encoding='utf-8', chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    从二进制流中逐条读取ADI记录，跳过 <EOH> 之前的文件头
+    :param stream: 以二进制模式打开的文件对象
+    :return: 生成器，每条记录为 {字段名(大写): 值} 字典
+    """
+    initial = stream.read(chunk_size)
+    # 按ADIF规范，首字符为 '<' 的文件没有文件头
+    in_header = not initial.startswith(b'<')
+
+    record = {}
+    for name, value in _iter_fields(stream, chunk_size, initial):
+        if in_header:
+            if name == 'EOH':
+                in_header = False
+            continue
+        if value is None:
+            if name == 'EOR' and record:
+                yield record
+                record = {}
+            continue
+        record[name] = value.decode(encoding)
+
+
+def read_adi_records(source, encoding='utf-8', chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    逐条读取ADI记录
+    :param source: 文件路径或文件对象(二进制；文本模式的文件对象会使用其底层缓冲区)
+    :param encoding: 文件编码
+    :param chunk_size: 每次读取的字节数
+    :return: 生成器，每条记录为 {字段名(大写): 值} 字典
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            yield from iter_adi_records(f, encoding, chunk_size)
+    else:
+        stream = getattr(source, 'buffer', source)
+        yield from iter_adi_records(stream, encoding, chunk_size)
+
+
+def format_field(name, value, encoding='utf-8'):
+    """
+    生成一个ADI字段，长度按编码后的字节数计算(与解析时一致)
+    :param value: 字符串或可转换为字符串的值
+    """
+    text = value if isinstance(value, str) else str(value)
+    return f"<{name}:{len(text.encode(encoding))}>{text}"
+
+
+def format_header(program_id='QSL Logger', program_version='1.0.0', encoding='utf-8'):
+    """ADI文件头"""
+    return "Generated by {}\n{}\n{}\n{}\n<EOH>\n".format(
+        program_id,
+        format_field('ADIF_VER', '3.1.0', encoding),
+        format_field('PROGRAMID', program_id, encoding),
+        format_field('PROGRAMVERSION', program_version, encoding),
+    )
+
+
+def format_record(record, encoding='utf-8'):
+    """将 {ADIF字段名: 值} 字典转换为一条ADI记录，忽略空值"""
+    return "".join(
+        format_field(name, value, encoding) for name, value in record.items() if value is not None and value != ''
+    ) + "<EOR>\n"
+
+
+def iter_adi(records, encoding='utf-8', header=True):
+    """
+    逐条生成ADI文本，不在内存中拼接整个文件
+    :param records: {ADIF字段名: 值} 字典的可迭代对象
+    :return: 生成器，先产出文件头，之后每条记录产出一个字符串
+    """
+    if header:
+        yield format_header(encoding=encoding)
+    for record in records:
+        yield format_record(record, encoding)
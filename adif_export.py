@@ -0,0 +1,124 @@
+"""
+ADIF导出模块
+按 qso_log 列与ADIF字段的对应关系生成ADI文件，使用服务端游标分批读取并逐批输出，
+内存占用与日志总数无关
+
+命令行用法: python adif_export.py 输出文件.adi [--callsign BY4 --band 20m ...]
+"""
+
+import argparse
+import datetime
+
+from adif import format_header, format_record
+from db_utils import config, stream_query
+import log_filters
+
+DEFAULT_ENCODING = config.get('SETTINGS', 'encoding', fallback='utf-8')
+
+
+def _text(value):
+    return value.strip() if isinstance(value, str) else str(value)
+
+
+def _number(value):
+    # 14.074 而不是 14.074000000000001
+    return f"{float(value):.6f}".rstrip('0').rstrip('.')
+
+
+def _date(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.strftime('%Y%m%d')
+    return str(value).replace('-', '')[:8]
+
+
+def _time(value):
+    # time 列为 'HH:MM' 或 'HH:MM:SS'
+    if isinstance(value, datetime.timedelta):
+        seconds = int(value.total_seconds())
+        return f"{seconds // 3600:02d}{seconds // 60 % 60:02d}{seconds % 60:02d}"
+    return str(value).replace(':', '')[:6]
+
+
+def _upper(value):
+    return _text(value).upper()
+
+
+# qso_log 列 -> (ADIF字段, 格式化函数)，与 adif_import.adif_record_to_row 的映射对应
+# 表中没有信号报告(RST)列，导出时也不包含
+EXPORT_FIELDS = (
+    ('callsign', 'CALL', _upper),
+    ('date', 'QSO_DATE', _date),
+    ('time', 'TIME_ON', _time),
+    ('band', 'BAND', _text),
+    ('mode', 'MODE', _upper),
+    ('frequency', 'FREQ', _number),
+    ('power', 'TX_PWR', _number),
+    ('equipment', 'MY_RIG', _text),
+    ('antenna', 'MY_ANTENNA', _text),
+    ('grid', 'GRIDSQUARE', _upper),
+    ('dxcc', 'DXCC', _text),
+    ('province', 'STATE', _text),
+    ('notes', 'COMMENT', _text),
+    ('lotw_qsl_sent', 'LOTW_QSL_SENT', _upper),
+    ('lotw_qsl_rcvd', 'LOTW_QSL_RCVD', _upper),
+)
+EXPORT_COLUMNS = tuple(column for column, _, _ in EXPORT_FIELDS) + ('confirmed',)
+
+
+def row_to_adif_record(row):
+    """
+    将 qso_log 行转换为ADIF记录
+    :return: {ADIF字段名: 字符串值}，空值不包含在内
+    """
+    record = {}
+    for column, name, convert in EXPORT_FIELDS:
+        value = row.get(column)
+        if value is None or value == '':
+            continue
+        # 频率、功率为0表示未填写
+        if name in ('FREQ', 'TX_PWR') and not value:
+            continue
+        record[name] = convert(value)
+    if row.get('confirmed') and 'LOTW_QSL_RCVD' not in record:
+        record['LOTW_QSL_RCVD'] = 'Y'
+    return record
+
+
+def export_adi(filters=None, encoding=DEFAULT_ENCODING, batch_size=500):
+    """
+    按时间顺序导出日志
+    :param filters: log_filters.parse_filters 返回的筛选条件
+    :param encoding: 输出编码，字段长度按该编码的字节数计算
+    :param batch_size: 每次从游标读取的行数，也是每次产出的记录数
+    :return: 生成器，产出编码后的字节串
+    """
+    conditions, params = log_filters.build_conditions(filters or {})
+    query = f"""
+        SELECT {", ".join(EXPORT_COLUMNS)} FROM qso_log {log_filters.where_clause(conditions)}
+        ORDER BY qso_datetime_utc, id
+    """
+    yield format_header(encoding=encoding).encode(encoding)
+    for rows in stream_query(query, params, batch_size):
+        yield "".join(format_record(row_to_adif_record(row), encoding) for row in rows).encode(encoding)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="导出日志为ADIF(ADI)文件")
+    parser.add_argument('output', help="输出文件路径")
+    parser.add_argument('--encoding', default=DEFAULT_ENCODING, help="输出文件编码")
+    for name in log_filters.FILTERS:
+        parser.add_argument(f"--{name.replace('_', '-')}", dest=name, help="筛选条件，见 log_filters.py")
+    args = parser.parse_args(argv)
+
+    from db_utils import init_db_pool
+    init_db_pool()
+
+    filters = log_filters.parse_filters(vars(args))
+    with open(args.output, 'wb') as f:
+        for chunk in export_adi(filters, encoding=args.encoding):
+            f.write(chunk)
+    print(f"已导出到 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+ADIF批量导入模块
+按批次执行多行 INSERT ... ON DUPLICATE KEY UPDATE，每批一个事务，
+依赖 qso_log 上的唯一键 uq_qso_log_identity (callsign, date, time, band, mode)
+
+命令行用法: python adif_import.py log.adi [--batch-size 1000]
+"""
+
+import argparse
+import logging
+import time
+
+from adif import read_adi_records
+from db_utils import config, transaction
+import callsign_resolver
+import qso_events
+import qso_time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = config.getint('SETTINGS', 'import_batch_size', fallback=1000)
+DEFAULT_ENCODING = config.get('SETTINGS', 'encoding', fallback='utf-8')
+# 按呼号补全为空的 dxcc、province(见 callsign_resolver.py)
+ENRICH = config.getboolean('SETTINGS', 'enrich_imports', fallback=False)
+
+# 导入时写入的列，顺序与 adif_record_to_row 返回的字典一致
+IMPORT_COLUMNS = (
+    'callsign', 'frequency', 'mode', 'equipment', 'antenna', 'power',
+    'date', 'time', 'notes', 'dxcc', 'grid', 'province', 'band',
+    'confirmed', 'lotw_qsl_rcvd', 'lotw_qsl_sent', 'sync_status', 'qso_datetime_utc'
+)
+IDENTITY_COLUMNS = ('callsign', 'date', 'time', 'band', 'mode')
+
+# 已存在的记录只补充空字段和确认状态，不覆盖手工录入的数据
+# 注意 MySQL 按从左到右的顺序赋值，last_sync_time 必须在 confirmed 之前
+# (SQLite 中各赋值都使用原值，结果相同)
+_UPSERT_SUFFIX = """
+ON DUPLICATE KEY UPDATE
+    last_sync_time = IF(VALUES(confirmed) > COALESCE(confirmed, 0), NOW(), last_sync_time),
+    confirmed = GREATEST(COALESCE(confirmed, 0), VALUES(confirmed)),
+    lotw_qsl_rcvd = IF(VALUES(lotw_qsl_rcvd) = 'Y', 'Y', COALESCE(lotw_qsl_rcvd, VALUES(lotw_qsl_rcvd))),
+    lotw_qsl_sent = IF(VALUES(lotw_qsl_sent) = 'Y', 'Y', COALESCE(lotw_qsl_sent, VALUES(lotw_qsl_sent))),
+    frequency = IF(COALESCE(frequency, 0) = 0, VALUES(frequency), frequency),
+    dxcc = COALESCE(NULLIF(dxcc, ''), VALUES(dxcc)),
+    grid = COALESCE(NULLIF(grid, ''), VALUES(grid)),
+    province = COALESCE(NULLIF(province, ''), VALUES(province)),
+    sync_status = IF(VALUES(sync_status) = 2, 2, sync_status),
+    qso_datetime_utc = COALESCE(qso_datetime_utc, VALUES(qso_datetime_utc))
+"""
+
+
+def _to_float(value, default=None):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def adif_record_to_row(record):
+    """
+    将ADIF记录转换为 qso_log 行
+    :param record: {ADIF字段名: 值} 字典
+    :return: 行字典，缺少必要字段或格式错误时返回 None
+    """
+    if not all(record.get(k) for k in ('CALL', 'QSO_DATE', 'TIME_ON', 'BAND', 'MODE')):
+        return None
+
+    qso_date = record['QSO_DATE'].strip()
+    time_on = record['TIME_ON'].strip()
+    if len(qso_date) != 8 or not qso_date.isdigit():
+        return None
+    if len(time_on) not in (4, 6) or not time_on.isdigit():
+        return None
+
+    date = f"{qso_date[:4]}-{qso_date[4:6]}-{qso_date[6:]}"
+
+    # LOTW_QSL_RCVD: Y-已确认, V-已核实
+    qsl_rcvd = record.get('LOTW_QSL_RCVD', '').strip().upper()[:1] or None
+    confirmed = qsl_rcvd in ('Y', 'V')
+    # 已在LOTW中的记录(LOTW下载的报告或已标记上传)不需要再由 lotw_uploader 上传
+    qsl_sent = record.get('LOTW_QSL_SENT', '').strip().upper()[:1] or None
+    in_lotw = confirmed or qsl_sent == 'Y' or bool(record.get('APP_LOTW_RXQSO'))
+
+    return {
+        'callsign': record['CALL'].strip().upper(),
+        'frequency': _to_float(record.get('FREQ'), 0.0),
+        'mode': record['MODE'].strip().upper(),
+        'equipment': record.get('MY_RIG') or None,
+        'antenna': record.get('MY_ANTENNA') or None,
+        'power': _to_float(record.get('TX_PWR')),
+        'date': date,
+        'time': f"{time_on[:2]}:{time_on[2:4]}",
+        'notes': record.get('COMMENT') or record.get('NOTES') or None,
+        'dxcc': record.get('DXCC') or None,
+        'grid': record.get('GRIDSQUARE') or None,
+        'province': record.get('STATE') or None,
+        'band': record['BAND'].strip().lower(),
+        'confirmed': 1 if confirmed else 0,
+        'lotw_qsl_rcvd': 'Y' if confirmed else qsl_rcvd,
+        'lotw_qsl_sent': 'Y' if in_lotw else qsl_sent,
+        'sync_status': 2 if in_lotw else 0,
+        # QSO_DATE、TIME_ON 为UTC，保留 TIME_ON 中的秒
+        'qso_datetime_utc': qso_time.column_value(date, time_on)
+    }
+
+
+def _upsert_batch(rows):
+    """
+    在一个事务中写入一批记录
+    :return: (新增记录数, 更新记录数)
+    """
+    key_placeholders = "(" + ", ".join(["%s"] * len(IDENTITY_COLUMNS)) + ")"
+    key_query = (
+        f"SELECT * FROM qso_log "
+        f"WHERE ({', '.join(IDENTITY_COLUMNS)}) IN ({', '.join([key_placeholders] * len(rows))})"
+    )
+    key_params = [row[c] for row in rows for c in IDENTITY_COLUMNS]
+
+    with transaction() as cursor:
+        # 写入前后各读取一次本批涉及的记录，用于更新统计表和缓存
+        cursor.execute(key_query + " FOR UPDATE", key_params)
+        existing = cursor.fetchall()
+
+        row_placeholders = "(" + ", ".join(["%s"] * len(IMPORT_COLUMNS)) + ")"
+        cursor.execute(
+            f"INSERT INTO qso_log ({', '.join(IMPORT_COLUMNS)}) "
+            f"VALUES {', '.join([row_placeholders] * len(rows))}" + _UPSERT_SUFFIX,
+            [row[c] for row in rows for c in IMPORT_COLUMNS]
+        )
+        affected = cursor.rowcount
+
+        # 没有变化的记录不计入受影响行数；有变化的记录MySQL计2、SQLite计1，
+        # 更新记录数按写入前后读取的结果比较得到
+        added = len(rows) - len(existing)
+        updated = 0
+        if affected:
+            cursor.execute(key_query, key_params)
+            current = cursor.fetchall()
+            before = {row['id']: row for row in existing}
+            updated = sum(1 for row in current if row['id'] in before and row != before[row['id']])
+            qso_events.publish(removed=existing, added=current)
+
+    return added, updated
+
+
+def import_records(records, batch_size=None):
+    """
+    批量导入ADIF记录
+    :param records: ADIF记录字典的可迭代对象(通常是 read_adi_records 返回的生成器)
+    :param batch_size: 每批记录数(每批一个事务)，默认读取配置 SETTINGS.import_batch_size
+    :return: 导入统计字典
+    """
+    batch_size = batch_size or DEFAULT_BATCH_SIZE
+    stats = {'records': 0, 'added': 0, 'updated': 0, 'skipped': 0, 'enriched': 0, 'batches': 0}
+    started = time.perf_counter()
+
+    def flush(batch):
+        rows = list(batch.values())
+        if ENRICH:
+            stats['enriched'] += callsign_resolver.enrich(rows)
+        added, updated = _upsert_batch(rows)
+        stats['added'] += added
+        stats['updated'] += updated
+        stats['batches'] += 1
+        batch.clear()
+
+    # 以唯一键去重，同一批内重复的记录以最后一条为准
+    batch = {}
+    for record in records:
+        stats['records'] += 1
+        row = adif_record_to_row(record)
+        if row is None:
+            stats['skipped'] += 1
+            continue
+        key = tuple(str(row[c]).lower() for c in IDENTITY_COLUMNS)
+        batch[key] = row
+        if len(batch) >= batch_size:
+            flush(batch)
+    if batch:
+        flush(batch)
+
+    elapsed = time.perf_counter() - started
+    stats['seconds'] = round(elapsed, 3)
+    stats['rows_per_second'] = round(stats['records'] / elapsed, 1) if elapsed > 0 else 0.0
+    logger.info(f"ADIF导入完成: {stats}")
+    return stats
+
+
+def import_adif(source, batch_size=None, encoding=None):
+    """
+    批量导入ADI文件
+    :param source: 文件路径或文件对象
+    :param batch_size: 每批记录数(每批一个事务)，默认读取配置 SETTINGS.import_batch_size
+    :param encoding: 文件编码，默认读取配置 SETTINGS.encoding
+    :return: 导入统计字典
+    """
+    return import_records(read_adi_records(source, encoding or DEFAULT_ENCODING), batch_size)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量导入ADIF(ADI)日志文件")
+    parser.add_argument('files', nargs='+', help="ADI文件路径")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="每批(每个事务)记录数")
+    parser.add_argument('--encoding', default=DEFAULT_ENCODING, help="ADI文件编码")
+    args = parser.parse_args(argv)
+
+    from db_utils import init_db_pool
+    init_db_pool()
+
+    for path in args.files:
+        stats = import_adif(path, batch_size=args.batch_size, encoding=args.encoding)
+        print(f"{path}: 共 {stats['records']} 条，新增 {stats['added']}，更新 {stats['updated']}，"
+              f"跳过 {stats['skipped']}，用时 {stats['seconds']} 秒 ({stats['rows_per_second']} 条/秒)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+ADIF解析器微基准：流式分词器 vs 原正则整文件解析
+用法: python benchmarks/adif_parser.py [--records 100000] [--repeat 3]
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from adif import read_adi_records  # noqa: E402
+
+# 原 process_adi_file 使用的正则(补充了 <EOR> 的识别以便对比记录数)
+LEGACY_PATTERN = re.compile(r'<([^>:]+)(?::(\d+))?>([^<]*)', re.IGNORECASE | re.DOTALL)
+
+
+def legacy_read_adi_records(filepath, encoding='utf-8'):
+    with open(filepath, 'r', encoding=encoding) as f:
+        adi_content = f.read()
+    records = []
+    current_record = {}
+    for tag, length, value in LEGACY_PATTERN.findall(adi_content):
+        tag = tag.upper()
+        if tag == 'EOR':
+            if current_record:
+                records.append(current_record)
+                current_record = {}
+        elif length:
+            current_record[tag] = value.strip()[:int(length)]
+    return records
+
+
+def _field(name, value):
+    return f"<{name}:{len(value.encode('utf-8'))}>{value}"
+
+
+def generate_adi(path, count, seed=0):
+    rng = random.Random(seed)
+    bands = [('160m', 1.84), ('80m', 3.573), ('40m', 7.074), ('20m', 14.074), ('15m', 21.074), ('10m', 28.074), ('6m', 50.313)]
+    modes = ['FT8', 'FT8', 'FT8', 'CW', 'SSB', 'FT4', 'RTTY']
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("Benchmark export\n" + _field('ADIF_VER', '3.1.0') + "<EOH>\n")
+        for _ in range(count):
+            band, freq = rng.choice(bands)
+            call = f"B{rng.choice('DGHY')}{rng.randint(0, 9)}{''.join(rng.choices('ABCDEFGHIJKLMNOPQRSTUVWXYZ', k=rng.randint(2, 3)))}"
+            f.write(''.join([
+                _field('CALL', call),
+                _field('QSO_DATE', f"2024{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}"),
+                _field('TIME_ON', f"{rng.randint(0, 23):02d}{rng.randint(0, 59):02d}{rng.randint(0, 59):02d}"),
+                _field('BAND', band),
+                _field('FREQ', f"{freq:.6f}"),
+                _field('MODE', rng.choice(modes)),
+                _field('GRIDSQUARE', f"OM{rng.randint(10, 99)}"),
+                _field('LOTW_QSL_RCVD', rng.choice('YN')),
+            ]) + "<EOR>\n")
+
+
+def measure(func, repeat):
+    # 计时与内存分开测量，tracemalloc 本身会显著拖慢分配密集的代码
+    best = None
+    count = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        count = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return count, best, peak
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--records', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.adi')
+        generate_adi(path, args.records)
+        size_mb = os.path.getsize(path) / 1024 / 1024
+        print(f"{args.records} 条记录, {size_mb:.1f} MB")
+
+        cases = [
+            ('legacy regex', lambda: len(legacy_read_adi_records(path))),
+            ('streaming', lambda: sum(1 for _ in read_adi_records(path))),
+        ]
+        for name, func in cases:
+            count, elapsed, peak = measure(func, args.repeat)
+            print(f"{name:>14}: {count} 条, {elapsed:.3f} 秒, {count / elapsed:,.0f} 条/秒, "
+                  f"峰值内存 {peak / 1024 / 1024:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,401 @@
+"""
+日志接口与导入路径的基准测试
+生成模拟日志(呼号前缀、波段、模式按实际分布加权)写入独立的基准测试数据库，
+通过 Flask 测试客户端调用各接口，输出 p50/p99 延迟、吞吐量和进程峰值内存(JSON)，
+便于在不同提交之间比较
+
+用法: python benchmarks/api_suite.py [--sizes 10000,100000,1000000] [--database qso_log_bench]
+                                    [--requests 200] [--output result.json] [--reuse] [--with-cache]
+                                    [--backend mysql|sqlite]
+数据库连接使用 config.ini 中的 [DB_CONFIG]，数据库名替换为 --database 加日志规模后缀，
+该数据库会被清空重建(--reuse 且记录数一致时复用)；SQLite后端使用 [SQLITE] path 所在目录下的
+同名 .db 文件
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# (前缀, 权重, dxcc, 省份或州列表, 网格前两位)
+PREFIXES = [
+    ('BY', 8, 'BY', ['BJ', 'SH', 'GD', 'ZJ', 'JS', 'SC', 'HB', 'SD'], 'OM'),
+    ('BG', 14, 'BY', ['BJ', 'SH', 'GD', 'ZJ', 'JS', 'SC', 'HB', 'SD'], 'OM'),
+    ('BD', 6, 'BY', ['GD', 'FJ', 'GX', 'HN', 'YN'], 'OL'),
+    ('BH', 5, 'BY', ['BJ', 'TJ', 'HE', 'SX', 'NM'], 'ON'),
+    ('BA', 2, 'BY', ['BJ', 'SH'], 'OM'),
+    ('JA', 10, 'JA', [], 'PM'),
+    ('JH', 4, 'JA', [], 'PM'),
+    ('HL', 3, 'HL', [], 'PM'),
+    ('BV', 2, 'BV', [], 'PL'),
+    ('K', 8, 'K', ['CA', 'TX', 'NY', 'FL', 'WA'], 'EM'),
+    ('W', 8, 'K', ['CA', 'TX', 'NY', 'FL', 'WA'], 'FN'),
+    ('VK', 3, 'VK', [], 'QF'),
+    ('DL', 5, 'DL', [], 'JO'),
+    ('UA', 4, 'UA', [], 'KO'),
+    ('RA', 2, 'UA', [], 'KO'),
+    ('YB', 3, 'YB', [], 'OI'),
+    ('DU', 2, 'DU', [], 'PK'),
+    ('HS', 2, 'HS', [], 'OK'),
+    ('9M', 1, '9M2', [], 'OJ'),
+    ('EA', 2, 'EA', [], 'IN'),
+]
+# (波段, 频率, 权重)
+BANDS = [('160m', 1.840, 1), ('80m', 3.573, 3), ('40m', 7.074, 20), ('30m', 10.136, 6), ('20m', 14.074, 30),
+         ('17m', 18.100, 6), ('15m', 21.074, 14), ('12m', 24.915, 4), ('10m', 28.074, 12), ('6m', 50.313, 4)]
+MODES = [('FT8', 60), ('CW', 14), ('SSB', 14), ('FT4', 8), ('RTTY', 3), ('FM', 1)]
+LETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+class LogbookGenerator:
+    """模拟日志生成器：少数呼号被反复通联(长尾分布)，时间跨度5年"""
+
+    def __init__(self, size, seed=0):
+        self.rng = random.Random(seed)
+        self.seed = seed
+        self.size = size
+        # 不同呼号数约为记录数的1/4
+        self.callsigns = [self._callsign() for _ in range(max(size // 4, 10))]
+        self.start = date(2020, 1, 1)
+
+    def _callsign(self):
+        prefix = self.rng.choices(PREFIXES, weights=[p[1] for p in PREFIXES])[0]
+        suffix = ''.join(self.rng.choices(LETTERS, k=self.rng.choice((2, 3, 3))))
+        return f"{prefix[0]}{self.rng.randint(0, 9)}{suffix}", prefix
+
+    def row(self, callsign=None):
+        rng = self.rng
+        # 偏向前部的下标：排在前面的呼号出现得更频繁，同时覆盖整个呼号池
+        # (100万条记录约有22万个不同呼号)
+        index = int(len(self.callsigns) * rng.random() ** 3)
+        call, prefix = callsign or self.callsigns[index]
+        band, freq, _ = rng.choices(BANDS, weights=[b[2] for b in BANDS])[0]
+        mode = rng.choices(MODES, weights=[m[1] for m in MODES])[0][0]
+        qso_date = self.start + timedelta(days=rng.randrange(5 * 365))
+        confirmed = rng.random() < 0.35
+        return {
+            'callsign': call,
+            'frequency': round(freq + rng.random() * 0.003, 6),
+            'mode': mode,
+            'equipment': rng.choice(('IC-7300', 'FT-991A', 'TS-590SG', None)),
+            'antenna': rng.choice(('Dipole', 'Yagi', 'GP', None)),
+            'power': rng.choice((5, 10, 50, 100)),
+            'date': qso_date.isoformat(),
+            'time': f"{rng.randrange(24):02d}:{rng.randrange(60):02d}",
+            'notes': None,
+            'dxcc': prefix[2],
+            'grid': f"{prefix[4]}{rng.randrange(100):02d}",
+            'province': rng.choice(prefix[3]) if prefix[3] else None,
+            'band': band,
+            'qslcard': rng.choice((0, 0, 0, 1, 2)),
+            'confirmed': 1 if confirmed else 0,
+            'lotw_qsl_rcvd': 'Y' if confirmed else None,
+        }
+
+    def rows(self, count):
+        for _ in range(count):
+            yield self.row()
+
+    def new_callsign(self, i):
+        """不在日志中的呼号，用于新增记录"""
+        prefix = PREFIXES[i % len(PREFIXES)]
+        return f"{prefix[0]}{i % 10}Z{LETTERS[i // 10 % 26]}{LETTERS[i // 260 % 26]}", prefix
+
+
+def percentile(sorted_values, p):
+    """最近秩法百分位数"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def peak_rss_mb():
+    """进程峰值常驻内存(MB)"""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为KB，macOS 为字节
+    return round(usage / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def timed(name, func, iterations, units=1):
+    """
+    重复调用 func 并统计延迟
+    :param units: 每次调用处理的记录数，大于1时吞吐量按记录数/秒计算，否则按请求数/秒
+    """
+    latencies = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        func(i)
+        latencies.append((time.perf_counter() - t0) * 1000)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    result = {
+        'name': name,
+        'iterations': iterations,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'throughput_per_s': round(iterations * units / elapsed, 1) if elapsed > 0 else None,
+        'throughput_unit': 'rows' if units > 1 else 'requests',
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    print(f"  {name}: p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms, "
+          f"{result['throughput_per_s']} {result['throughput_unit']}/s", file=sys.stderr)
+    return result
+
+
+def _check(response, status=200):
+    if response.status_code != status:
+        raise RuntimeError(f"{response.request.path}: HTTP {response.status_code} {response.get_data(as_text=True)[:200]}")
+    return response
+
+
+def prepare_database(database, size, generator, reuse):
+    """创建基准测试数据库、执行迁移并写入模拟日志"""
+    import db_utils
+    from migrations import migrate
+
+    if db_utils.BACKEND == 'sqlite':
+        directory = os.path.dirname(db_utils.sqlite_config['path'])
+        db_utils.sqlite_config['path'] = os.path.join(directory, f"{database}.db")
+    else:
+        import mysql.connector
+
+        server_config = {k: v for k, v in db_utils.db_config.items()
+                         if k in ('host', 'port', 'user', 'password', 'charset')}
+        conn = mysql.connector.connect(**server_config)
+        cursor = conn.cursor()
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{database}` DEFAULT CHARSET utf8mb4")
+        conn.close()
+        db_utils.db_config['database'] = database
+    db_utils.init_db_pool()
+    migrate()
+
+    from db_utils import execute_query, transaction
+    # 记录生成数据时的参数，--reuse 时据此判断能否复用
+    execute_query("""
+        CREATE TABLE IF NOT EXISTS benchmark_info (
+            size INT NOT NULL, seed INT NOT NULL, max_id INT NOT NULL
+        )
+    """)
+    info = execute_query("SELECT size, seed, max_id FROM benchmark_info", fetch=True)
+    columns = list(generator.row())
+    if reuse and info and (info[0]['size'], info[0]['seed']) == (size, generator.seed):
+        print(f"复用已有数据库 {database}", file=sys.stderr)
+        # 上次运行中断时没有删除测试中新增的记录
+        restore_database()
+        # 跳过已用于生成数据的随机数
+        for _ in generator.rows(size):
+            pass
+        return 0.0
+
+    print(f"正在生成 {size} 条模拟日志到 {database} ...", file=sys.stderr)
+    started = time.perf_counter()
+    for table in ('benchmark_info', 'qso_log', 'qso_counts', 'award_dxcc', 'award_province', 'award_grid',
+                  'grid_counts'):
+        execute_query(f"TRUNCATE TABLE {table}")
+    placeholders = "(" + ", ".join(["%s"] * len(columns)) + ")"
+
+    def insert(batch):
+        # 模拟数据中偶尔出现的重复QSO直接忽略
+        with transaction():
+            execute_query(
+                f"INSERT IGNORE INTO qso_log ({', '.join(columns)}) VALUES {', '.join([placeholders] * len(batch))}",
+                [row[c] for row in batch for c in columns]
+            )
+
+    batch = []
+    for row in generator.rows(size):
+        batch.append(row)
+        if len(batch) == 2000:
+            insert(batch)
+            batch = []
+    if batch:
+        insert(batch)
+    max_id = execute_query("SELECT COALESCE(MAX(id), 0) AS max_id FROM qso_log", fetch=True)[0]['max_id']
+    execute_query("INSERT INTO benchmark_info (size, seed, max_id) VALUES (%s, %s, %s)",
+                  (size, generator.seed, max_id))
+    # 统计表随后整体重建
+    import grids
+    import qso_stats
+    qso_stats.rebuild_counts()
+    qso_stats.rebuild_awards()
+    grids.rebuild()
+    return round(time.perf_counter() - started, 1)
+
+
+def restore_database():
+    """删除基准测试过程中新增的记录并重建统计表，使下次 --reuse 的数据相同"""
+    from db_utils import execute_query
+    import grids
+    import qso_stats
+
+    max_id = execute_query("SELECT max_id FROM benchmark_info", fetch=True)[0]['max_id']
+    execute_query("DELETE FROM qso_log WHERE id > %s", (max_id,))
+    qso_stats.rebuild_counts()
+    qso_stats.rebuild_awards()
+    grids.rebuild()
+
+
+def run_suite(size, args):
+    import db_utils
+    import callsign_index
+    import dupe_check
+    import http_cache
+    from flask import Flask
+    from routes import init_routes
+    from adif import iter_adi
+    from adif_export import row_to_adif_record
+    from lotw_handler import LOTWHandler
+
+    generator = LogbookGenerator(size, seed=args.seed)
+    database = f"{args.database}_{size}"
+    load_seconds = prepare_database(database, size, generator, args.reuse)
+    if not args.with_cache:
+        # 测量数据库路径，不使用响应缓存
+        http_cache.CACHE_SIZE = 0
+
+    app = Flask(__name__, template_folder=os.path.join(os.path.dirname(__file__), '..', 'templates'))
+    app.config['SECRET_KEY'] = 'benchmark'
+    app.config['WTF_CSRF_ENABLED'] = False
+    db_utils.init_app(app)
+    init_routes(app)
+    client = app.test_client()
+    rng = random.Random(args.seed)
+    n = args.requests
+    results = []
+
+    # /log/new: 表单提交，每次一个新呼号
+    def new_log(i):
+        row = generator.row(callsign=generator.new_callsign(i))
+        data = {k: v for k, v in row.items() if v is not None and k not in ('confirmed', 'lotw_qsl_rcvd')}
+        # 表单的模式选项中没有RTTY，按其他数字模式提交
+        if data['mode'] == 'RTTY':
+            data['mode'] = 'DIGITAL'
+        _check(client.post('/log/new', data=data), 201)
+    results.append(timed('POST /log/new', new_log, n))
+
+    results.append(timed('GET /api/logs (first page)',
+                         lambda i: _check(client.get('/api/logs?size=25')), n))
+
+    # 游标翻页：从首页连续向后翻
+    cursor = {'next': None}
+
+    def next_page(i):
+        url = '/api/logs?size=25' + (f"&cursor={cursor['next']}" if cursor['next'] else '')
+        cursor['next'] = _check(client.get(url)).get_json()['next']
+    results.append(timed('GET /api/logs (cursor paging)', next_page, n))
+
+    # 兼容的页码分页：随机页
+    pages = max(size // 25, 1)
+    results.append(timed('GET /api/logs?page= (random page)',
+                         lambda i: _check(client.get(f"/api/logs?page={rng.randint(1, pages)}&size=25")),
+                         max(n // 4, 1)))
+
+    results.append(timed('GET /api/logs (filtered)',
+                         lambda i: _check(client.get(f"/api/logs?size=25&band=20m&mode=FT8&callsign=BG{i % 10}")),
+                         n))
+
+    def all_logs(i):
+        response = _check(client.get('/api/logs?all=true&format=ndjson'))
+        for _ in response.response:
+            pass
+        response.close()
+    results.append(timed('GET /api/logs?all=true', all_logs, args.full_repeat, size))
+
+    callsigns = [c for c, _ in generator.callsigns[:1000]]
+    callsign_index.load()
+    results.append(timed('GET /api/history/<callsign>',
+                         lambda i: _check(client.get(f"/api/history/{rng.choice(callsigns)}")), n))
+
+    # 查重索引：构建耗时、查询延迟和内存占用
+    results.append(timed('dupe_check.load', lambda i: dupe_check.load(), 1, size))
+    results.append(timed('GET /api/dupe',
+                         lambda i: _check(client.get(f"/api/dupe?callsign={rng.choice(callsigns)}&band=20m&mode=FT8")),
+                         n))
+    dupe_stats = dupe_check.stats()
+
+    # process_adi_file: 导入一个新记录组成的ADI文件(每批一个事务)
+    import_count = min(size, args.import_records)
+    with tempfile.NamedTemporaryFile('w', suffix='.adi', delete=False, encoding='utf-8') as f:
+        adi_path = f.name
+        for chunk in iter_adi(row_to_adif_record(generator.row(callsign=generator.new_callsign(n + i)))
+                              for i in range(import_count)):
+            f.write(chunk)
+    try:
+        handler = LOTWHandler(os.path.join(os.path.dirname(__file__), '..', 'config.ini'))
+        results.append(timed('process_adi_file', lambda i: handler.process_adi_file(adi_path), 1, import_count))
+    finally:
+        os.unlink(adi_path)
+
+    sample = list(generator.rows(min(size, args.import_records)))
+    results.append(timed('convert_to_adi', lambda i: handler.convert_to_adi(sample), 3, len(sample)))
+
+    restore_database()
+
+    return {'size': size, 'database': database, 'load_seconds': load_seconds, 'results': results,
+            'dupe_index': dupe_stats}
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="日志接口与导入路径基准测试")
+    parser.add_argument('--sizes', default='10000', help="日志规模，逗号分隔，如 10000,100000,1000000")
+    parser.add_argument('--database', default='qso_log_bench', help="基准测试数据库名前缀(会被清空)")
+    parser.add_argument('--requests', type=int, default=200, help="每个接口的请求次数")
+    parser.add_argument('--full-repeat', type=int, default=3, help="all=true 全量获取的次数")
+    parser.add_argument('--import-records', type=int, default=10000, help="导入/转换测试的记录数")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--reuse', action='store_true', help="记录数一致时复用已有的基准测试数据库")
+    parser.add_argument('--with-cache', action='store_true', help="启用响应缓存(默认关闭以测量数据库路径)")
+    parser.add_argument('--output', help="结果JSON文件路径，默认输出到标准输出")
+    parser.add_argument('--backend', choices=('mysql', 'sqlite'), help="存储后端，默认使用 config.ini 中的配置")
+    args = parser.parse_args(argv)
+
+    import db_utils
+    if args.backend:
+        db_utils.BACKEND = args.backend
+
+    report = {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'backend': db_utils.BACKEND,
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'runs': [run_suite(int(size), args) for size in args.sizes.split(',')],
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
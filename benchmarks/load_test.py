@@ -0,0 +1,229 @@
+"""
+多进程部署的吞吐量测试
+用 gunicorn(gunicorn.conf.py + wsgi:app)依次以不同的工作进程数启动服务，多个客户端进程通过HTTP
+持续发送读请求(分页、筛选、呼号历史、查重、统计)，输出每种进程数的吞吐量、p50/p99 延迟和
+相对第一种进程数的加速比(JSON)，便于确认增加工作进程后吞吐量随之提高
+
+用法: python benchmarks/load_test.py [--workers 1,2,4] [--threads 4] [--clients 16] [--duration 10]
+                                     [--size 100000] [--database qso_log_bench] [--reuse] [--with-cache]
+                                     [--backend mysql|sqlite] [--port 8765] [--output result.json]
+基准测试数据库与 api_suite.py 相同(--database 加日志规模后缀)；服务使用临时配置文件(CNHAMLOG_CONFIG)，
+其中数据库、监听地址被替换，LOTW上传和写入队列关闭，默认关闭响应缓存以测量数据库路径
+客户端与服务在同一台机器上时会争用CPU，客户端进程数不宜超过CPU核数
+/log/new 需要表单的CSRF令牌，写入路径的延迟见 api_suite.py
+"""
+
+import argparse
+import configparser
+import http.client
+import json
+import multiprocessing
+import os
+import platform
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, BASE_DIR)
+
+from api_suite import LogbookGenerator, percentile, prepare_database, _git_commit  # noqa: E402
+
+# (权重, 生成请求路径的函数)，参数为 (随机数生成器, 呼号列表, 页数)
+REQUESTS = [
+    (30, lambda rng, calls, pages: f"/api/logs?size=25&page={rng.randint(1, pages)}"),
+    (20, lambda rng, calls, pages: f"/api/logs?size=25&band={rng.choice(['20m', '40m', '15m'])}"
+                                   f"&mode={rng.choice(['FT8', 'CW', 'SSB'])}"),
+    (25, lambda rng, calls, pages: f"/api/history/{rng.choice(calls)}"),
+    (20, lambda rng, calls, pages: f"/api/dupe?callsign={rng.choice(calls)}&band=20m&mode=FT8"),
+    (5, lambda rng, calls, pages: "/api/stats/summary"),
+]
+
+
+def _client(port, callsigns, pages, deadline, measure_from, seed, results):
+    """客户端进程: 一个保持连接，顺序发送请求直到 deadline，只统计 measure_from 之后的请求"""
+    rng = random.Random(seed)
+    weights = [w for w, _ in REQUESTS]
+    builders = [b for _, b in REQUESTS]
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    latencies, errors = [], 0
+    while True:
+        now = time.time()
+        if now >= deadline:
+            break
+        path = rng.choices(builders, weights)[0](rng, callsigns, pages)
+        started = time.perf_counter()
+        try:
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            ok = response.status == 200
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            ok = False
+        if now >= measure_from:
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+    conn.close()
+    results.put((latencies, errors))
+
+
+def _write_config(path, database, port, with_cache):
+    """基准测试用的配置文件: 基准测试数据库，关闭后台线程"""
+    import db_utils
+
+    # 重新读取原始文本，保留未展开的插值语法
+    config = configparser.ConfigParser()
+    with open(db_utils.config_path, encoding='utf-8') as f:
+        config.read_file(f)
+    config.set('DB_CONFIG', 'backend', db_utils.BACKEND)
+    if db_utils.BACKEND == 'sqlite':
+        if not config.has_section('SQLITE'):
+            config.add_section('SQLITE')
+        config.set('SQLITE', 'path', db_utils.sqlite_config['path'])
+    else:
+        config.set('DB_CONFIG', 'database', database)
+    for section, option, value in (('LOTW', 'upload_enabled', 'false'),
+                                   ('WRITE_BEHIND', 'enabled', 'false'),
+                                   ('SERVER', 'bind', f"127.0.0.1:{port}")):
+        if not config.has_section(section):
+            config.add_section(section)
+        config.set(section, option, value)
+    if not with_cache:
+        config.set('SETTINGS', 'response_cache_size', '0')
+    with open(path, 'w', encoding='utf-8') as f:
+        config.write(f)
+
+
+def _wait_ready(port, proc, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"gunicorn 启动失败，退出码 {proc.returncode}")
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/api/logs/count')
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("等待服务启动超时")
+
+
+def run_round(workers, args, config_path, callsigns, pages):
+    """以指定的工作进程数启动服务并施加负载"""
+    env = dict(os.environ, CNHAMLOG_CONFIG=config_path)
+    command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+               '--workers', str(workers), '--threads', str(args.threads), '--log-level', 'warning', 'wsgi:app']
+    proc = subprocess.Popen(command, cwd=BASE_DIR, env=env)
+    try:
+        _wait_ready(args.port, proc)
+        print(f"{workers} 个工作进程: 施加负载 {args.duration} 秒 ({args.clients} 个客户端)", file=sys.stderr)
+        results = multiprocessing.Queue()
+        measure_from = time.time() + args.warmup
+        deadline = measure_from + args.duration
+        clients = [multiprocessing.Process(target=_client,
+                                           args=(args.port, callsigns, pages, deadline, measure_from,
+                                                 args.seed * 1000 + i, results))
+                   for i in range(args.clients)]
+        for client in clients:
+            client.start()
+        collected = [results.get() for _ in clients]
+        for client in clients:
+            client.join()
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(60)
+
+    latencies = sorted(l for latency_list, _ in collected for l in latency_list)
+    errors = sum(e for _, e in collected)
+    result = {
+        'workers': workers,
+        'threads': args.threads,
+        'clients': args.clients,
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / args.duration, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+    }
+    print(f"  {result['throughput_rps']} req/s, p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms, "
+          f"{errors} 个错误", file=sys.stderr)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="多进程部署吞吐量测试")
+    parser.add_argument('--workers', default='1,2,4', help="工作进程数，逗号分隔")
+    parser.add_argument('--threads', type=int, default=4, help="每个工作进程的请求线程数")
+    parser.add_argument('--clients', type=int, default=16, help="客户端进程数(并发请求数)")
+    parser.add_argument('--duration', type=float, default=10, help="每种进程数的统计时长(秒)")
+    parser.add_argument('--warmup', type=float, default=2, help="开始统计前的预热时长(秒)")
+    parser.add_argument('--size', type=int, default=100000, help="日志规模")
+    parser.add_argument('--database', default='qso_log_bench', help="基准测试数据库名前缀(会被清空)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--reuse', action='store_true', help="记录数一致时复用已有的基准测试数据库")
+    parser.add_argument('--with-cache', action='store_true', help="启用响应缓存(默认关闭以测量数据库路径)")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--output', help="结果JSON文件路径，默认输出到标准输出")
+    parser.add_argument('--backend', choices=('mysql', 'sqlite'), help="存储后端，默认使用 config.ini 中的配置")
+    args = parser.parse_args(argv)
+
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        raise SystemExit("需要安装 gunicorn: pip install gunicorn")
+
+    import db_utils
+    if args.backend:
+        db_utils.BACKEND = args.backend
+
+    generator = LogbookGenerator(args.size, seed=args.seed)
+    database = f"{args.database}_{args.size}"
+    load_seconds = prepare_database(database, args.size, generator, args.reuse)
+    # 服务进程各自连接数据库
+    db_utils.close_db_pool()
+    callsigns = [c for c, _ in generator.callsigns[:1000]]
+    pages = max(args.size // 25, 1)
+
+    fd, config_path = tempfile.mkstemp(suffix='.ini')
+    os.close(fd)
+    try:
+        _write_config(config_path, database, args.port, args.with_cache)
+        rounds = [run_round(int(w), args, config_path, callsigns, pages) for w in args.workers.split(',')]
+    finally:
+        os.unlink(config_path)
+
+    base = rounds[0]['throughput_rps'] if rounds and rounds[0]['throughput_rps'] else None
+    for result in rounds:
+        result['speedup'] = round(result['throughput_rps'] / base, 2) if base else None
+
+    report = {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'backend': db_utils.BACKEND,
+        'size': args.size,
+        'database': database,
+        'load_seconds': load_seconds,
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'rounds': rounds,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+呼号索引
+内存中维护按字母排序的呼号列表(用于前缀补全)和呼号历史记录的LRU缓存，
+日志写入的事务提交后由 qso_events 增量更新；
+多进程部署时其他工作进程的写入使日志版本(log_version)变化，使用前发现版本不同时，
+其他进程只新增了记录则按id读取新增记录的呼号增量更新，有修改、删除时重新构建
+"""
+
+import bisect
+import threading
+from collections import OrderedDict
+
+from db_utils import config, execute_query
+import log_version
+
+HISTORY_LIMIT = 10
+HISTORY_CACHE_SIZE = config.getint('SETTINGS', 'history_cache_size', fallback=1024)
+
+_lock = threading.Lock()
+# 同一时间只有一个线程重新构建
+_load_lock = threading.Lock()
+# 排序的呼号列表及每个呼号的通联次数，首次使用时从数据库构建
+_callsigns = None
+_counts = {}
+# 呼号 -> 最近的历史记录
+_history = OrderedDict()
+# 每次写入递增，防止并发写入时把过期的查询结果放入缓存
+_generation = 0
+# 呼号列表对应的日志版本
+_version = None
+
+
+def load():
+    """从数据库构建呼号列表(一次分组查询)，构建期间有写入时重新构建"""
+    global _callsigns, _counts, _version
+    while True:
+        with _lock:
+            generation = _generation
+        version = log_version.current()[0]
+        rows = execute_query("SELECT callsign, COUNT(*) AS count FROM qso_log GROUP BY callsign", fetch=True)
+        counts = {}
+        for row in rows:
+            callsign = (row['callsign'] or '').upper()
+            counts[callsign] = counts.get(callsign, 0) + int(row['count'])
+        with _lock:
+            if generation == _generation:
+                _counts = counts
+                _callsigns = sorted(counts)
+                _history.clear()
+                _version = version
+                return
+
+
+def _stale():
+    return _callsigns is None or _version != log_version.current()[0]
+
+
+def _add_callsign(callsign, delta):
+    count = _counts.get(callsign, 0) + delta
+    if count > 0:
+        if callsign not in _counts:
+            bisect.insort(_callsigns, callsign)
+        _counts[callsign] = count
+    elif callsign in _counts:
+        del _counts[callsign]
+        del _callsigns[bisect.bisect_left(_callsigns, callsign)]
+
+
+def _refresh():
+    """
+    按其他进程的变更记录增量更新呼号列表
+    :return: 是否已更新；无法增量更新时返回 False，需要重新构建
+    """
+    global _version
+    with _lock:
+        version = _version
+    current, ids = log_version.changes_since(version)
+    if ids is None:
+        return False
+    rows = []
+    for start in range(0, len(ids), 1000):
+        chunk = ids[start:start + 1000]
+        rows.extend(execute_query(
+            f"SELECT callsign FROM qso_log WHERE id IN ({', '.join(['%s'] * len(chunk))})", chunk, fetch=True))
+    with _lock:
+        # 读取期间本进程写入过，变更的先后无法确定
+        if _version != version:
+            return False
+        for row in rows:
+            callsign = (row['callsign'] or '').upper()
+            _history.pop(callsign, None)
+            _add_callsign(callsign, 1)
+        _version = current
+    return True
+
+
+def _ensure_loaded():
+    if _stale():
+        with _load_lock:
+            # 等待期间其他线程可能已经重新构建
+            if _stale() and (_callsigns is None or not _refresh()):
+                load()
+
+
+def advance_version(previous, version):
+    """本进程写入后日志版本由 previous 变为 version，呼号列表已增量更新，直接对应新版本"""
+    global _version
+    with _lock:
+        if _callsigns is not None and _version == previous:
+            _version = version
+
+
+def suggest(prefix, limit=10):
+    """
+    前缀补全
+    :return: [{'callsign': 呼号, 'count': 通联次数}, ...]，按字母顺序
+    """
+    _ensure_loaded()
+    prefix = prefix.upper()
+    result = []
+    with _lock:
+        i = bisect.bisect_left(_callsigns, prefix)
+        while i < len(_callsigns) and len(result) < limit and _callsigns[i].startswith(prefix):
+            result.append({'callsign': _callsigns[i], 'count': _counts[_callsigns[i]]})
+            i += 1
+    return result
+
+
+def get_history(callsign):
+    """呼号最近的通联记录，优先读取缓存；从未通联过的呼号不访问数据库"""
+    _ensure_loaded()
+    callsign = callsign.upper()
+    with _lock:
+        if callsign not in _counts:
+            return []
+        if callsign in _history:
+            _history.move_to_end(callsign)
+            return _history[callsign]
+        generation = _generation
+
+    rows = execute_query("""
+        SELECT date, time, frequency, mode
+        FROM qso_log
+        WHERE callsign = %s
+        ORDER BY qso_datetime_utc DESC, id DESC
+        LIMIT %s
+    """, (callsign, HISTORY_LIMIT), fetch=True)
+
+    with _lock:
+        if generation == _generation:
+            _history[callsign] = rows
+            if len(_history) > HISTORY_CACHE_SIZE:
+                _history.popitem(last=False)
+    return rows
+
+
+def apply_changes(removed, added):
+    """按变更前后的行更新呼号列表并清除相关呼号的历史缓存，在事务提交后调用"""
+    global _generation, _version
+    with _lock:
+        _generation += 1
+        if _callsigns is not None and removed and _stale():
+            # 修改、删除的行可能是其他进程新增而列表中还没有的，下次使用时重新构建
+            _version = None
+        for rows, delta in ((removed, -1), (added, 1)):
+            for row in rows:
+                callsign = (row.get('callsign') or '').upper()
+                _history.pop(callsign, None)
+                if _callsigns is not None and _version is not None:
+                    _add_callsign(callsign, delta)
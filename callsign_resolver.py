@@ -0,0 +1,348 @@
+"""
+呼号解析
+按前缀表把呼号解析为DXCC实体(编号、名称、大洲、CQ/ITU分区)，中国呼号再按分区数字和后缀首字母得到省份
+
+前缀表为 cty.dat 格式(默认 data/cty.dat，精简版，可替换为 country-files.com 发布的完整文件)，
+载入后构建前缀树按最长前缀匹配，"=" 开头的条目为完整呼号例外；
+cty.dat 不含DXCC编号，编号按主前缀从 data/dxcc_codes.csv 中查找
+
+精简的前缀表缺少大量实体，最长前缀可能退回到上级国家(如 KH2 匹配到 K、VK9X 匹配到 VK)，
+因此结果中的 exact 表示匹配是否可信: 匹配的前缀覆盖呼号前缀直到分区数字(如 BS7H 匹配 BS7)，
+或前缀表完整(实体数不少于 COMPLETE_ENTITY_COUNT)且路径上没有更长的前缀；enrich 只在可信时填写 dxcc
+
+单个查询有LRU缓存(表单输入时逐字查询)；resolve_many / enrich 用于ADIF导入和存量日志补全
+
+命令行用法:
+    python callsign_resolver.py BG1ABC JA1XYZ   (解析呼号)
+    python callsign_resolver.py backfill         (补全 qso_log 中为空的 dxcc、province)
+"""
+
+import csv
+import functools
+import os
+import re
+import threading
+
+from db_utils import config, transaction
+import qso_events
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CTY_FILE = os.path.join(_BASE_DIR, config.get('SETTINGS', 'cty_file', fallback=os.path.join('data', 'cty.dat')))
+DXCC_CODES_FILE = os.path.join(_BASE_DIR, 'data', 'dxcc_codes.csv')
+CACHE_SIZE = config.getint('SETTINGS', 'callsign_cache_size', fallback=4096)
+# 完整的 cty.dat 约有340个DXCC实体，实体数少于该值时视为精简版
+COMPLETE_ENTITY_COUNT = 300
+
+# 不影响所属实体的后缀: 便携、移动、QRP 等
+_IGNORED_SUFFIXES = {'P', 'M', 'A', 'QRP', 'LH', 'R'}
+# 水上/航空移动不属于任何DXCC实体
+_NO_ENTITY_SUFFIXES = {'MM', 'AM'}
+
+# 别名中的修饰: (CQ分区) [ITU分区] <纬度/经度> {大洲} ~时区~
+_ALIAS = re.compile(r'(=?)([A-Z0-9/]+)(.*)')
+_MODIFIERS = re.compile(r'\((\d+)\)|\[(\d+)\]|<([^>]*)>|\{(\w+)\}|~([^~]*)~')
+
+# 中国呼号分区数字 -> [(后缀首字母范围, 省份)]
+CHINA_PROVINCES = {
+    '1': [('A', 'X', '北京')],
+    '2': [('A', 'H', '黑龙江'), ('I', 'P', '吉林'), ('Q', 'X', '辽宁')],
+    '3': [('A', 'F', '天津'), ('G', 'L', '内蒙古'), ('M', 'R', '河北'), ('S', 'X', '山西')],
+    '4': [('A', 'H', '上海'), ('I', 'P', '山东'), ('Q', 'X', '江苏')],
+    '5': [('A', 'H', '浙江'), ('I', 'P', '江西'), ('Q', 'X', '福建')],
+    '6': [('A', 'H', '安徽'), ('I', 'P', '河南'), ('Q', 'X', '湖北')],
+    '7': [('A', 'H', '湖南'), ('I', 'P', '广东'), ('Q', 'X', '广西'), ('Y', 'Z', '海南')],
+    '8': [('A', 'F', '四川'), ('G', 'L', '重庆'), ('M', 'R', '贵州'), ('S', 'X', '云南')],
+    '9': [('A', 'F', '陕西'), ('G', 'L', '甘肃'), ('M', 'R', '宁夏'), ('S', 'X', '青海')],
+    '0': [('A', 'F', '新疆'), ('G', 'L', '西藏')],
+}
+CHINA_PREFIX = 'BY'
+_CHINA_CALL = re.compile(r'B[A-Z]?(\d)([A-Z])')
+# 呼号前缀(直到分区数字): BG1ABC -> BG1，9M2AB -> 9M2，E21ABC -> E2
+_CALL_PREFIX = re.compile(r'\d?[A-Z]+\d')
+
+
+class _PrefixTrie:
+    """前缀树，每个节点是 字符 -> 子节点 的字典，键 None 保存以该节点结尾的前缀对应的实体"""
+
+    __slots__ = ('root',)
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, prefix, entity):
+        node = self.root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[None] = entity
+
+    def longest_match(self, callsign):
+        """
+        :return: (实体, 匹配的前缀长度, 沿树走过的长度)；走过的长度大于匹配长度时，
+                 路径上有更长的前缀(属于其他实体)而呼号不在其中
+        """
+        node, best, matched, walked = self.root, None, 0, 0
+        for char in callsign:
+            node = node.get(char)
+            if node is None:
+                break
+            walked += 1
+            if None in node:
+                best, matched = node[None], walked
+        return best, matched, walked
+
+
+def _load_dxcc_codes(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8', newline='') as f:
+        return {row['prefix'].strip().upper(): int(row['dxcc']) for row in csv.DictReader(f)}
+
+
+def _apply_modifiers(entity, text):
+    """别名后的修饰覆盖实体的分区、坐标、大洲、时区"""
+    if not text:
+        return entity
+    entity = dict(entity)
+    for cq, itu, latlon, continent, offset in _MODIFIERS.findall(text):
+        if cq:
+            entity['cq_zone'] = int(cq)
+        elif itu:
+            entity['itu_zone'] = int(itu)
+        elif latlon:
+            lat, _, lon = latlon.partition('/')
+            entity['lat'], entity['lon'] = float(lat), 0.0 - float(lon)
+        elif continent:
+            entity['continent'] = continent
+        elif offset:
+            entity['utc_offset'] = 0.0 - float(offset)
+    return entity
+
+
+def parse_cty(text, dxcc_codes=None):
+    """
+    解析 cty.dat 格式的前缀表
+    :return: (前缀树, 完整呼号例外字典, 实体数)
+    """
+    dxcc_codes = dxcc_codes or {}
+    trie, exact, count = _PrefixTrie(), {}, 0
+    for record in text.split(';'):
+        parts = record.strip().split(':', 8)
+        if len(parts) < 9:
+            continue
+        name, cq, itu, continent, lat, lon, offset, prefix, aliases = (p.strip() for p in parts)
+        # "*" 开头的只属于WAE，呼号按所在的DXCC实体解析
+        if prefix.startswith('*'):
+            continue
+        entity = {
+            'entity': name,
+            'prefix': prefix,
+            'dxcc': dxcc_codes.get(prefix.upper()),
+            'continent': continent,
+            'cq_zone': int(cq),
+            'itu_zone': int(itu),
+            # cty.dat 中西经、东时区为正
+            'lat': float(lat),
+            'lon': 0.0 - float(lon),
+            'utc_offset': 0.0 - float(offset),
+        }
+        count += 1
+        for alias in aliases.replace('\n', '').split(','):
+            match = _ALIAS.match(alias.strip().upper())
+            if not match:
+                continue
+            is_exact, call, modifiers = match.groups()
+            target = _apply_modifiers(entity, modifiers)
+            if is_exact:
+                exact[call] = target
+            else:
+                trie.add(call, target)
+    return trie, exact, count
+
+
+_lock = threading.Lock()
+# (前缀树, 完整呼号例外, 是否为完整前缀表)，首次使用时载入
+_table = None
+
+
+def load(path=None):
+    """
+    载入前缀表(修改前缀文件后调用以重新载入)
+    :return: 前缀表中的实体数
+    """
+    global _table
+    with open(path or CTY_FILE, encoding='utf-8', errors='replace') as f:
+        text = f.read()
+    trie, exact, count = parse_cty(text, _load_dxcc_codes(DXCC_CODES_FILE))
+    with _lock:
+        _table = (trie, exact, count >= COMPLETE_ENTITY_COUNT)
+        _resolve.cache_clear()
+    return count
+
+
+def _ensure_loaded():
+    if _table is None:
+        load()
+
+
+def _split_callsign(callsign):
+    """
+    拆分带 "/" 的呼号
+    :return: (用于匹配前缀的部分, 本地呼号, 是否在其他分区便携)；水上/航空移动返回 None
+    """
+    parts = [p for p in callsign.split('/') if p]
+    if any(p in _NO_ENTITY_SUFFIXES for p in parts[1:]):
+        return None
+    parts = [parts[0]] + [p for p in parts[1:] if p not in _IGNORED_SUFFIXES] if parts else []
+    if not parts:
+        return None
+    if len(parts) == 1:
+        return parts[0], parts[0], False
+    home, other = parts[0], parts[1]
+    if len(other) == 1 and other.isdigit():
+        # BG1ABC/5: 按第5区匹配前缀
+        area = re.sub(r'\d', other, home, count=1) if re.search(r'\d', home) else home + other
+        return area, home, True
+    # VR2/BG1ABC 或 BG1ABC/VR2: 较短的部分为前缀
+    if len(other) < len(home):
+        return other, home, True
+    return home, other, True
+
+
+def _china_province(callsign):
+    match = _CHINA_CALL.match(callsign)
+    if not match:
+        return None
+    digit, letter = match.groups()
+    for start, end, province in CHINA_PROVINCES.get(digit, ()):
+        if start <= letter <= end:
+            return province
+    return None
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _resolve(callsign):
+    trie, exact, complete = _table
+    entity = exact.get(callsign)
+    split = _split_callsign(callsign)
+    trusted = entity is not None
+    if entity is None:
+        if split is None:
+            return None
+        prefix_part, home, _ = split
+        entity = exact.get(home) if prefix_part == home else None
+        trusted = entity is not None
+        if entity is None:
+            entity, matched, walked = trie.longest_match(prefix_part)
+            call_prefix = _CALL_PREFIX.match(prefix_part)
+            trusted = ((call_prefix is not None and matched >= call_prefix.end())
+                       or (complete and matched == walked))
+    if entity is None:
+        return None
+    result = dict(entity, callsign=callsign, province=None, exact=trusted)
+    # 在其他分区或境外便携时无法由呼号得到省份
+    if entity['prefix'] == CHINA_PREFIX and split is not None and not split[2]:
+        result['province'] = _china_province(split[1])
+    return result
+
+
+def normalize(callsign):
+    return (callsign or '').strip().upper()
+
+
+def resolve(callsign):
+    """
+    解析单个呼号
+    :return: {'callsign', 'entity', 'prefix', 'dxcc'(编号，未知时为None), 'continent', 'cq_zone', 'itu_zone',
+              'lat', 'lon', 'utc_offset', 'province'(中国省份，其他为None),
+              'exact'(匹配是否可信，见模块说明)}；无法解析时返回 None
+    """
+    callsign = normalize(callsign)
+    if not callsign:
+        return None
+    _ensure_loaded()
+    result = _resolve(callsign)
+    return dict(result) if result else None
+
+
+def resolve_many(callsigns):
+    """批量解析，返回与输入顺序对应的结果列表(结果字典为缓存中的对象，不要修改)，重复的呼号只解析一次"""
+    _ensure_loaded()
+    results = {}
+    output = []
+    for callsign in callsigns:
+        callsign = normalize(callsign)
+        if callsign not in results:
+            results[callsign] = _resolve(callsign) if callsign else None
+        output.append(results[callsign])
+    return output
+
+
+def enrich(rows):
+    """
+    为 dxcc、province 为空的日志行填入解析结果(直接修改传入的行字典)；
+    dxcc 只在匹配可信(exact)时填写，不会填入退回到上级国家的结果
+    :return: 修改的行数
+    """
+    pending = [row for row in rows if not row.get('dxcc') or not row.get('province')]
+    changed = 0
+    for row, result in zip(pending, resolve_many(row.get('callsign') for row in pending)):
+        if result is None:
+            continue
+        updated = False
+        if not row.get('dxcc') and result['dxcc'] is not None and result['exact']:
+            row['dxcc'] = str(result['dxcc'])
+            updated = True
+        if not row.get('province') and result['province']:
+            row['province'] = result['province']
+            updated = True
+        changed += updated
+    return changed
+
+
+def backfill(batch_size=1000):
+    """
+    补全 qso_log 中 dxcc、province 为空的记录，按 id 分批，每批一个事务
+    :return: {'scanned': 检查的记录数, 'updated': 补全的记录数}
+    """
+    stats = {'scanned': 0, 'updated': 0}
+    last_id = 0
+    while True:
+        with transaction() as cursor:
+            cursor.execute("""
+                SELECT * FROM qso_log
+                WHERE id > %s AND (dxcc IS NULL OR dxcc = '' OR province IS NULL OR province = '')
+                ORDER BY id LIMIT %s FOR UPDATE
+            """, (last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                return stats
+            last_id = rows[-1]['id']
+            stats['scanned'] += len(rows)
+            added = [dict(row) for row in rows]
+            enrich(added)
+            changes = [(old, new) for old, new in zip(rows, added) if old != new]
+            if not changes:
+                continue
+            cases = " ".join(["WHEN %s THEN %s"] * len(changes))
+            ids = [new['id'] for _, new in changes]
+            cursor.execute(f"""
+                UPDATE qso_log SET dxcc = CASE id {cases} END, province = CASE id {cases} END
+                WHERE id IN ({", ".join(["%s"] * len(changes))})
+            """, [v for _, new in changes for v in (new['id'], new['dxcc'])]
+                 + [v for _, new in changes for v in (new['id'], new['province'])] + ids)
+            qso_events.publish(removed=[old for old, _ in changes], added=[new for _, new in changes])
+            stats['updated'] += len(changes)
+
+
+if __name__ == '__main__':
+    import sys
+    from db_utils import init_db_pool
+
+    if sys.argv[1:] == ['backfill']:
+        init_db_pool()
+        print(f"补全完成: {backfill()}")
+    elif sys.argv[1:]:
+        for callsign, result in zip(sys.argv[1:], resolve_many(sys.argv[1:])):
+            print(callsign, result)
+    else:
+        raise SystemExit("用法: python callsign_resolver.py <呼号>... | backfill")
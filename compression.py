@@ -0,0 +1,126 @@
+"""
+响应压缩
+按请求的 Accept-Encoding 压缩 JSON、NDJSON、ADIF 等文本响应: 安装 brotli 时优先使用 br，否则使用 gzip。
+流式响应(全量获取、ADIF导出)逐块压缩并立即输出，不等待整个响应生成；
+小于 min_size 的响应不压缩。压缩后 ETag 改为弱校验(同一版本的不同编码内容不同)
+
+由 init_app 注册为请求钩子，配置见 config.ini 的 [COMPRESSION]；前面有反向代理负责压缩时可关闭
+"""
+
+import zlib
+
+from flask import request
+
+from db_utils import config
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ENABLED = config.getboolean('COMPRESSION', 'enabled', fallback=True)
+MIN_SIZE = config.getint('COMPRESSION', 'min_size', fallback=1024)
+GZIP_LEVEL = config.getint('COMPRESSION', 'gzip_level', fallback=6)
+BROTLI_QUALITY = config.getint('COMPRESSION', 'brotli_quality', fallback=4)
+
+COMPRESSIBLE_TYPES = {
+    'application/json', 'application/x-ndjson', 'application/x-arrl-adif', 'application/javascript',
+}
+
+
+class _GzipCompressor:
+    def __init__(self):
+        # wbits 31: gzip 文件头
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        """输出已压缩的数据(流式响应每块之后调用)"""
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _BrotliCompressor:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+ENCODERS = {'gzip': _GzipCompressor}
+if brotli is not None:
+    ENCODERS['br'] = _BrotliCompressor
+# 质量相同时优先 br
+PREFERENCE = [e for e in ('br', 'gzip') if e in ENCODERS]
+
+
+def choose_encoding():
+    """按请求的 Accept-Encoding 选择编码，不接受压缩时返回 None"""
+    return request.accept_encodings.best_match(PREFERENCE)
+
+
+def _compressible(response):
+    # 静态文件(direct_passthrough)可能是范围请求，不压缩
+    return (
+        response.status_code == 200 and not response.direct_passthrough
+        and 'Content-Encoding' not in response.headers
+        and (response.mimetype.startswith('text/') or response.mimetype in COMPRESSIBLE_TYPES)
+    )
+
+
+def _stream(chunks, compressor):
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = compressor.compress(chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    finally:
+        # 客户端断开时结束原生成器(归还流式读取占用的连接)
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+def compress_response(response):
+    """after_request 钩子: 按 Accept-Encoding 压缩响应"""
+    if not _compressible(response):
+        return response
+    # 不论是否压缩，缓存都要区分 Accept-Encoding
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding()
+    if encoding is None:
+        return response
+    compressor = ENCODERS[encoding]()
+    if response.is_streamed:
+        response.response = _stream(response.response, compressor)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < MIN_SIZE:
+            return response
+        response.set_data(compressor.compress(body) + compressor.finish())
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app):
+    """注册压缩钩子([COMPRESSION] enabled = false 时不注册)"""
+    if ENABLED:
+        app.after_request(compress_response)
@@ -1,14 +1,20 @@
 
 import mysql.connector
 from mysql.connector import pooling
+from contextlib import contextmanager
+from flask import g, has_app_context
 import threading
+import time
 import traceback
 import configparser
+import logging
 import os
+import metrics
+import sqlite_backend
 
-# 读取配置文件(显式指定UTF-8编码)
+# 读取配置文件(显式指定UTF-8编码)，环境变量 CNHAMLOG_CONFIG 可指定其他配置文件
 config = configparser.ConfigParser()
-config_path = os.path.join(os.path.dirname(__file__), 'config.ini')
+config_path = os.environ.get('CNHAMLOG_CONFIG') or os.path.join(os.path.dirname(__file__), 'config.ini')
 with open(config_path, 'r', encoding='utf-8') as f:
     config.read_file(f)
 
@@ -24,13 +30,50 @@ db_config = {
     "pool_name": config.get('DB_CONFIG', 'pool_name', fallback='qso_pool'),
     "pool_reset_session": config.getboolean('DB_CONFIG', 'pool_reset_session', fallback=True)
 }
+# 连接池耗尽时等待空闲连接的最长时间(秒)
+pool_timeout = config.getfloat('DB_CONFIG', 'pool_timeout', fallback=10)
+
+# 存储后端: mysql 或 sqlite(不需要数据库服务器，见 sqlite_backend.py)
+BACKEND = config.get('DB_CONFIG', 'backend', fallback='mysql').strip().lower()
+sqlite_config = {
+    # 相对路径相对于程序目录
+    "path": os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         config.get('SQLITE', 'path', fallback=os.path.join('instance', 'qso_log.db'))),
+    "pool_size": db_config["pool_size"],
+    "synchronous": config.get('SQLITE', 'synchronous', fallback='NORMAL'),
+    "cache_size_mb": config.getint('SQLITE', 'cache_size_mb', fallback=64),
+    "mmap_size_mb": config.getint('SQLITE', 'mmap_size_mb', fallback=256),
+    "busy_timeout": config.getfloat('SQLITE', 'busy_timeout', fallback=10),
+    "statement_cache_size": config.getint('SQLITE', 'statement_cache_size', fallback=256)
+}
+
+# 超过该耗时(毫秒)的SQL语句记入慢查询日志，0 为不记录
+slow_query_seconds = config.getfloat('METRICS', 'slow_query_ms', fallback=200) / 1000
+slow_query_logger = logging.getLogger('slow_query')
+
+# 两种后端的数据库异常(都带有 errno 和 msg 属性)和连接池耗尽异常
+DatabaseError = (mysql.connector.Error, sqlite_backend.Error)
+PoolError = (pooling.PoolError, sqlite_backend.PoolError)
+# 数据本身的错误(违反约束、MySQL严格模式下值过长等)，与连接中断等不同，重试也不会成功
+DataError = (mysql.connector.errors.IntegrityError, mysql.connector.errors.DataError, sqlite_backend.DataError)
 
 # 全局连接池
 db_pool = None
 db_local = threading.local()
 
-def init_db_pool():
+def init_db_pool(pool_size=None):
+    """
+    按 [DB_CONFIG] backend 初始化连接池，两种后端的连接提供相同的接口
+    (get_connection / cursor(dictionary=True) / commit / rollback / in_transaction)
+    :param pool_size: 连接数，默认为 [DB_CONFIG] pool_size(多进程部署时按进程的线程数计算，见 server.py)
+    """
     global db_pool
+    if pool_size:
+        db_config["pool_size"] = sqlite_config["pool_size"] = pool_size
+    if BACKEND == 'sqlite':
+        return _init_sqlite_pool()
+    if BACKEND != 'mysql':
+        raise SystemExit(f"不支持的数据库后端: {BACKEND}，可选 mysql、sqlite")
     print("正在使用的数据库配置：")
     print(f"Host: {db_config['host']}")
     print(f"Port: {db_config['port']}")
@@ -50,69 +93,275 @@ def init_db_pool():
         print(traceback.format_exc())
         raise SystemExit("无法初始化数据库连接池")
 
-def get_db_connection():
+def _init_sqlite_pool():
+    global db_pool
+    print("正在使用的数据库配置：")
+    print(f"SQLite: {sqlite_config['path']}")
+
+    try:
+        db_pool = sqlite_backend.SQLiteConnectionPool(**sqlite_config)
+        print("SQLite连接池初始化成功")
+        return True
+    except Exception as e:
+        print(f"SQLite数据库打开失败: {str(e)}")
+        print(traceback.format_exc())
+        raise SystemExit("无法打开SQLite数据库，请检查 [SQLITE] path 配置")
+
+def close_db_pool():
+    """
+    关闭连接池中的空闲连接并丢弃连接池
+    gunicorn 主进程在 fork 工作进程之前调用，子进程不能继续使用父进程建立的连接
+    """
+    global db_pool
+    if db_pool is None:
+        return
+    if BACKEND == 'sqlite':
+        db_pool.close()
+    else:
+        db_pool._remove_connections()
+    db_pool = None
+
+def prime_pool():
+    """
+    取出连接池中的全部连接各执行一次查询(断开的连接在此重连)，工作进程接收请求前调用
+    :return: 可用的连接数
+    """
+    conns = []
+    try:
+        while True:
+            try:
+                conns.append(db_pool.get_connection())
+            except PoolError:
+                break
+        for conn in conns:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+    finally:
+        for conn in conns:
+            conn.close()
+    return len(conns)
+
+# 连接池统计
+pool_stats = {
+    "checkouts": 0,          # 取出连接次数
+    "wait_seconds": 0.0,     # 取连接累计耗时
+    "max_wait_seconds": 0.0, # 取连接最大耗时
+    "exhausted": 0,          # 取连接时连接池已耗尽的次数
+    "timeouts": 0,           # 等待超时次数
+    "in_use": 0              # 当前借出的连接数
+}
+_pool_stats_lock = threading.Lock()
+metrics.Callback("cnhamlog_db_pool_in_use", "当前借出的连接数", lambda: pool_stats["in_use"])
+metrics.Callback("cnhamlog_db_pool_exhausted_total", "取连接时连接池已耗尽的次数",
+                 lambda: pool_stats["exhausted"], type="counter")
+metrics.Callback("cnhamlog_db_pool_timeouts_total", "等待空闲连接超时次数",
+                 lambda: pool_stats["timeouts"], type="counter")
+
+def _checkout():
+    """从连接池取出连接，连接池耗尽时等待最多 pool_timeout 秒"""
     if db_pool is None:
         raise RuntimeError("数据库连接池未初始化")
-    if not hasattr(db_local, 'conn'):
-        db_local.conn = db_pool.get_connection()
-    return db_local.conn
+    started = time.perf_counter()
+    exhausted = False
+    while True:
+        try:
+            conn = db_pool.get_connection()
+            break
+        except PoolError:
+            if not exhausted:
+                exhausted = True
+                with _pool_stats_lock:
+                    pool_stats["exhausted"] += 1
+            if time.perf_counter() - started >= pool_timeout:
+                with _pool_stats_lock:
+                    pool_stats["timeouts"] += 1
+                raise
+            time.sleep(0.005)
+    waited = time.perf_counter() - started
+    metrics.db_pool_wait_seconds.observe(waited)
+    with _pool_stats_lock:
+        pool_stats["checkouts"] += 1
+        pool_stats["in_use"] += 1
+        pool_stats["wait_seconds"] += waited
+        pool_stats["max_wait_seconds"] = max(pool_stats["max_wait_seconds"], waited)
+    return conn
+
+def _release(conn):
+    """归还连接到连接池"""
+    try:
+        conn.close()
+    finally:
+        with _pool_stats_lock:
+            pool_stats["in_use"] -= 1
+
+def get_pool_stats():
+    """返回连接池统计信息的快照"""
+    with _pool_stats_lock:
+        stats = dict(pool_stats)
+    stats["backend"] = BACKEND
+    stats["pool_size"] = db_config["pool_size"]
+    stats["avg_wait_seconds"] = stats["wait_seconds"] / stats["checkouts"] if stats["checkouts"] else 0.0
+    return stats
+
+def _observe_query(query, params, seconds):
+    """记录SQL耗时(按归一化语句)，超过 slow_query_ms 时写慢查询日志"""
+    statement = metrics.normalize_sql(query)
+    operation = statement.split(' ', 1)[0].lower()
+    metrics.db_query_seconds.observe(seconds, operation=operation)
+    metrics.db_statement_seconds.inc(seconds, statement=statement)
+    metrics.db_statement_calls.inc(statement=statement)
+    if has_app_context():
+        g.db_seconds = g.get('db_seconds', 0.0) + seconds
+        g.db_queries = g.get('db_queries', 0) + 1
+    if slow_query_seconds and seconds >= slow_query_seconds:
+        metrics.db_slow_queries.inc(operation=operation)
+        slow_query_logger.warning(f"慢查询 {seconds * 1000:.1f} ms, {len(params or ())} 个参数: {statement}")
+
+class _TimedCursor:
+    """transaction() 返回的游标，统计 execute 耗时，其余属性转给原游标"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, query, params=None):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(query, params or ())
+        finally:
+            _observe_query(query, params, time.perf_counter() - started)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+def _scope():
+    """
+    当前连接的存放位置：Flask应用上下文内为 g (同一请求的所有语句共用一个连接，
+    在 teardown_appcontext 中归还)，否则为线程局部变量(每条语句结束后归还)
+    """
+    return g if has_app_context() else db_local
+
+def init_app(app):
+    """注册请求结束时归还连接"""
+    app.teardown_appcontext(close_db_connection)
+
+def get_db_connection():
+    scope = _scope()
+    if getattr(scope, 'db_conn', None) is None:
+        scope.db_conn = _checkout()
+    return scope.db_conn
 
 def close_db_connection(exception=None):
-    if hasattr(db_local, 'conn'):
-        db_local.conn.close()
-        del db_local.conn
+    scope = _scope()
+    conn = getattr(scope, 'db_conn', None)
+    if conn is not None:
+        scope.db_conn = None
+        # 未开启 pool_reset_session 时需自行结束请求内遗留的事务
+        if not db_config["pool_reset_session"] and conn.in_transaction:
+            conn.rollback()
+        _release(conn)
+
+def _in_transaction(scope):
+    return getattr(scope, 'db_tx_depth', 0) > 0
+
+@contextmanager
+def transaction():
+    """
+    事务上下文，块内的 execute_query 与返回的游标共用同一个连接，块结束时统一提交，
+    出现异常则回滚；可以嵌套，内层并入最外层事务
+    用法:
+        with transaction() as cursor:
+            cursor.execute(...)
+            execute_query(...)
+    """
+    scope = _scope()
+    conn = get_db_connection()
+    depth = getattr(scope, 'db_tx_depth', 0)
+    if depth == 0:
+        # 结束请求内之前的只读事务，使本事务读到最新数据
+        if conn.in_transaction:
+            conn.commit()
+        scope.db_on_commit = []
+    scope.db_tx_depth = depth + 1
+    cursor = conn.cursor(dictionary=True)
+    committed = False
+    try:
+        yield _TimedCursor(cursor)
+        if depth == 0:
+            conn.commit()
+            committed = True
+    except Exception:
+        if depth == 0:
+            conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        scope.db_tx_depth = depth
+        if depth == 0:
+            callbacks, scope.db_on_commit = scope.db_on_commit, []
+            if scope is db_local:
+                close_db_connection()
+    if committed:
+        for callback in callbacks:
+            callback()
+
+def on_commit(callback):
+    """在当前事务提交后执行回调(用于刷新内存缓存等)，不在事务中时立即执行"""
+    scope = _scope()
+    if _in_transaction(scope):
+        scope.db_on_commit.append(callback)
+    else:
+        callback()
 
 def execute_query(query, params=None, fetch=False):
+    scope = _scope()
+    in_transaction = _in_transaction(scope)
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
+    started = time.perf_counter()
     try:
         cursor.execute(query, params or ())
-        if fetch:
-            result = cursor.fetchall()
-        else:
-            conn.commit()
+        result = cursor.fetchall() if fetch else None
+        _observe_query(query, params, time.perf_counter() - started)
+        if not fetch:
+            if not in_transaction:
+                conn.commit()
             result = cursor.lastrowid
         return result
     except Exception as e:
-        conn.rollback()
+        if not in_transaction:
+            conn.rollback()
         raise
     finally:
         cursor.close()
-        close_db_connection()
+        if scope is db_local and not in_transaction:
+            close_db_connection()
 
-def check_column_exists(table_name, column_name):
-    """检查表中是否已存在指定列"""
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
+def stream_query(query, params=None, batch_size=500):
+    """
+    使用非缓冲游标逐批读取大结果集，内存占用与结果集大小无关
+    独占一个连接池连接(不与线程内的 execute_query 共用)，生成器结束时归还
+    :return: 生成器，每次产出不超过 batch_size 行的字典列表
+    """
+    conn = _checkout()
+    cursor = conn.cursor(dictionary=True, buffered=False)
     try:
-        cursor.execute(f"""
-            SELECT COUNT(*) AS count 
-            FROM INFORMATION_SCHEMA.COLUMNS 
-            WHERE TABLE_SCHEMA = DATABASE() 
-            AND TABLE_NAME = '{table_name}' 
-            AND COLUMN_NAME = '{column_name}'
-        """)
-        return cursor.fetchone()['count'] > 0
+        # 只统计到开始返回结果，不包含调用方处理各批次的时间
+        started = time.perf_counter()
+        cursor.execute(query, params or ())
+        _observe_query(query, params, time.perf_counter() - started)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
     finally:
+        # 客户端提前断开时丢弃未读取的结果，否则连接无法归还连接池
+        if conn.unread_result:
+            conn.consume_results()
         cursor.close()
-        close_db_connection()
-
-def alter_table_add_columns():
-    """安全地添加表列(仅添加不存在的列)"""
-    columns_to_add = [
-        ('dxcc', 'VARCHAR(10)'),
-        ('grid', 'VARCHAR(10)'),
-        ('province', 'VARCHAR(20)'),
-        ('band', 'VARCHAR(10)'),
-        ('qslcard', 'TINYINT DEFAULT 0 COMMENT \'0-未发卡,1-已发卡,2-eyeball\''),
-        ('confirmed', 'BOOLEAN DEFAULT FALSE'),
-        ('sync_status', 'TINYINT DEFAULT 0 COMMENT \'0-未同步,1-同步中,2-已同步,3-同步失败\''),
-        ('last_sync_time', 'DATETIME'),
-        ('lotw_qsl_rcvd', 'VARCHAR(1) COMMENT \'Y-已收到,N-未收到\''),
-        ('lotw_qsl_sent', 'VARCHAR(1) COMMENT \'Y-已发送,N-未发送\'')
-    ]
-    
-    for column_name, column_def in columns_to_add:
-        if not check_column_exists('qso_log', column_name):
-            execute_query(f"ALTER TABLE qso_log ADD COLUMN {column_name} {column_def}")
-            print(f"已成功添加列: {column_name}")
\ No newline at end of file
+        _release(conn)
@@ -0,0 +1,258 @@
+"""
+查重索引
+比赛中录入时需要立即知道呼号在当前波段、模式上是否已经通联过(DUPE)。
+内存中保存查重时段内所有日志的 (呼号, 波段, 模式)，启动时一次查询构建，
+日志写入的事务提交后由 qso_events 增量更新，查重不访问数据库
+
+为节省内存，每种 (波段, 模式) 组合分配一个槽位号，每个呼号只保存一个槽位位图(int)；
+同一组合通联多次的呼号另外记录多出的次数，删除其中一条后仍然是DUPE
+
+多进程部署时索引记录对应的日志版本(log_version)，查重前发现版本变化(其他工作进程写入过)时，
+其他进程只新增了记录则按id读取新增的行增量更新，有修改、删除时重新构建
+
+查重时段在 config.ini 的 [SETTINGS] dupe_window_start / dupe_window_end 中设置(如比赛时段)，
+修改后需重启
+"""
+
+import datetime
+import sys
+import threading
+
+from db_utils import config, execute_query, stream_query
+import log_version
+import qso_time
+
+
+def _parse_window(name):
+    value = config.get('SETTINGS', name, fallback='').strip()
+    if not value:
+        return None
+    return datetime.datetime.strptime(value, '%Y-%m-%d %H:%M')
+
+
+# 配置为 'YYYY-MM-DD HH:MM'(UTC)，包含开始时间，不包含结束时间；为空表示不限
+WINDOW_START = _parse_window('dupe_window_start')
+WINDOW_END = _parse_window('dupe_window_end')
+
+
+def _normalize(callsign, band, mode):
+    return (callsign or '').strip().upper(), (band or '').strip().lower(), (mode or '').strip().upper()
+
+
+def in_window(row):
+    """日志行是否在查重时段内(按 qso_datetime_utc，行中没有时按 date、time 计算)"""
+    if WINDOW_START is None and WINDOW_END is None:
+        return True
+    value = qso_time.of_row(row)
+    if value is None:
+        return False
+    return ((WINDOW_START is None or value >= WINDOW_START)
+            and (WINDOW_END is None or value < WINDOW_END))
+
+
+def _window_conditions():
+    """
+    查重时段的查询条件，使用 qso_datetime_utc 索引；
+    时间未知的记录(qso_time.UNKNOWN_UTC)只设置结束时间时也会查询出来，由 in_window 排除
+    """
+    conditions, params = [], []
+    for bound, operator in ((WINDOW_START, '>='), (WINDOW_END, '<')):
+        if bound is not None:
+            conditions.append(f"qso_datetime_utc {operator} %s")
+            params.append(bound)
+    return conditions, params
+
+
+class _Index:
+    """呼号 -> 槽位位图"""
+
+    __slots__ = ('slots', 'slot_keys', 'worked', 'repeats')
+
+    def __init__(self):
+        # (波段, 模式) -> 槽位号，只增不减
+        self.slots = {}
+        self.slot_keys = []
+        self.worked = {}
+        # (呼号, 槽位号) -> 超出1次的通联次数
+        self.repeats = {}
+
+    def _slot(self, band, mode):
+        slot = self.slots.get((band, mode))
+        if slot is None:
+            slot = self.slots[(band, mode)] = len(self.slot_keys)
+            self.slot_keys.append((band, mode))
+        return slot
+
+    def add(self, callsign, band, mode):
+        slot = self._slot(band, mode)
+        mask = self.worked.get(callsign, 0)
+        if mask >> slot & 1:
+            self.repeats[(callsign, slot)] = self.repeats.get((callsign, slot), 0) + 1
+        else:
+            self.worked[callsign] = mask | 1 << slot
+
+    def remove(self, callsign, band, mode):
+        slot = self.slots.get((band, mode))
+        if slot is None:
+            return
+        repeats = self.repeats.get((callsign, slot))
+        if repeats:
+            if repeats > 1:
+                self.repeats[(callsign, slot)] = repeats - 1
+            else:
+                del self.repeats[(callsign, slot)]
+            return
+        mask = self.worked.get(callsign, 0) & ~(1 << slot)
+        if mask:
+            self.worked[callsign] = mask
+        else:
+            self.worked.pop(callsign, None)
+
+
+_lock = threading.Lock()
+# 同一时间只有一个线程重新构建
+_load_lock = threading.Lock()
+# 首次使用时(或启动预热时，见 server.py)从数据库构建
+_index = None
+# 每次写入递增，构建期间有写入时重新构建
+_generation = 0
+# 索引对应的日志版本
+_version = None
+
+
+def load():
+    """
+    从数据库构建查重索引，使用服务端游标分批读取，不会一次载入全部行
+    :return: 索引中的呼号数
+    """
+    global _index, _version
+    conditions, params = _window_conditions()
+    where = "WHERE " + " AND ".join(conditions) if conditions else ""
+    while True:
+        with _lock:
+            generation = _generation
+        # 查询之前读取版本，查询期间其他进程的写入会在下次使用时触发重新构建
+        version = log_version.current()[0]
+        index = _Index()
+        query = f"SELECT callsign, band, mode, date, time, qso_datetime_utc FROM qso_log {where}"
+        for rows in stream_query(query, params, batch_size=5000):
+            for row in rows:
+                if conditions and not in_window(row):
+                    continue
+                callsign, band, mode = _normalize(row['callsign'], row['band'], row['mode'])
+                if callsign:
+                    index.add(callsign, band, mode)
+        with _lock:
+            if generation == _generation:
+                _index = index
+                _version = version
+                return len(index.worked)
+
+
+def _stale():
+    return _index is None or _version != log_version.current()[0]
+
+
+def _refresh():
+    """
+    按其他进程的变更记录增量更新索引
+    :return: 是否已更新；无法增量更新时返回 False，需要重新构建
+    """
+    global _version
+    with _lock:
+        version = _version
+    current, ids = log_version.changes_since(version)
+    if ids is None:
+        return False
+    rows = []
+    for start in range(0, len(ids), 1000):
+        chunk = ids[start:start + 1000]
+        rows.extend(execute_query(
+            f"SELECT callsign, band, mode, date, time, qso_datetime_utc FROM qso_log "
+            f"WHERE id IN ({', '.join(['%s'] * len(chunk))})", chunk, fetch=True))
+    with _lock:
+        # 读取期间本进程写入过，变更的先后无法确定
+        if _version != version:
+            return False
+        for row in rows:
+            callsign, band, mode = _normalize(row['callsign'], row['band'], row['mode'])
+            if callsign and in_window(row):
+                _index.add(callsign, band, mode)
+        _version = current
+    return True
+
+
+def _ensure_loaded():
+    if _stale():
+        with _load_lock:
+            # 等待期间其他线程可能已经重新构建
+            if _stale() and (_index is None or not _refresh()):
+                load()
+
+
+def advance_version(previous, version):
+    """本进程写入后日志版本由 previous 变为 version，索引已增量更新，直接对应新版本"""
+    global _version
+    with _lock:
+        if _index is not None and _version == previous:
+            _version = version
+
+
+def check(callsign, band, mode):
+    """
+    查重
+    :return: {'dupe': 是否已在该波段、模式通联过,
+              'worked': [{'band': 波段, 'mode': 模式}, ...] 该呼号在查重时段内通联过的组合}
+    """
+    _ensure_loaded()
+    callsign, band, mode = _normalize(callsign, band, mode)
+    with _lock:
+        mask = _index.worked.get(callsign, 0)
+        slot = _index.slots.get((band, mode))
+        worked = [_index.slot_keys[i] for i in range(mask.bit_length()) if mask >> i & 1]
+    return {
+        'dupe': slot is not None and bool(mask >> slot & 1),
+        'worked': [{'band': b, 'mode': m} for b, m in worked],
+    }
+
+
+def apply_changes(removed, added):
+    """按变更前后的行更新查重索引，在事务提交后调用"""
+    global _generation, _version
+    with _lock:
+        _generation += 1
+        if _index is None:
+            return
+        if removed and _stale():
+            # 修改、删除的行可能是其他进程新增而索引中还没有的，下次使用时重新构建
+            _version = None
+            return
+        for rows, apply in ((removed, _index.remove), (added, _index.add)):
+            for row in rows:
+                if not in_window(row):
+                    continue
+                callsign, band, mode = _normalize(row.get('callsign'), row.get('band'), row.get('mode'))
+                if callsign:
+                    apply(callsign, band, mode)
+
+
+def stats():
+    """索引规模和内存占用估算(字节，包含字典本身和其中的键、值对象)"""
+    _ensure_loaded()
+    with _lock:
+        worked = list(_index.worked.items())
+        repeats = list(_index.repeats.items())
+        slot_count = len(_index.slot_keys)
+        memory = sys.getsizeof(_index.worked) + sys.getsizeof(_index.repeats) + sys.getsizeof(_index.slots)
+    memory += sum(sys.getsizeof(callsign) + sys.getsizeof(mask) for callsign, mask in worked)
+    memory += sum(sys.getsizeof(key) + sys.getsizeof(count) for key, count in repeats)
+    keys = sum(bin(mask).count('1') for _, mask in worked)
+    return {
+        'window': {name: bound.strftime('%Y-%m-%d %H:%M') if bound else None
+                   for name, bound in (('start', WINDOW_START), ('end', WINDOW_END))},
+        'callsigns': len(worked),
+        'slots': slot_count,
+        'keys': keys,
+        'qsos': keys + sum(count for _, count in repeats),
+        'memory_bytes': memory,
+    }
@@ -1,12 +1,13 @@
 
 from flask_wtf import FlaskForm
 from wtforms import StringField, FloatField, SelectField, DateField, TextAreaField
-from wtforms.validators import DataRequired, NumberRange
+from wtforms.validators import DataRequired, NumberRange, Length
 import datetime
 
 class QSOForm(FlaskForm):
-    callsign = StringField('呼号')
-    time = StringField('时间')
+    # 长度上限与 qso_log 的列定义一致，超长的值写入数据库时会失败(写入队列中的记录不能再退回)
+    callsign = StringField('呼号', validators=[Length(max=10)])
+    time = StringField('时间', validators=[Length(max=10)])
     frequency = FloatField('频率(MHz)')
     mode = SelectField('模式', choices=[
         ('', '请选择模式'),
@@ -20,15 +21,15 @@ class QSOForm(FlaskForm):
         ('FT4', 'FT4'),
         ('DIGITAL', '其他数字模式')
     ], default='FM')
-    equipment = StringField('设备')
-    antenna = StringField('天线')
+    equipment = StringField('设备', validators=[Length(max=50)])
+    antenna = StringField('天线', validators=[Length(max=50)])
     power = FloatField('功率(W)', validators=[NumberRange(min=0, max=2000)], default=0.0)
     date = DateField('日期', default=datetime.date.today)
     notes = TextAreaField('备注')
-    dxcc = StringField('DXCC国家编号') 
-    grid = StringField('网格坐标')
-    province = StringField('省份/州')
-    band = StringField('波段')
+    dxcc = StringField('DXCC国家编号', validators=[Length(max=10)])
+    grid = StringField('网格坐标', validators=[Length(max=10)])
+    province = StringField('省份/州', validators=[Length(max=20)])
+    band = StringField('波段', validators=[Length(max=10)])
     qslcard = SelectField('QSL卡片状态', choices=[
         ('0', '未换卡'),
         ('1', 'Eyeball'),
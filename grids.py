@@ -0,0 +1,293 @@
+"""
+梅登黑德网格(Maidenhead)地图
+- 网格与经纬度互相转换；安装 numpy 时批量转换使用向量化计算，否则逐个计算
+- grid_counts 表按 (网格, 波段, 模式) 维护通联数和确认数，网格保存到6位(子方格)，只有4位的保存4位，
+  随日志写入增量更新(见 qso_events.py)
+- 地图按视野范围和缩放级别聚合: 缩放级别低时合并为2位(大区)或4位(方格)网格，
+  返回按列组织的数组，不逐条返回日志
+
+命令行用法: python grids.py rebuild   (按 qso_log 重新计算 grid_counts)
+"""
+
+import math
+import re
+
+from db_utils import execute_query, stream_query, transaction
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_GRID_PATTERN = re.compile(r'[A-R]{2}[0-9]{2}(?:[A-X]{2})?')
+
+# 网格位数 -> (经度跨度, 纬度跨度)(度)
+CELL_SIZE = {2: (20.0, 10.0), 4: (2.0, 1.0), 6: (2.0 / 24, 1.0 / 24)}
+
+# 缩放级别(与 Leaflet/OSM 瓦片一致) -> 聚合的网格位数: 小于4为大区，小于9为方格，其余为子方格
+ZOOM_PRECISION = ((4, 2), (9, 4))
+MAX_PRECISION = 6
+
+
+def normalize(grid):
+    """规范化为大写的4位或6位网格，无效(或不足4位)时返回 None"""
+    match = _GRID_PATTERN.match(str(grid or '').strip().upper())
+    return match.group(0) if match else None
+
+
+def _corner(grid):
+    """网格西南角的 (纬度, 经度)"""
+    lon = (ord(grid[0]) - 65) * 20.0 - 180
+    lat = (ord(grid[1]) - 65) * 10.0 - 90
+    if len(grid) >= 4:
+        lon += (ord(grid[2]) - 48) * 2.0
+        lat += ord(grid[3]) - 48
+    if len(grid) >= 6:
+        lon += (ord(grid[4]) - 65) * CELL_SIZE[6][0]
+        lat += (ord(grid[5]) - 65) * CELL_SIZE[6][1]
+    return lat, lon
+
+
+def to_latlon(grids, center=True):
+    """
+    网格 -> 经纬度
+    :param grids: 已规范化的2/4/6位网格序列
+    :param center: True 返回网格中心，False 返回西南角
+    :return: (纬度列表, 经度列表)；安装 numpy 时为数组
+    """
+    grids = list(grids)
+    if np is None:
+        lats, lons = [], []
+        for grid in grids:
+            lat, lon = _corner(grid)
+            if center:
+                lon_size, lat_size = CELL_SIZE[len(grid)]
+                lat, lon = lat + lat_size / 2, lon + lon_size / 2
+            lats.append(lat)
+            lons.append(lon)
+        return lats, lons
+
+    if not grids:
+        return np.empty(0), np.empty(0)
+    codes = np.frombuffer(''.join(g.ljust(6) for g in grids).encode('ascii'), dtype=np.uint8)
+    codes = codes.reshape(-1, 6).astype(np.float64)
+    lengths = np.fromiter((len(g) for g in grids), dtype=np.int8, count=len(grids))
+    has4, has6 = lengths >= 4, lengths >= 6
+    lon = (codes[:, 0] - 65) * 20 - 180 + np.where(has4, (codes[:, 2] - 48) * 2, 0)
+    lat = (codes[:, 1] - 65) * 10 - 90 + np.where(has4, codes[:, 3] - 48, 0)
+    lon += np.where(has6, (codes[:, 4] - 65) * CELL_SIZE[6][0], 0)
+    lat += np.where(has6, (codes[:, 5] - 65) * CELL_SIZE[6][1], 0)
+    if center:
+        lon += np.where(has6, CELL_SIZE[6][0], np.where(has4, CELL_SIZE[4][0], CELL_SIZE[2][0])) / 2
+        lat += np.where(has6, CELL_SIZE[6][1], np.where(has4, CELL_SIZE[4][1], CELL_SIZE[2][1])) / 2
+    return lat, lon
+
+
+def from_latlon(lats, lons, precision=MAX_PRECISION):
+    """
+    经纬度 -> 网格
+    :param precision: 网格位数 2/4/6
+    :return: 网格列表；超出范围的坐标取最近的网格
+    """
+    if precision not in CELL_SIZE:
+        raise ValueError("网格位数必须是 2、4、6 之一")
+    if np is None:
+        return [_from_latlon(lat, lon, precision) for lat, lon in zip(lats, lons)]
+
+    lat = np.clip(np.asarray(lats, dtype=np.float64) + 90, 0, 180 - 1e-9)
+    lon = np.clip(np.asarray(lons, dtype=np.float64) + 180, 0, 360 - 1e-9)
+    codes = np.empty((len(lat), precision), dtype=np.uint8)
+    codes[:, 0] = 65 + lon // 20
+    codes[:, 1] = 65 + lat // 10
+    if precision >= 4:
+        codes[:, 2] = 48 + lon % 20 // 2
+        codes[:, 3] = 48 + lat % 10 // 1
+    if precision >= 6:
+        codes[:, 4] = 65 + lon % 2 * 12 // 1
+        codes[:, 5] = 65 + lat % 1 * 24 // 1
+    return codes.view(f'S{precision}').ravel().astype(str).tolist()
+
+
+def _from_latlon(lat, lon, precision):
+    lat = min(max(lat + 90, 0), 180 - 1e-9)
+    lon = min(max(lon + 180, 0), 360 - 1e-9)
+    grid = chr(65 + int(lon // 20)) + chr(65 + int(lat // 10))
+    if precision >= 4:
+        grid += chr(48 + int(lon % 20 // 2)) + chr(48 + int(lat % 10 // 1))
+    if precision >= 6:
+        grid += chr(65 + int(lon % 2 * 12 // 1)) + chr(65 + int(lat % 1 * 24 // 1))
+    return grid
+
+
+def _count_key(row):
+    grid = normalize(row.get('grid'))
+    if grid is None:
+        return None
+    return grid, (row.get('band') or '').strip().lower()[:10], (row.get('mode') or '').strip().upper()[:10]
+
+
+def _write_deltas(deltas):
+    values = [key + tuple(delta) for key, delta in deltas.items() if delta[0] or delta[1]]
+    if not values:
+        return
+    placeholders = ", ".join(["(%s, %s, %s, %s, %s)"] * len(values))
+    execute_query(f"""
+        INSERT INTO grid_counts (grid, band, mode, qso_count, confirmed_count) VALUES {placeholders}
+        ON DUPLICATE KEY UPDATE
+            qso_count = qso_count + VALUES(qso_count),
+            confirmed_count = confirmed_count + VALUES(confirmed_count)
+    """, [value for row in values for value in row])
+
+
+def apply_changes(removed, added):
+    """按变更前后的行更新 grid_counts，需在写入日志的同一事务中调用"""
+    # 键 -> [通联数增量, 确认数增量]
+    deltas = {}
+    for rows, sign in ((removed, -1), (added, 1)):
+        for row in rows:
+            key = _count_key(row)
+            if key is None:
+                continue
+            delta = deltas.setdefault(key, [0, 0])
+            delta[0] += sign
+            delta[1] += sign if row.get('confirmed') else 0
+    _write_deltas(deltas)
+
+
+def rebuild():
+    """按 qso_log 全量重新计算 grid_counts(网格规范化在Python中完成，与增量更新一致)"""
+    deltas = {}
+    for rows in stream_query("""
+        SELECT grid, band, mode, COUNT(*) AS qso_count,
+               SUM(CASE WHEN confirmed THEN 1 ELSE 0 END) AS confirmed_count
+        FROM qso_log WHERE grid IS NOT NULL AND grid <> ''
+        GROUP BY grid, band, mode
+    """, batch_size=5000):
+        for row in rows:
+            key = _count_key(row)
+            if key is not None:
+                delta = deltas.setdefault(key, [0, 0])
+                delta[0] += int(row['qso_count'])
+                delta[1] += int(row['confirmed_count'] or 0)
+    items = list(deltas.items())
+    with transaction():
+        execute_query("DELETE FROM grid_counts")
+        for start in range(0, len(items), 1000):
+            _write_deltas(dict(items[start:start + 1000]))
+    return len(items)
+
+
+def precision_for_zoom(zoom):
+    for max_zoom, precision in ZOOM_PRECISION:
+        if zoom < max_zoom:
+            return precision
+    return MAX_PRECISION
+
+
+def _lon_ranges(west, east):
+    """经度范围，跨越180度经线(west > east)时拆成两段"""
+    return [(west, east)] if west <= east else [(west, 180.0), (-180.0, east)]
+
+
+def _field_ranges(south, north, lon_ranges):
+    """
+    与视野相交的2位大区对应的网格字符串范围 [开始, 结束)，
+    网格首字母为经度，同一经度列中相邻纬度的大区是连续的范围，可以使用主键索引
+    """
+    ranges = []
+    low, high = from_latlon([south, north], [0, 0], 2)
+    for west, east in lon_ranges:
+        first, last = from_latlon([0, 0], [west, east], 2)
+        for lon_code in range(ord(first[0]), ord(last[0]) + 1):
+            ranges.append((chr(lon_code) + low[1], chr(lon_code) + chr(ord(high[1]) + 1)))
+    return ranges
+
+
+def parse_bbox(value):
+    """'west,south,east,north'(度) -> (west, south, east, north)，为空时为全球"""
+    if not value:
+        return -180.0, -90.0, 180.0, 90.0
+    try:
+        west, south, east, north = (float(v) for v in value.split(','))
+    except ValueError:
+        raise ValueError("bbox 格式应为 west,south,east,north")
+    if not all(math.isfinite(v) for v in (west, south, east, north)) or south > north:
+        raise ValueError("bbox 范围无效")
+    south, north = max(south, -90.0), min(north, 90.0)
+    # 地图平移多圈后经度可能超出 ±180
+    if east - west >= 360:
+        return -180.0, south, 180.0, north
+    if not -180 <= west <= 180:
+        west = (west + 180) % 360 - 180
+    if not -180 <= east <= 180:
+        east = (east + 180) % 360 - 180
+    return west, south, east, north
+
+
+def aggregate(bbox=None, zoom=2, precision=None, band=None, mode=None, confirmed=False):
+    """
+    按视野范围聚合网格
+    :param bbox: (west, south, east, north)
+    :param zoom: 地图缩放级别，决定聚合的网格位数(precision 未指定时)
+    :param confirmed: 只返回有确认记录的网格
+    :return: {'precision': 网格位数, 'cell': [经度跨度, 纬度跨度],
+              'grid': [...], 'lat': [...], 'lon': [...](网格中心), 'qsos': [...], 'confirmed': [...]}
+    """
+    west, south, east, north = bbox or parse_bbox(None)
+    precision = precision or precision_for_zoom(zoom)
+    if precision not in CELL_SIZE:
+        raise ValueError("网格位数必须是 2、4、6 之一")
+    lon_ranges = _lon_ranges(west, east)
+
+    ranges = _field_ranges(south, north, lon_ranges)
+    conditions = ["qso_count > 0", "(" + " OR ".join(["(grid >= %s AND grid < %s)"] * len(ranges)) + ")"]
+    params = [value for bounds in ranges for value in bounds]
+    if precision > 4:
+        # 只有4位的网格无法放到子方格中
+        conditions.append("CHAR_LENGTH(grid) >= %s")
+        params.append(precision)
+    if band:
+        conditions.append("band = %s")
+        params.append(band.strip().lower())
+    if mode:
+        conditions.append("mode = %s")
+        params.append(mode.strip().upper())
+    having = "HAVING SUM(confirmed_count) > 0" if confirmed else ""
+    rows = execute_query(f"""
+        SELECT LEFT(grid, {precision}) AS cell, SUM(qso_count) AS qsos, SUM(confirmed_count) AS confirmed
+        FROM grid_counts WHERE {" AND ".join(conditions)}
+        GROUP BY cell {having} ORDER BY cell
+    """, params, fetch=True)
+
+    cells = [row['cell'] for row in rows]
+    lon_size, lat_size = CELL_SIZE[precision]
+    lats, lons = to_latlon(cells)
+    # 大区范围内进一步按网格与视野是否相交筛选
+    keep = [
+        south - lat_size / 2 < lat < north + lat_size / 2
+        and any(w - lon_size / 2 < lon < e + lon_size / 2 for w, e in lon_ranges)
+        for lat, lon in zip(lats, lons)
+    ] if np is None else (
+        (lats > south - lat_size / 2) & (lats < north + lat_size / 2)
+        & np.logical_or.reduce([(lons > w - lon_size / 2) & (lons < e + lon_size / 2) for w, e in lon_ranges])
+    )
+    picked = [i for i, k in enumerate(keep) if k]
+    return {
+        'precision': precision,
+        'cell': [lon_size, lat_size],
+        'grid': [cells[i] for i in picked],
+        'lat': [round(float(lats[i]), 4) for i in picked],
+        'lon': [round(float(lons[i]), 4) for i in picked],
+        'qsos': [int(rows[i]['qsos']) for i in picked],
+        'confirmed': [int(rows[i]['confirmed']) for i in picked],
+    }
+
+
+if __name__ == '__main__':
+    import sys
+    from db_utils import init_db_pool
+
+    if sys.argv[1:] != ['rebuild']:
+        raise SystemExit("用法: python grids.py rebuild")
+    init_db_pool()
+    print(f"网格统计表已重建，共 {rebuild()} 个 (网格, 波段, 模式)")
@@ -0,0 +1,48 @@
+"""
+gunicorn 配置(生产环境多进程部署)
+用法: gunicorn -c gunicorn.conf.py wsgi:app
+监听地址、进程数和线程数读取 config.ini 的 [SERVER]，命令行参数(--workers 等)优先
+
+启动顺序:
+    1. 主进程预加载应用(不连接数据库)，on_starting 中执行一次数据库迁移并关闭临时连接，
+       迁移失败时主进程退出，不启动工作进程(表结构不完整时各接口都会出错)
+    2. fork 工作进程，post_fork 中按进程数和线程数创建本进程的连接池(server.pool_size_for)
+    3. 工作进程预热连接和内存索引后才开始接收请求
+"""
+
+import multiprocessing
+import os
+import sys
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, _BASE_DIR)
+
+# 模块级变量按名称作为 gunicorn 设置，避免与设置项(如 config)重名
+from db_utils import config as _config  # noqa: E402
+
+chdir = _BASE_DIR
+bind = _config.get('SERVER', 'bind', fallback='127.0.0.1:8000')
+workers = _config.getint('SERVER', 'workers', fallback=0) or multiprocessing.cpu_count()
+worker_class = 'gthread'
+threads = _config.getint('SERVER', 'threads', fallback=4)
+timeout = _config.getint('SERVER', 'timeout', fallback=120)
+graceful_timeout = _config.getint('SERVER', 'graceful_timeout', fallback=30)
+# 预加载应用，fork 前只导入模块，不建立连接
+preload_app = True
+
+
+def on_starting(server):
+    import server as app_server
+    app_server.prepare_master()
+
+
+def post_fork(server, worker):
+    import server as app_server
+    pool_size = app_server.pool_size_for(server.cfg.workers, server.cfg.threads)
+    server.log.info(f"工作进程 {worker.pid}: {server.cfg.threads} 个线程，连接池 {pool_size} 个连接")
+    app_server.init_worker(pool_size=pool_size, migrate=False)
+
+
+def worker_exit(server, worker):
+    import server as app_server
+    app_server.stop_background()
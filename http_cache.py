@@ -0,0 +1,73 @@
+"""
+日志读接口的条件请求与响应缓存
+响应以日志数据版本(见 log_version.py)作为 ETag。客户端携带的 If-None-Match 与当前版本一致时
+直接返回304，不访问数据库；200响应按 (版本, 路径, 查询参数) 缓存在进程内的LRU中，
+日志变更后版本改变，旧缓存不再命中并随LRU淘汰
+"""
+
+import functools
+import threading
+from collections import OrderedDict
+
+from flask import current_app, make_response, request
+
+from db_utils import config
+import log_version
+
+CACHE_SIZE = config.getint('SETTINGS', 'response_cache_size', fallback=256)
+# 超过该大小的响应(如大分页)不缓存
+MAX_CACHED_BYTES = 1024 * 1024
+
+_lock = threading.Lock()
+# (版本, 路径, 查询参数) -> (响应体, mimetype)
+_cache = OrderedDict()
+
+
+def _cache_get(key):
+    with _lock:
+        entry = _cache.get(key)
+        if entry is not None:
+            _cache.move_to_end(key)
+        return entry
+
+
+def _cache_put(key, entry):
+    with _lock:
+        _cache[key] = entry
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def conditional(view):
+    """
+    视图装饰器：添加 ETag / Last-Modified，处理 If-None-Match 并缓存响应
+    只缓存非流式的200响应，错误响应原样返回
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        # 先取版本再查询：查询期间有写入时响应可能比版本新，下次请求版本不同会重新获取
+        version, modified = log_version.current()
+        # 弱比较: 压缩后的响应使用弱 ETag(见 compression.py)
+        if request.if_none_match.contains_weak(version):
+            response = make_response('', 304)
+        else:
+            key = (version, request.path, tuple(sorted(request.args.items(multi=True))))
+            entry = _cache_get(key)
+            if entry is not None:
+                body, mimetype = entry
+                response = current_app.response_class(body, mimetype=mimetype)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                if not response.is_streamed:
+                    body = response.get_data()
+                    if len(body) <= MAX_CACHED_BYTES:
+                        _cache_put(key, (body, response.mimetype))
+        response.set_etag(version)
+        response.last_modified = modified
+        # 允许浏览器缓存，但每次使用前都要向服务端验证
+        response.cache_control.no_cache = True
+        return response
+    return wrapper
@@ -0,0 +1,89 @@
+"""
+日志列表的列选择与JSON编码
+- 日志接口按列名查询，不使用 SELECT *；默认不返回LOTW同步用的内部列(sync_status、last_sync_time)，
+  ?fields=callsign,band 可指定返回的列
+- ?format=columns 返回按列组织的数组: columns 为列名，data 中第i个数组为第i列的值，
+  列名不随每条记录重复，配合压缩(见 compression.py)响应体可缩小数倍
+- 安装 orjson 时使用 orjson 编码，否则使用标准库 json；日期为 ISO 格式(YYYY-MM-DD)，
+  Decimal 输出为数值，timedelta(MySQL TIME)输出为 HH:MM:SS
+"""
+
+import datetime
+import decimal
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# qso_log 的全部列
+LOG_COLUMNS = (
+    'id', 'callsign', 'frequency', 'mode', 'equipment', 'antenna', 'power', 'date', 'time', 'notes',
+    'dxcc', 'grid', 'province', 'band', 'qslcard', 'confirmed',
+    'sync_status', 'last_sync_time', 'lotw_qsl_rcvd', 'lotw_qsl_sent', 'qso_datetime_utc',
+)
+# 日志列表默认返回的列
+LIST_COLUMNS = tuple(c for c in LOG_COLUMNS if c not in ('sync_status', 'last_sync_time'))
+# 游标分页需要的排序列，总是查询
+REQUIRED_COLUMNS = ('id', 'qso_datetime_utc')
+
+FORMATS = ('rows', 'columns')
+
+
+def parse_fields(value):
+    """
+    解析 ?fields= 参数
+    :return: 查询的列(包含排序列)，未指定时为 LIST_COLUMNS；有未知列时抛出 ValueError
+    """
+    if not value:
+        return LIST_COLUMNS
+    fields = [f.strip().lower() for f in value.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in LOG_COLUMNS]
+    if unknown:
+        raise ValueError(f"未知的列: {', '.join(unknown)}")
+    return tuple(c for c in LOG_COLUMNS if c in fields or c in REQUIRED_COLUMNS)
+
+
+def parse_format(value):
+    """解析 ?format= 参数(rows 或 columns，ndjson 由全量获取单独处理)"""
+    value = (value or 'rows').strip().lower()
+    if value not in FORMATS:
+        raise ValueError(f"不支持的格式: {value}，可选 {', '.join(FORMATS)}")
+    return value
+
+
+def _default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, datetime.timedelta):
+        seconds = int(value.total_seconds())
+        return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode('utf-8', errors='replace')
+    raise TypeError(f"无法编码为JSON: {type(value).__name__}")
+
+
+def dumps(obj):
+    """编码为紧凑的JSON(bytes)"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def to_columns(rows, columns):
+    """行字典列表转换为按列组织的数组"""
+    return [[row[c] for row in rows] for c in columns]
+
+
+def payload(rows, columns, fmt, **extra):
+    """
+    日志列表的响应数据
+    :param fmt: rows 为字典列表，columns 为 {"columns": 列名, "data": 各列的值}
+    """
+    if fmt == 'columns':
+        return {"success": True, "format": "columns", "columns": list(columns),
+                "data": to_columns(rows, columns), **extra}
+    return {"success": True, "data": rows, **extra}
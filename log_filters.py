@@ -0,0 +1,145 @@
+"""
+日志筛选
+将 /api/logs 的查询参数转换为 WHERE 条件。每个筛选列都有以它开头、后接 qso_datetime_utc 的
+二级索引(见 migrations.py)，筛选后按时间倒序分页可以直接按索引顺序读取；
+日期和时间范围按 qso_datetime_utc 的索引范围查找
+
+支持的参数:
+    callsign   呼号前缀，如 BY4
+    band, mode, province, dxcc   精确匹配(不区分大小写)
+    date_from, date_to           日期范围 YYYY-MM-DD，包含两端
+    since, until                 UTC时间范围 YYYY-MM-DD HH:MM[:SS]，包含 since、不包含 until
+                                 (如最近2小时: since=当前UTC时间减2小时)
+    qslcard    0/1/2
+    confirmed  true/false
+"""
+
+import datetime
+
+from db_utils import config, execute_query
+
+# 带筛选条件时统计总数最多扫描的记录数，超过时只返回下限
+COUNT_LIMIT = config.getint('SETTINGS', 'filter_count_limit', fallback=10000)
+
+
+def _text(max_length):
+    def convert(value):
+        value = value.strip()
+        if not value or len(value) > max_length:
+            raise ValueError
+        return value
+    return convert
+
+
+def _prefix(value):
+    value = value.strip().upper()
+    if not value or len(value) > 10:
+        raise ValueError
+    # 转义 LIKE 通配符，只做前缀匹配
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def _date(value):
+    return datetime.date.fromisoformat(value.strip())
+
+
+def _day_start(value):
+    return datetime.datetime.combine(_date(value), datetime.time())
+
+
+def _next_day_start(value):
+    return _day_start(value) + datetime.timedelta(days=1)
+
+
+def _datetime(value):
+    # 兼容 ISO 格式的 T 分隔和末尾的 Z，带时区时转换为UTC
+    value = datetime.datetime.fromisoformat(value.strip().rstrip('Zz'))
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _qslcard(value):
+    value = int(value)
+    if value not in (0, 1, 2):
+        raise ValueError
+    return value
+
+
+def _boolean(value):
+    value = value.strip().lower()
+    if value in ('true', '1', 'yes'):
+        return True
+    if value in ('false', '0', 'no'):
+        return False
+    raise ValueError
+
+
+# 参数名 -> (列, 比较运算, 转换函数)
+FILTERS = {
+    'callsign': ('callsign', 'LIKE', _prefix),
+    'band': ('band', '=', _text(10)),
+    'mode': ('mode', '=', _text(10)),
+    'province': ('province', '=', _text(20)),
+    'dxcc': ('dxcc', '=', _text(10)),
+    'date_from': ('qso_datetime_utc', '>=', _day_start),
+    'date_to': ('qso_datetime_utc', '<', _next_day_start),
+    'since': ('qso_datetime_utc', '>=', _datetime),
+    'until': ('qso_datetime_utc', '<', _datetime),
+    'qslcard': ('qslcard', '=', _qslcard),
+    'confirmed': ('confirmed', '=', _boolean),
+}
+
+
+def parse_filters(args):
+    """
+    从查询参数中取出筛选条件，忽略空值
+    :param args: request.args 或字典
+    :return: {参数名: 转换后的值}
+    :raises ValueError: 参数值无效
+    """
+    filters = {}
+    for name, (_, _, convert) in FILTERS.items():
+        value = args.get(name)
+        if value is None or value == '':
+            continue
+        try:
+            filters[name] = convert(value)
+        except ValueError:
+            raise ValueError(f"筛选参数 {name} 的值无效: {value}")
+    if 'date_from' in filters and 'date_to' in filters and filters['date_from'] >= filters['date_to']:
+        raise ValueError("date_from 不能晚于 date_to")
+    if 'since' in filters and 'until' in filters and filters['since'] >= filters['until']:
+        raise ValueError("since 必须早于 until")
+    return filters
+
+
+def build_conditions(filters):
+    """
+    :return: (条件列表, 参数列表)，条件之间为 AND 关系
+    """
+    conditions, params = [], []
+    for name, value in filters.items():
+        column, operator, _ = FILTERS[name]
+        conditions.append(f"{column} {operator} %s")
+        params.append(value)
+    return conditions, params
+
+
+def where_clause(conditions):
+    return "WHERE " + " AND ".join(conditions) if conditions else ""
+
+
+def count_matches(filters):
+    """
+    统计符合条件的记录数，最多扫描 COUNT_LIMIT 条
+    :return: (记录数, 是否精确)
+    """
+    conditions, params = build_conditions(filters)
+    result = execute_query(f"""
+        SELECT COUNT(*) AS total FROM (
+            SELECT 1 FROM qso_log {where_clause(conditions)} LIMIT %s
+        ) AS matched
+    """, (*params, COUNT_LIMIT + 1), fetch=True)
+    total = int(result[0]['total'])
+    return min(total, COUNT_LIMIT), total <= COUNT_LIMIT
@@ -0,0 +1,141 @@
+"""
+日志数据版本
+每次日志写入(新增、修改、删除、导入)的事务提交后生成新版本号，读接口用它作为 ETag。
+版本号保存在 instance/log_version 文件中，同一台机器上的多个工作进程共享，读取时不访问数据库。
+进程内的索引(dupe_check、callsign_index)记录自己对应的版本，版本不同说明有其他进程写入过。
+
+每个版本同时在 instance/log_changes 中追加一行变更记录(版本号、写入进程、新增记录的id)，
+其他进程的索引按记录只读取新增的行增量更新；修改、删除等变更没有id列表，需要重新构建
+"""
+
+import datetime
+import json
+import os
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows 上不加锁(单进程运行)
+    fcntl = None
+
+VERSION_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'log_version')
+CHANGES_FILE = os.path.join(os.path.dirname(VERSION_FILE), 'log_changes')
+# 变更记录超过该大小时只保留后一半，索引对应的版本已被丢弃时重新构建
+CHANGES_MAX_BYTES = 256 * 1024
+# 一次写入新增的记录超过该数量时不记录id(如大批量导入)，其他进程重新构建
+MAX_DELTA_IDS = 1000
+
+_lock = threading.Lock()
+
+
+def _read():
+    try:
+        with open(VERSION_FILE) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return ''
+
+
+def _replace(path, content):
+    # 先写临时文件再替换，读取方不会读到写了一半的内容
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def _read_changes():
+    try:
+        with open(CHANGES_FILE) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def _append_change(change):
+    line = json.dumps(change) + "\n"
+    try:
+        size = os.path.getsize(CHANGES_FILE)
+    except FileNotFoundError:
+        size = 0
+    if size + len(line) > CHANGES_MAX_BYTES:
+        lines = [json.dumps(c) + "\n" for c in _read_changes()]
+        _replace(CHANGES_FILE, "".join(lines[len(lines) // 2:]) + line)
+    else:
+        with open(CHANGES_FILE, 'a') as f:
+            f.write(line)
+
+
+def _file_lock(lock_file, exclusive):
+    if fcntl:
+        fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+
+def advance(inserted_ids=None, local=True):
+    """
+    生成新版本号，并返回被替换的版本号；多个进程的更新在文件锁内依次进行，
+    版本号的先后顺序与更新顺序一致
+    :param inserted_ids: 本次写入只新增了记录时为新增记录的id，其他变更为 None
+    :param local: 写入的进程是否已增量更新自己的索引(qso_events)；为 False 时本进程的索引也需要处理该变更
+    :return: (原版本号, 新版本号)
+    """
+    version = f"{time.time_ns():x}-{uuid.uuid4().hex[:8]}"
+    if inserted_ids is not None and len(inserted_ids) > MAX_DELTA_IDS:
+        inserted_ids = None
+    os.makedirs(os.path.dirname(VERSION_FILE), exist_ok=True)
+    with _lock, open(f"{VERSION_FILE}.lock", 'a') as lock_file:
+        _file_lock(lock_file, True)
+        previous = _read()
+        _append_change({'version': version, 'pid': os.getpid() if local else None,
+                        'ids': list(inserted_ids) if inserted_ids is not None else None})
+        _replace(VERSION_FILE, version)
+    return previous, version
+
+
+def bump():
+    """
+    生成新版本号，用于没有经过 qso_events 的批量修改(迁移、qso_time 回填)，所有进程的索引都会重新构建
+    版本号由时间戳和随机数组成，多个进程同时写入也不会得到相同的版本号
+    :return: 新版本号
+    """
+    return advance(local=False)[1]
+
+
+def changes_since(version):
+    """
+    索引从 version 更新到当前版本需要处理的变更，本进程已增量更新过的变更跳过
+    :return: (当前版本号, 其他进程新增记录的id列表)；无法增量更新(有修改、删除，
+             或 version 已不在变更记录中)时id列表为 None
+    """
+    os.makedirs(os.path.dirname(VERSION_FILE), exist_ok=True)
+    with _lock, open(f"{VERSION_FILE}.lock", 'a') as lock_file:
+        _file_lock(lock_file, False)
+        current_version = _read()
+        changes = _read_changes()
+    if current_version == version:
+        return current_version, []
+    positions = [i for i, change in enumerate(changes) if change['version'] == version]
+    if not positions:
+        return current_version, None
+    pending = changes[positions[0] + 1:]
+    pid = os.getpid()
+    foreign = [change for change in pending if change['pid'] != pid]
+    if not foreign:
+        return current_version, []
+    # 本进程的修改、删除与其他进程的新增交错时，本进程的增量更新可能基于缺少新增行的索引
+    if any(change['ids'] is None for change in pending):
+        return current_version, None
+    return current_version, [i for change in foreign for i in change['ids']]
+
+
+def current():
+    """
+    :return: (版本号, 版本生成时间)，时间为带时区的UTC datetime
+    """
+    version = _read()
+    if not version:
+        version = bump()
+    timestamp = int(version.split('-')[0], 16) / 1e9
+    return version, datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
@@ -10,6 +10,7 @@ import xml.etree.ElementTree as ET
 import logging
 from configparser import ConfigParser
 import os
+import metrics
 
 # 配置日志
 logging.basicConfig(
@@ -20,6 +21,12 @@ logger = logging.getLogger(__name__)
 
 class LOTWHandler:
     """处理与LOTW网站交互的类"""
+
+    # 增量同步高水位标记: 名称 -> 记录中对应的LOTW接收时间字段
+    SYNC_MARKS = {
+        'last_qsl': 'APP_LOTW_RXQSL',
+        'last_qso_rx': 'APP_LOTW_RXQSO',
+    }
     
     def __init__(self, config_file='config.ini'):
         """
@@ -31,7 +38,8 @@ class LOTWHandler:
         with open(config_file, 'r', encoding='utf-8') as fp:
             self.config.read_file(fp)
         
-        self.base_url = "https://lotw.arrl.org/lotwuser/lotwreport.adi"
+        self.base_url = self.config.get('LOTW', 'url', fallback="https://lotw.arrl.org/lotwuser/lotwreport.adi")
+        self.upload_url = self.config.get('LOTW', 'upload_url', fallback=self.base_url)
         self.session = requests.Session()
         
         # 从配置加载认证信息
@@ -59,12 +67,14 @@ class LOTWHandler:
             params['qso_date'] = qso_date.strftime('%Y-%m-%d')
         
         try:
-            response = self.session.post(
-                self.base_url,
-                params=params,
-                files={'upfile': ('log.adi', log_data)}
-            )
-            response.raise_for_status()
+            with metrics.lotw_request_seconds.time(operation='upload'):
+                response = self.session.post(
+                    self.upload_url,
+                    params=params,
+                    files={'upfile': ('log.adi', log_data)},
+                    timeout=60
+                )
+                response.raise_for_status()
             
             # 解析LOTW返回的XML响应
             root = ET.fromstring(response.text)
@@ -80,14 +90,65 @@ class LOTWHandler:
             logger.error(f"提交日志到LOTW时出错: {str(e)}")
             return False
 
-    def download_log(self, start_date=None, end_date=None):
+    def get_sync_mark(self, name):
+        """
+        读取增量同步高水位标记
+        :param name: SYNC_MARKS 中的名称
+        :return: 'YYYY-MM-DD HH:MM:SS' 格式的时间字符串，未同步过时返回None
+        """
+        from db_utils import execute_query
+        rows = execute_query("SELECT value FROM lotw_sync_state WHERE name = %s", (name,), fetch=True)
+        return rows[0]['value'] if rows else None
+
+    def set_sync_mark(self, name, value):
+        """保存增量同步高水位标记"""
+        from db_utils import execute_query
+        execute_query("""
+            INSERT INTO lotw_sync_state (name, value, updated_at) VALUES (%s, %s, NOW())
+            ON DUPLICATE KEY UPDATE value = VALUES(value), updated_at = NOW()
+        """, (name, value))
+
+    def _download_to_file(self, params, prefix):
+        """
+        流式下载LOTW报告并写入download目录，不在内存中缓存整个响应
+        :param params: 请求参数
+        :param prefix: 文件名前缀
+        :return: 文件路径；LOTW返回的不是ADIF数据时返回None
+        """
+        # 准备下载目录
+        download_dir = os.path.join(os.path.dirname(__file__), 'download')
+        os.makedirs(download_dir, exist_ok=True)
+
+        # 生成带时间戳的文件名
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        filepath = os.path.join(download_dir, f"{prefix}_{timestamp}.adi")
+
+        with metrics.lotw_request_seconds.time(operation='download'), \
+                self.session.get(self.base_url, params=params, timeout=30, stream=True) as response:
+            response.raise_for_status()
+            # 验证响应内容
+            if 'application/x-arrl-adif' not in response.headers.get('Content-Type', ''):
+                return None
+            with open(filepath, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    f.write(chunk)
+        return filepath
+
+    def download_log(self, start_date=None, end_date=None, incremental=False, auto_process=False):
         """
         从LOTW下载QSL日志并自动保存到项目download目录
         :param start_date: 开始日期(可选)，datetime对象
         :param end_date: 结束日期(可选)，datetime对象
-        :return: (success, message)元组，success为布尔值表示是否成功，
-                 message为结果描述或错误信息
+        :param incremental: 是否只下载上次同步之后收到的QSL(默认False，下载全部)
+        :param auto_process: 是否自动导入下载的文件(默认False)，增量同步标记只在导入后更新
+        :return: 如果auto_process为False，返回(success, message)元组，success为布尔值表示是否成功，
+                 message为结果描述或错误信息；
+                 如果auto_process为True，返回(success, message, added, updated)元组
         """
+        def failed(error_msg):
+            logger.error(error_msg)
+            return (False, error_msg) if not auto_process else (False, error_msg, 0, 0)
+
         params = {
             'login': self.username,
             'password': self.password,
@@ -97,6 +158,11 @@ class LOTWHandler:
         }
         
         try:
+            if incremental:
+                since = self.get_sync_mark('last_qsl')
+                if since:
+                    params['qso_qslsince'] = since
+
             # 处理日期参数
             if start_date:
                 if not isinstance(start_date, datetime):
@@ -108,263 +174,156 @@ class LOTWHandler:
                     raise ValueError("end_date必须是datetime对象")
                 params['qso_enddate'] = end_date.strftime('%Y-%m-%d')
 
-            # 准备下载目录
-            download_dir = os.path.join(os.path.dirname(__file__), 'download')
-            os.makedirs(download_dir, exist_ok=True)
-            
-            # 生成带时间戳的文件名
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"lotw_log_qsl_{timestamp}.adi"
-            filepath = os.path.join(download_dir, filename)
-            
-            # 发送请求
-            response = self.session.get(self.base_url, params=params, timeout=30)
-            response.raise_for_status()
-    # 验证响应内容
-            if 'application/x-arrl-adif' not in response.headers.get('Content-Type', ''):
-                error_msg = "LOTW返回了无效的ADIF格式数据，可能是认证失败或服务不可用"
-                logger.error(error_msg)
-                return (False, error_msg)
-            
-            # 保存文件
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(response.text)
-                success_msg = f"日志已成功下载并保存到：{filepath}"
+            filepath = self._download_to_file(params, 'lotw_log_qsl')
+            if filepath is None:
+                return failed("LOTW返回了无效的ADIF格式数据，可能是认证失败或服务不可用")
+
+            success_msg = f"日志已成功下载并保存到：{filepath}"
             logger.info(success_msg)
+
+            if auto_process:
+                added, updated = self.process_adi_file(filepath, sync_mark='last_qsl')
+                return (True, success_msg, added, updated)
             return (True, success_msg)
             
         except requests.exceptions.RequestException as e:
-            error_msg = f"网络请求失败：{str(e)}。请检查网络连接和LOTW服务状态"
-            logger.error(error_msg)
-            return (False, error_msg)
+            return failed(f"网络请求失败：{str(e)}。请检查网络连接和LOTW服务状态")
             
         except IOError as e:
-            error_msg = f"文件保存失败：{str(e)}。请检查目录权限和磁盘空间"
-            logger.error(error_msg)
-            return (False, error_msg)
+            return failed(f"文件保存失败：{str(e)}。请检查目录权限和磁盘空间")
             
         except ValueError as e:
-            error_msg = f"参数错误：{str(e)}"
-            logger.error(error_msg)
-            return (False, error_msg)
+            return failed(f"参数错误：{str(e)}")
             
         except Exception as e:
-            error_msg = f"处理LOTW日志时发生意外错误：{str(e)}"
-            logger.error(error_msg)
-            return (False, error_msg)
+            return failed(f"处理LOTW日志时发生意外错误：{str(e)}")
 
-    def download_log_QSO(self, start_date=None, end_date=None, auto_process=True):
+    def download_log_QSO(self, start_date=None, end_date=None, auto_process=True, incremental=False):
         """
         从LOTW下载全部QSO记录并可选自动处理
-        :param start_date: 开始日期(可选)，datetime对象，未指定则默认为1900-01-01
+        :param start_date: 开始日期(可选)，datetime对象，未指定则默认为1900-01-01(增量模式下不限制)
         :param end_date: 结束日期(可选)，datetime对象，未指定则默认为当前日期
         :param auto_process: 是否自动处理下载的文件(默认True)
+        :param incremental: 是否只下载上次同步之后LOTW新收到的QSO(默认False，下载全部)
         :return: 如果auto_process为False，返回(success, message)元组；
                  如果auto_process为True，返回(success, message, added, updated)元组
         """
-
-
-        # 从配置中获取呼号和密码
-        callsign = self.config.get('LOTW', 'username', fallback=None)
-        password = self.config.get('LOTW', 'password', fallback=None)
-        
-        if not callsign or not password:
-            error_msg = "LOTW认证信息未配置，请检查config.ini"
+        def failed(error_msg):
             logger.error(error_msg)
             return (False, error_msg) if not auto_process else (False, error_msg, 0, 0)
 
-        # 构建请求URL
-        base_url = f"https://lotw.arrl.org/lotwuser/lotwreport.adi?login={callsign}&password={password}&qso_query=1&qso_qsl=no"
+        if not self.username or not self.password:
+            return failed("LOTW认证信息未配置，请检查config.ini")
+
+        params = {
+            'login': self.username,
+            'password': self.password,
+            'qso_query': '1',
+            'qso_qsl': 'no'
+        }
         
         try:
+            since = self.get_sync_mark('last_qso_rx') if incremental else None
+            if since:
+                params['qso_qsorxsince'] = since
+
             # 处理日期参数
-            if not start_date:
+            if not start_date and not since:
                 start_date = datetime(1900, 1, 1)
             if not end_date:
                 end_date = datetime.now()
                 
-            if not isinstance(start_date, datetime):
+            if start_date and not isinstance(start_date, datetime):
                 raise ValueError("start_date必须是datetime对象")
             if not isinstance(end_date, datetime):
                 raise ValueError("end_date必须是datetime对象")
-                
-            base_url += f"&qso_startdate={start_date.strftime('%Y-%m-%d')}"
-            base_url += f"&qso_enddate={end_date.strftime('%Y-%m-%d')}"
 
-            # 准备下载目录
-            download_dir = os.path.join(os.path.dirname(__file__), 'download')
-            os.makedirs(download_dir, exist_ok=True)
-            
-            # 生成带时间戳的文件名
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"lotw_qso_{timestamp}.adi"
-            filepath = os.path.join(download_dir, filename)
-            
-            # 发送请求
-            response = self.session.get(base_url, timeout=30)
-            response.raise_for_status()
-            
-            # 验证响应内容
-            if 'application/x-arrl-adif' not in response.headers.get('Content-Type', ''):
-                error_msg = "LOTW返回了无效的ADIF格式数据，可能是认证失败或服务不可用"
-                logger.error(error_msg)
-                return (False, error_msg) if not auto_process else (False, error_msg, 0, 0)
-            
-            # 保存文件
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(response.text)
+            if start_date:
+                params['qso_startdate'] = start_date.strftime('%Y-%m-%d')
+            params['qso_enddate'] = end_date.strftime('%Y-%m-%d')
+
+            filepath = self._download_to_file(params, 'lotw_qso')
+            if filepath is None:
+                return failed("LOTW返回了无效的ADIF格式数据，可能是认证失败或服务不可用")
             
             success_msg = f"全部QSO记录已成功下载并保存到：{filepath}"
             logger.info(success_msg)
             
             if auto_process:
-                added, updated = self.process_adi_file(filepath)
+                added, updated = self.process_adi_file(filepath, sync_mark='last_qso_rx')
                 return (True, success_msg, added, updated)
             else:
                 return (True, success_msg)
             
         except requests.exceptions.RequestException as e:
-            error_msg = f"网络请求失败：{str(e)}。请检查网络连接和LOTW服务状态"
-            logger.error(error_msg)
-            return (False, error_msg) if not auto_process else (False, error_msg, 0, 0)
+            return failed(f"网络请求失败：{str(e)}。请检查网络连接和LOTW服务状态")
             
         except IOError as e:
-            error_msg = f"文件保存失败：{str(e)}。请检查目录权限和磁盘空间"
-            logger.error(error_msg)
-            return (False, error_msg) if not auto_process else (False, error_msg, 0, 0)
+            return failed(f"文件保存失败：{str(e)}。请检查目录权限和磁盘空间")
             
         except ValueError as e:
-            error_msg = f"参数错误：{str(e)}"
-            logger.error(error_msg)
-            return (False, error_msg) if not auto_process else (False, error_msg, 0, 0)
+            return failed(f"参数错误：{str(e)}")
             
         except Exception as e:
-            error_msg = f"处理LOTW QSO记录时发生意外错误：{str(e)}"
-            logger.error(error_msg)
-            return (False, error_msg) if not auto_process else (False, error_msg, 0, 0)
-
+            return failed(f"处理LOTW QSO记录时发生意外错误：{str(e)}")
 
+    def sync(self, incremental=True):
+        """
+        同步LOTW：先下载QSO记录，再下载QSL确认，均自动导入
+        :param incremental: 是否只同步上次同步之后的新数据(默认True)
+        :return: {'qso': (success, message, added, updated), 'qsl': (...)}
+        """
+        return {
+            'qso': self.download_log_QSO(auto_process=True, incremental=incremental),
+            'qsl': self.download_log(auto_process=True, incremental=incremental)
+        }
 
-    def process_adi_file(self, filepath):
+    def process_adi_file(self, filepath, sync_mark=None):
         """
         处理从LOTW下载的ADI文件，与本地数据库比较并更新
+        按批次写入(每批一个事务)，见 adif_import.import_records
         :param filepath: ADI文件路径
+        :param sync_mark: 增量同步标记名称(可选)，导入成功后更新为文件中最新的时间
         :return: (新增记录数, 更新记录数)元组
         """
-        from db_utils import execute_query
-        import re
-        
-        # 解析ADI文件
-        with open(filepath, 'r', encoding='utf-8') as f:
-            adi_content = f.read()
-        
-        # ADI记录解析正则表达式
-        record_pattern = re.compile(
-            r'<([^>:]+):(\d+)>([^<]*)',
-            re.IGNORECASE | re.DOTALL
-        )
-        
-        # 分割记录
-        records = []
-        current_record = {}
-        for tag, length, value in record_pattern.findall(adi_content):
-            tag = tag.upper()
-            value = value.strip()[:int(length)]
-            
-            if tag == 'EOR':
-                if current_record:
-                    records.append(current_record)
-                    current_record = {}
-            else:
-                current_record[tag] = value
-        
-        added = 0
-        updated = 0
-        
-        for record in records:
-            # 检查必要字段
-            if not all(k in record for k in ['CALL', 'QSO_DATE', 'TIME_ON', 'BAND', 'MODE']):
-                continue
-            
-            # 构建查询条件
-            conditions = {
-                'callsign': record['CALL'],
-                'qso_date': record['QSO_DATE'],
-                'time_on': record['TIME_ON'],
-                'band': record['BAND'],
-                'mode': record['MODE']
-            }
-            
-            # 检查记录是否存在
-            existing = execute_query("""
-                SELECT id, confirmed FROM qso_log 
-                WHERE callsign = %(callsign)s 
-                AND qso_date = %(qso_date)s 
-                AND time_on = %(time_on)s 
-                AND band = %(band)s 
-                AND mode = %(mode)s
-                LIMIT 1
-            """, conditions, fetch=True)
-            
-            # 处理LOTW确认状态
-            lotw_confirmed = record.get('LOTW_QSL_RCVD', '').upper() == 'Y'
-            
-            if not existing:
-                # 插入新记录
-                new_record = conditions.copy()
-                new_record.update({
-                    'confirmed': 1 if lotw_confirmed else 0,
-                    'lotw_qsl_rcvd': 'Y' if lotw_confirmed else 'N',
-                    'dxcc': record.get('DXCC'),
-                    'grid': record.get('GRIDSQUARE'),
-                    'province': record.get('STATE')
-                })
-                
-                execute_query("""
-                    INSERT INTO qso_log (
-                        callsign, qso_date, time_on, band, mode,
-                        dxcc, grid, province, confirmed, lotw_qsl_rcvd
-                    ) VALUES (
-                        %(callsign)s, %(qso_date)s, %(time_on)s, %(band)s, %(mode)s,
-                        %(dxcc)s, %(grid)s, %(province)s, %(confirmed)s, %(lotw_qsl_rcvd)s
-                    )
-                """, new_record)
-                added += 1
-            elif not existing[0]['confirmed'] and lotw_confirmed:
-                # 更新确认状态
-                execute_query("""
-                    UPDATE qso_log 
-                    SET confirmed = 1, 
-                        lotw_qsl_rcvd = 'Y',
-                        last_sync_time = NOW() 
-                    WHERE id = %s
-                """, (existing[0]['id'],))
-                updated += 1
-        
-        return (added, updated)
+        from adif import read_adi_records
+        from adif_import import import_records
+
+        encoding = self.config.get('SETTINGS', 'encoding', fallback='utf-8')
+        records = read_adi_records(filepath, encoding)
+
+        latest = None
+        if sync_mark:
+            field = self.SYNC_MARKS[sync_mark]
+
+            def track(records):
+                # 导入的同时记录最新的LOTW接收时间
+                nonlocal latest
+                for record in records:
+                    value = record.get(field)
+                    if value and (latest is None or value > latest):
+                        latest = value
+                    yield record
+
+            records = track(records)
+
+        stats = import_records(records)
+        logger.info(f"ADI文件处理完成: {filepath}, {stats['rows_per_second']} 条/秒")
+
+        if latest and latest > (self.get_sync_mark(sync_mark) or ''):
+            self.set_sync_mark(sync_mark, latest)
+        return (stats['added'], stats['updated'])
 
     def convert_to_adi(self, qso_records):
         """
         将QSO记录转换为ADI格式
-        :param qso_records: QSO记录列表
+        :param qso_records: qso_log 行字典列表，列名按 adif_export.EXPORT_FIELDS 转换为ADIF字段
         :return: ADI格式字符串
         """
-        adi_header = """Generated by QSL Logger
-                    <ADIF_VER:5>3.1.0
-                    <PROGRAMID:11>QSL Logger
-                    <PROGRAMVERSION:5>1.0.0
-                    <EOH>
-                    """
-        adi_lines = []
-        
-        for qso in qso_records:
-            adi_line = []
-            for field, value in qso.items():
-                if value:
-                    adi_line.append(f"<{field.upper()}:{len(str(value))}>{value}")
-            adi_lines.append("".join(adi_line) + "<EOR>")
-        
-        return adi_header + "\n".join(adi_lines)
+        from adif import iter_adi
+        from adif_export import row_to_adif_record
+
+        return "".join(iter_adi(row_to_adif_record(qso) for qso in qso_records))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,230 @@
+"""
+LOTW后台上传
+后台线程按批领取 sync_status=0 的日志，每批生成一个ADI文件上传到LOTW，
+web请求只负责唤醒，不等待LOTW响应
+
+状态流转(每一步都在一个事务中完成):
+    0-未同步 -> 1-同步中 (领取)
+    1-同步中 -> 2-已同步 (上传成功) / 3-同步失败 (重试次数用尽)
+进程异常退出时停留在 1 的记录超过 upload_claim_timeout 秒后重新置为 0
+
+命令行用法: python lotw_uploader.py [--once]
+"""
+
+import logging
+import threading
+import time
+
+from db_utils import config, execute_query, transaction
+from lotw_handler import LOTWHandler
+import qso_events
+
+logger = logging.getLogger(__name__)
+
+STATUS_PENDING = 0
+STATUS_UPLOADING = 1
+STATUS_UPLOADED = 2
+STATUS_FAILED = 3
+
+BATCH_SIZE = config.getint('LOTW', 'upload_batch_size', fallback=100)
+WORKERS = config.getint('LOTW', 'upload_workers', fallback=1)
+MAX_RETRIES = config.getint('LOTW', 'upload_max_retries', fallback=5)
+# 第n次重试前等待 retry_delay * 2^(n-1) 秒，最长 MAX_RETRY_DELAY 秒
+RETRY_DELAY = config.getfloat('LOTW', 'upload_retry_delay', fallback=2)
+MAX_RETRY_DELAY = 300
+# 没有待上传记录时的轮询间隔(秒)
+POLL_INTERVAL = config.getfloat('LOTW', 'upload_interval', fallback=60)
+CLAIM_TIMEOUT = config.getint('LOTW', 'upload_claim_timeout', fallback=600)
+
+
+def _set_status(ids, status, expected):
+    """
+    将处于 expected 状态的记录改为 status
+    :return: 实际修改的记录(修改前的行)
+    """
+    if not ids:
+        return []
+    placeholders = ", ".join(["%s"] * len(ids))
+    with transaction():
+        old = execute_query(f"""
+            SELECT * FROM qso_log WHERE id IN ({placeholders}) AND sync_status = %s FOR UPDATE
+        """, (*ids, expected), fetch=True)
+        if not old:
+            return []
+        changed = {"sync_status": status}
+        if status == STATUS_UPLOADED:
+            changed["lotw_qsl_sent"] = 'Y'
+        assignments = ", ".join(f"{field} = %s" for field in changed)
+        placeholders = ", ".join(["%s"] * len(old))
+        execute_query(f"""
+            UPDATE qso_log SET {assignments}, last_sync_time = NOW() WHERE id IN ({placeholders})
+        """, (*changed.values(), *(row['id'] for row in old)))
+        # 同步状态也显示在日志列表中，需要让读接口的缓存失效
+        qso_events.publish(removed=old, added=[{**row, **changed} for row in old])
+    return old
+
+
+def claim_batch(limit=BATCH_SIZE):
+    """领取一批待上传的记录(0 -> 1)，多个线程或进程同时领取不会得到重复的记录"""
+    with transaction():
+        rows = execute_query("""
+            SELECT id FROM qso_log WHERE sync_status = %s ORDER BY id LIMIT %s FOR UPDATE
+        """, (STATUS_PENDING, limit), fetch=True)
+        return _set_status([row['id'] for row in rows], STATUS_UPLOADING, STATUS_PENDING)
+
+
+def release_stale_claims(timeout=CLAIM_TIMEOUT):
+    """将长时间停留在同步中的记录重新置为未同步(上传进程异常退出后恢复)"""
+    rows = execute_query("""
+        SELECT id FROM qso_log
+        WHERE sync_status = %s AND (last_sync_time IS NULL OR last_sync_time < NOW() - INTERVAL %s SECOND)
+    """, (STATUS_UPLOADING, timeout), fetch=True)
+    return len(_set_status([row['id'] for row in rows], STATUS_PENDING, STATUS_UPLOADING))
+
+
+def retry_failed():
+    """将上传失败的记录重新加入上传队列"""
+    rows = execute_query("SELECT id FROM qso_log WHERE sync_status = %s", (STATUS_FAILED,), fetch=True)
+    return len(_set_status([row['id'] for row in rows], STATUS_PENDING, STATUS_FAILED))
+
+
+class LOTWUploader:
+    """后台上传线程池"""
+
+    def __init__(self, workers=WORKERS, batch_size=BATCH_SIZE, max_retries=MAX_RETRIES,
+                 retry_delay=RETRY_DELAY, poll_interval=POLL_INTERVAL, handler_factory=LOTWHandler):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.handler_factory = handler_factory
+        self._threads = []
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self.stats = {'batches': 0, 'uploaded': 0, 'failed': 0, 'retries': 0, 'last_error': None}
+
+    def _count(self, **changes):
+        with self._lock:
+            for name, value in changes.items():
+                if name == 'last_error':
+                    self.stats[name] = value
+                else:
+                    self.stats[name] += value
+
+    def upload(self, handler, rows):
+        """
+        上传一批记录，失败时按指数退避重试
+        :return: 是否上传成功
+        """
+        payload = handler.convert_to_adi(rows)
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                delay = min(self.retry_delay * 2 ** (attempt - 1), MAX_RETRY_DELAY)
+                self._count(retries=1)
+                logger.warning(f"LOTW上传失败，{delay:.0f} 秒后第 {attempt} 次重试")
+                if self._stop.wait(delay):
+                    return False
+            if handler.submit_log(payload):
+                return True
+        return False
+
+    def run_once(self, handler=None):
+        """
+        领取并上传一批记录
+        :return: 本批记录数，没有待上传记录时为0
+        """
+        rows = claim_batch(self.batch_size)
+        if not rows:
+            return 0
+        handler = handler or self.handler_factory()
+        ids = [row['id'] for row in rows]
+        try:
+            success = self.upload(handler, rows)
+        except Exception as e:
+            logger.error(f"LOTW上传出错: {str(e)}")
+            success = False
+        if success:
+            _set_status(ids, STATUS_UPLOADED, STATUS_UPLOADING)
+            self._count(batches=1, uploaded=len(ids))
+        elif self._stop.is_set():
+            # 停止时未完成的批次退回队列
+            _set_status(ids, STATUS_PENDING, STATUS_UPLOADING)
+        else:
+            _set_status(ids, STATUS_FAILED, STATUS_UPLOADING)
+            self._count(batches=1, failed=len(ids), last_error=f"{len(ids)} 条记录上传失败，重试次数用尽")
+        return len(ids)
+
+    def _run(self):
+        # requests.Session 不是线程安全的，每个线程使用自己的LOTWHandler
+        handler = None
+        while not self._stop.is_set():
+            try:
+                handler = handler or self.handler_factory()
+                release_stale_claims()
+                if self.run_once(handler):
+                    continue
+            except Exception as e:
+                logger.error(f"LOTW上传线程出错: {str(e)}")
+                self._count(last_error=str(e))
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"lotw-uploader-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"LOTW上传线程已启动: {self.workers} 个")
+
+    def is_running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def wake(self):
+        """有新的待上传记录时立即开始处理，不等待轮询间隔"""
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+
+def get_queue_status():
+    """各同步状态的记录数"""
+    rows = execute_query("SELECT sync_status, COUNT(*) AS count FROM qso_log GROUP BY sync_status", fetch=True)
+    names = {STATUS_PENDING: 'pending', STATUS_UPLOADING: 'uploading',
+             STATUS_UPLOADED: 'uploaded', STATUS_FAILED: 'failed'}
+    status = {name: 0 for name in names.values()}
+    for row in rows:
+        if row['sync_status'] in names:
+            status[names[row['sync_status']]] = int(row['count'])
+    return status
+
+
+# 由 server.py 按配置启动
+uploader = LOTWUploader()
+
+
+if __name__ == '__main__':
+    import sys
+    from db_utils import init_db_pool
+
+    init_db_pool()
+    if sys.argv[1:] == ['--once']:
+        while uploader.run_once():
+            pass
+        print(uploader.stats)
+    else:
+        uploader.start()
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            uploader.stop()
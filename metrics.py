@@ -0,0 +1,215 @@
+"""
+运行指标
+进程内统计接口延迟、SQL耗时、连接池等待和LOTW请求耗时，由 /metrics 以 Prometheus 文本格式输出
+(不依赖 prometheus_client)。多个工作进程时每个进程各自统计，由 Prometheus 按实例汇总
+
+接口延迟在 init_app 注册的请求钩子中统计，流式响应(如ADIF导出)只统计到开始返回数据为止；
+[METRICS] timing_header = true 时每个响应附带 Server-Timing 头(接口总耗时、SQL耗时和语句数)
+"""
+
+import bisect
+import re
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+# 默认分桶(秒)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    return repr(float(value)) if value != float('inf') else "+Inf"
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+
+
+class Counter(_Metric):
+    """只增不减的计数"""
+
+    type = "counter"
+
+    def __init__(self, name, help, labels=(), max_series=None):
+        super().__init__(name, help, labels)
+        self._values = {}
+        # 标签组合超过上限后归入 "other"，防止序列数无限增长
+        self.max_series = max_series
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, '') for n in self.label_names)
+        with self._lock:
+            if key not in self._values and self.max_series and len(self._values) >= self.max_series:
+                key = ('other',) * len(self.label_names)
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [f"{self.name}{_labels(self.label_names, k)} {_number(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    """分桶统计耗时，输出累计分桶、总和与次数"""
+
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # 标签值 -> [各分桶(非累计)次数..., 超出最大分桶的次数], 总和
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, '') for n in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """统计代码块耗时，出现异常时 outcome 标签为 error(需声明 outcome 标签)"""
+        started = time.perf_counter()
+        outcome = 'ok'
+        try:
+            yield
+        except BaseException:
+            outcome = 'error'
+            raise
+        finally:
+            if 'outcome' in self.label_names:
+                labels['outcome'] = outcome
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        with self._lock:
+            items = sorted((k, (list(counts), total)) for k, (counts, total) in self._values.items())
+        lines = self._header()
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+class Callback(_Metric):
+    """输出时调用函数取值(连接池占用、队列长度等已有统计)"""
+
+    def __init__(self, name, help, func, type="gauge"):
+        super().__init__(name, help)
+        self.type = type
+        self.func = func
+
+    def render(self):
+        try:
+            value = self.func()
+        except Exception:
+            return []
+        return self._header() + [f"{self.name} {_number(value)}"]
+
+
+def render():
+    """所有指标的 Prometheus 文本格式"""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(query):
+    """
+    归一化SQL用于统计和慢查询日志: 合并空白，常量和参数替换为 ?，IN列表和多行VALUES折叠
+    """
+    sql = " ".join(query.split())
+    sql = re.sub(r"'(?:[^'\\]|\\.|'')*'", "?", sql)
+    sql = re.sub(r"%(?:\(\w+\))?s|\b\d+(?:\.\d+)?\b", "?", sql)
+    sql = re.sub(r"\(\?(?:, ?\?)+\)", "(?, ...)", sql)
+    sql = re.sub(r"\((\?, \.\.\.|\?)\)(?:, ?\((?:\?, \.\.\.|\?)\))+", r"(\1), ...", sql)
+    return sql
+
+
+# 接口
+http_request_seconds = Histogram(
+    "cnhamlog_http_request_duration_seconds", "接口处理耗时(秒)", ("method", "route", "status"))
+# SQL
+db_query_seconds = Histogram(
+    "cnhamlog_db_query_duration_seconds", "SQL语句耗时(秒)，按语句类型", ("operation",))
+db_statement_seconds = Counter(
+    "cnhamlog_db_statement_seconds_total", "各归一化SQL语句累计耗时(秒)", ("statement",), max_series=500)
+db_statement_calls = Counter(
+    "cnhamlog_db_statement_calls_total", "各归一化SQL语句执行次数", ("statement",), max_series=500)
+db_slow_queries = Counter(
+    "cnhamlog_db_slow_queries_total", "超过 slow_query_ms 的SQL语句数", ("operation",))
+# 连接池
+db_pool_wait_seconds = Histogram(
+    "cnhamlog_db_pool_wait_seconds", "从连接池取连接的等待时间(秒)",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10))
+# LOTW
+lotw_request_seconds = Histogram(
+    "cnhamlog_lotw_request_duration_seconds", "LOTW HTTP请求耗时(秒)，下载包含写入文件",
+    ("operation", "outcome"), buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120))
+
+
+def init_app(app):
+    """注册请求计时钩子"""
+    from flask import g, request
+    from db_utils import config
+
+    timing_header = config.getboolean('METRICS', 'timing_header', fallback=False)
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+        g.db_seconds = 0.0
+        g.db_queries = 0
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        # 按路由规则统计(如 /api/logs/<int:log_id>)，不按实际路径，避免序列数随ID增长
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        http_request_seconds.observe(elapsed, method=request.method, route=route, status=response.status_code)
+        if timing_header:
+            response.headers['Server-Timing'] = (
+                f'app;dur={elapsed * 1000:.1f}, '
+                f'db;dur={g.get("db_seconds", 0.0) * 1000:.1f};desc="{g.get("db_queries", 0)} queries"'
+            )
+        return response
@@ -0,0 +1,409 @@
+"""
+数据库结构迁移
+schema_version 表记录已执行的迁移版本。启动时只需一次查询比较版本号，
+有未执行的迁移时在数据库命名锁(GET_LOCK)保护下按顺序执行，多个进程同时启动也不会重复执行
+迁移语句按MySQL语法编写，SQLite后端执行前自动转换(见 sqlite_backend.py)，
+查询表结构和增删索引的语句两种后端不同，由下面的辅助函数区分
+
+新增表结构改动时在 MIGRATIONS 末尾追加，已发布的迁移不要修改
+命令行用法: python migrations.py [status]
+"""
+
+import db_utils
+from db_utils import DatabaseError, execute_query, transaction
+
+# 迁移锁名称及等待时间(秒)
+LOCK_NAME = 'qso_log_schema_migration'
+LOCK_TIMEOUT = 60
+
+# MySQL错误码：表不存在(SQLite后端的异常使用相同的错误码)
+ER_NO_SUCH_TABLE = 1146
+
+
+def _is_sqlite():
+    return db_utils.BACKEND == 'sqlite'
+
+
+def _column_exists(table_name, column_name):
+    if _is_sqlite():
+        columns = execute_query(f"PRAGMA table_info({table_name})", fetch=True)
+        return any(column['name'] == column_name for column in columns)
+    result = execute_query("""
+        SELECT COUNT(*) AS count
+        FROM INFORMATION_SCHEMA.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (table_name, column_name), fetch=True)
+    return result[0]['count'] > 0
+
+
+def _index_exists(table_name, index_name):
+    if _is_sqlite():
+        result = execute_query("""
+            SELECT COUNT(*) AS count FROM sqlite_master
+            WHERE type = 'index' AND tbl_name = %s AND name = %s
+        """, (table_name, index_name), fetch=True)
+        return result[0]['count'] > 0
+    result = execute_query("""
+        SELECT COUNT(*) AS count
+        FROM INFORMATION_SCHEMA.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+    """, (table_name, index_name), fetch=True)
+    return result[0]['count'] > 0
+
+
+# 以下操作都可重复执行：从旧版本(启动时探测表结构)升级的数据库中部分对象已经存在
+
+def add_column(table_name, column_name, column_def):
+    if not _column_exists(table_name, column_name):
+        execute_query(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_def}")
+        print(f"已成功添加列: {table_name}.{column_name}")
+
+
+def add_index(table_name, index_name, index_def, unique=False):
+    if not _index_exists(table_name, index_name):
+        index_type = 'UNIQUE INDEX' if unique else 'INDEX'
+        if _is_sqlite():
+            execute_query(f"CREATE {index_type} {index_name} ON {table_name} {index_def}")
+        else:
+            execute_query(f"ALTER TABLE {table_name} ADD {index_type} {index_name} {index_def}")
+        print(f"已成功添加索引: {table_name}.{index_name}")
+
+
+def drop_index(table_name, index_name):
+    if _index_exists(table_name, index_name):
+        if _is_sqlite():
+            execute_query(f"DROP INDEX {index_name}")
+        else:
+            execute_query(f"ALTER TABLE {table_name} DROP INDEX {index_name}")
+        print(f"已删除索引: {table_name}.{index_name}")
+
+
+def remove_duplicate_qsos(key_columns):
+    """
+    删除唯一键列相同的重复日志，每组保留 id 最小的一条，其余记录的确认状态合并到保留的记录
+    键列中有 NULL 的记录不受唯一键约束，不处理
+    :param key_columns: 唯一键的列
+    :return: 删除的记录数
+    """
+    key = ", ".join(key_columns)
+    not_null = " AND ".join(f"{column} IS NOT NULL" for column in key_columns)
+    groups = execute_query(f"""
+        SELECT MIN(id) AS keep_id, COUNT(*) AS count, {key},
+               MAX(confirmed) AS confirmed, MAX(lotw_qsl_rcvd) AS lotw_qsl_rcvd, MAX(lotw_qsl_sent) AS lotw_qsl_sent
+        FROM qso_log WHERE {not_null}
+        GROUP BY {key} HAVING COUNT(*) > 1
+    """, fetch=True)
+    removed = 0
+    for group in groups:
+        with transaction() as cursor:
+            cursor.execute(
+                "UPDATE qso_log SET confirmed = %s, lotw_qsl_rcvd = %s, lotw_qsl_sent = %s WHERE id = %s",
+                (group['confirmed'], group['lotw_qsl_rcvd'], group['lotw_qsl_sent'], group['keep_id'])
+            )
+            conditions = " AND ".join(f"{column} = %s" for column in key_columns)
+            cursor.execute(f"DELETE FROM qso_log WHERE {conditions} AND id <> %s",
+                           [group[column] for column in key_columns] + [group['keep_id']])
+        removed += group['count'] - 1
+    if removed:
+        print(f"已删除重复日志: {removed} 条")
+    return removed
+
+
+def _m001_create_qso_log():
+    execute_query("""
+        CREATE TABLE IF NOT EXISTS qso_log (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            callsign VARCHAR(10) NOT NULL,
+            frequency FLOAT NOT NULL,
+            mode VARCHAR(10) NOT NULL,
+            equipment VARCHAR(50),
+            antenna VARCHAR(50),
+            power FLOAT,
+            date DATE,
+            time VARCHAR(10) NOT NULL,
+            notes TEXT
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+
+
+def _m002_add_qso_log_columns():
+    columns_to_add = [
+        ('dxcc', 'VARCHAR(10)'),
+        ('grid', 'VARCHAR(10)'),
+        ('province', 'VARCHAR(20)'),
+        ('band', 'VARCHAR(10)'),
+        ('qslcard', 'TINYINT DEFAULT 0 COMMENT \'0-未发卡,1-已发卡,2-eyeball\''),
+        ('confirmed', 'BOOLEAN DEFAULT FALSE'),
+        ('sync_status', 'TINYINT DEFAULT 0 COMMENT \'0-未同步,1-同步中,2-已同步,3-同步失败\''),
+        ('last_sync_time', 'DATETIME'),
+        ('lotw_qsl_rcvd', 'VARCHAR(1) COMMENT \'Y-已收到,N-未收到\''),
+        ('lotw_qsl_sent', 'VARCHAR(1) COMMENT \'Y-已发送,N-未发送\'')
+    ]
+    for column_name, column_def in columns_to_add:
+        add_column('qso_log', column_name, column_def)
+
+
+def _m003_add_qso_log_indexes():
+    # 日志列表按 date DESC, time DESC 排序并以 (date, time, id) 作为游标分页
+    add_index('qso_log', 'idx_qso_log_date_time_id', '(date, time, id)')
+    # 按呼号查询历史记录: WHERE callsign = ? ORDER BY date DESC, time DESC
+    add_index('qso_log', 'idx_qso_log_callsign_date_time', '(callsign, date, time)')
+
+
+def _m004_add_qso_log_identity_key():
+    # QSO唯一标识，ADIF批量导入、LOTW同步和写入队列重放依赖它执行 INSERT ... ON DUPLICATE KEY UPDATE，
+    # 已有重复记录时先删除，否则无法添加唯一键(统计表在之后的迁移中构建)
+    if not _index_exists('qso_log', 'uq_qso_log_identity'):
+        remove_duplicate_qsos(('callsign', 'date', 'time', 'band', 'mode'))
+    add_index('qso_log', 'uq_qso_log_identity', '(callsign, date, time, band, mode)', unique=True)
+
+
+def _m005_create_lotw_sync_state():
+    # LOTW增量同步的高水位标记
+    execute_query("""
+        CREATE TABLE IF NOT EXISTS lotw_sync_state (
+            name VARCHAR(32) PRIMARY KEY,
+            value VARCHAR(32) NOT NULL,
+            updated_at DATETIME NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+
+
+def _m006_create_qso_counts():
+    # 按 (波段, 模式, 年份) 维护的记录数，见 qso_stats.py
+    from qso_stats import rebuild_counts
+
+    execute_query("""
+        CREATE TABLE IF NOT EXISTS qso_counts (
+            band VARCHAR(10) NOT NULL DEFAULT '',
+            mode VARCHAR(10) NOT NULL DEFAULT '',
+            year SMALLINT NOT NULL DEFAULT 0,
+            count INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (band, mode, year)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+    rebuild_counts()
+
+
+def _m007_create_award_tables():
+    # 奖状统计汇总表，见 qso_stats.py
+    from qso_stats import rebuild_awards
+
+    for table, key_def in (
+        ('award_dxcc', "dxcc VARCHAR(10) NOT NULL, band VARCHAR(10) NOT NULL DEFAULT '', "
+                       "mode VARCHAR(10) NOT NULL DEFAULT '', PRIMARY KEY (dxcc, band, mode)"),
+        ('award_province', "province VARCHAR(20) NOT NULL, band VARCHAR(10) NOT NULL DEFAULT '', "
+                           "PRIMARY KEY (province, band)"),
+        ('award_grid', "grid VARCHAR(4) NOT NULL, band VARCHAR(10) NOT NULL DEFAULT '', "
+                       "PRIMARY KEY (grid, band)"),
+    ):
+        execute_query(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                {key_def},
+                qso_count INT NOT NULL DEFAULT 0,
+                confirmed_count INT NOT NULL DEFAULT 0,
+                first_qso_date DATE
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """)
+    # 删除或修改记录后按奖状实体重新计算首次通联日期
+    add_index('qso_log', 'idx_qso_log_dxcc_date', '(dxcc, date)')
+    add_index('qso_log', 'idx_qso_log_province_date', '(province, date)')
+    add_index('qso_log', 'idx_qso_log_grid_date', '(grid, date)')
+    rebuild_awards()
+
+
+def _m008_add_filter_indexes():
+    # /api/logs 筛选条件使用的索引(见 log_filters.py)，筛选列之后接排序键，
+    # 等值筛选后按 date DESC, time DESC 分页无需额外排序
+    add_index('qso_log', 'idx_qso_log_band_mode_date', '(band, mode, date, time)')
+    add_index('qso_log', 'idx_qso_log_mode_date', '(mode, date, time)')
+    add_index('qso_log', 'idx_qso_log_dxcc_date_time', '(dxcc, date, time)')
+    add_index('qso_log', 'idx_qso_log_province_date_time', '(province, date, time)')
+    add_index('qso_log', 'idx_qso_log_qslcard_date', '(qslcard, date, time)')
+    add_index('qso_log', 'idx_qso_log_confirmed_date', '(confirmed, date, time)')
+    # 被上面的索引覆盖
+    drop_index('qso_log', 'idx_qso_log_dxcc_date')
+    drop_index('qso_log', 'idx_qso_log_province_date')
+
+
+def _m009_add_sync_status_index():
+    # lotw_uploader 按 sync_status 领取待上传记录
+    add_index('qso_log', 'idx_qso_log_sync_status', '(sync_status, id)')
+
+
+def _m010_create_grid_counts():
+    # 网格地图按 (网格, 波段, 模式) 维护的通联数和确认数，见 grids.py
+    from grids import rebuild
+
+    execute_query("""
+        CREATE TABLE IF NOT EXISTS grid_counts (
+            grid VARCHAR(6) NOT NULL,
+            band VARCHAR(10) NOT NULL DEFAULT '',
+            mode VARCHAR(10) NOT NULL DEFAULT '',
+            qso_count INT NOT NULL DEFAULT 0,
+            confirmed_count INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (grid, band, mode)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """)
+    rebuild()
+
+
+def _m011_add_qso_datetime_utc():
+    # date + time 规范化后的UTC时间(见 qso_time.py)，存量记录启动后在后台分批填充
+    add_column('qso_log', 'qso_datetime_utc', 'DATETIME NULL')
+    # 列表分页(游标为 (qso_datetime_utc, id))、时间范围筛选，以及查找待填充的记录
+    add_index('qso_log', 'idx_qso_log_utc_id', '(qso_datetime_utc, id)')
+    # 呼号历史和呼号前缀筛选
+    add_index('qso_log', 'idx_qso_log_callsign_utc', '(callsign, qso_datetime_utc)')
+    # 等值筛选后按时间倒序分页
+    add_index('qso_log', 'idx_qso_log_band_mode_utc', '(band, mode, qso_datetime_utc)')
+    add_index('qso_log', 'idx_qso_log_mode_utc', '(mode, qso_datetime_utc)')
+    add_index('qso_log', 'idx_qso_log_dxcc_utc', '(dxcc, qso_datetime_utc)')
+    add_index('qso_log', 'idx_qso_log_province_utc', '(province, qso_datetime_utc)')
+    add_index('qso_log', 'idx_qso_log_qslcard_utc', '(qslcard, qso_datetime_utc)')
+    add_index('qso_log', 'idx_qso_log_confirmed_utc', '(confirmed, qso_datetime_utc)')
+    # 不再按 (date, time) 排序；(dxcc, date, time)、(province, date, time) 仍用于重新计算奖状首次通联日期
+    for index_name in ('idx_qso_log_date_time_id', 'idx_qso_log_callsign_date_time', 'idx_qso_log_band_mode_date',
+                       'idx_qso_log_mode_date', 'idx_qso_log_qslcard_date', 'idx_qso_log_confirmed_date'):
+        drop_index('qso_log', index_name)
+
+
+def _m012_normalize_qso_time():
+    # time 列规范化为 HH:MM(见 qso_time.normalize_time)，使手工录入与LOTW报告中的同一QSO唯一键相同
+    import qso_time
+
+    rows = execute_query("SELECT id, time FROM qso_log WHERE time NOT LIKE '__:__'", fetch=True)
+    changes = []
+    for row in rows:
+        value = qso_time.normalize_time(row['time'])
+        if value != row['time']:
+            changes.append((row['id'], value))
+    if changes:
+        # 规范化后可能与已有记录重复，重新添加唯一键之前删除
+        drop_index('qso_log', 'uq_qso_log_identity')
+        for start in range(0, len(changes), 1000):
+            batch = changes[start:start + 1000]
+            cases = " ".join(["WHEN %s THEN %s"] * len(batch))
+            execute_query(
+                f"UPDATE qso_log SET time = CASE id {cases} END WHERE id IN ({', '.join(['%s'] * len(batch))})",
+                [v for pair in batch for v in pair] + [log_id for log_id, _ in batch]
+            )
+        print(f"已规范化时间: {len(changes)} 条")
+    # 迁移4 曾在存在重复记录时跳过唯一键，这里一并补上
+    removed = 0
+    if not _index_exists('qso_log', 'uq_qso_log_identity'):
+        removed = remove_duplicate_qsos(('callsign', 'date', 'time', 'band', 'mode'))
+    add_index('qso_log', 'uq_qso_log_identity', '(callsign, date, time, band, mode)', unique=True)
+    if removed:
+        from qso_stats import rebuild_counts, rebuild_awards
+        from grids import rebuild
+        rebuild_counts()
+        rebuild_awards()
+        rebuild()
+    if changes or removed:
+        import log_version
+        log_version.bump()
+
+
+def _m013_add_band_index():
+    # 只按波段筛选(最常用的筛选条件)时按时间倒序分页，(band, mode, qso_datetime_utc) 不能用于排序
+    add_index('qso_log', 'idx_qso_log_band_utc_id', '(band, qso_datetime_utc, id)')
+
+
+def _m014_qso_datetime_utc_not_null():
+    # 填充剩余的 qso_datetime_utc(date 无效的记录为 qso_time.UNKNOWN_UTC)后改为 NOT NULL，
+    # 游标分页、查重时段的条件不再需要 IS NULL 分支，可以直接按索引范围查找
+    import qso_time
+
+    filled = qso_time.backfill(pause=0)
+    if filled:
+        print(f"已填充QSO时间: {filled} 条")
+    # SQLite 不支持修改列定义，由写入路径(qso_time.fill)保证不为空
+    if not _is_sqlite():
+        execute_query("ALTER TABLE qso_log MODIFY qso_datetime_utc DATETIME NOT NULL")
+
+
+# (版本号, 名称, 迁移函数)，版本号必须递增
+MIGRATIONS = [
+    (1, 'create_qso_log', _m001_create_qso_log),
+    (2, 'add_qso_log_columns', _m002_add_qso_log_columns),
+    (3, 'add_qso_log_indexes', _m003_add_qso_log_indexes),
+    (4, 'add_qso_log_identity_key', _m004_add_qso_log_identity_key),
+    (5, 'create_lotw_sync_state', _m005_create_lotw_sync_state),
+    (6, 'create_qso_counts', _m006_create_qso_counts),
+    (7, 'create_award_tables', _m007_create_award_tables),
+    (8, 'add_filter_indexes', _m008_add_filter_indexes),
+    (9, 'add_sync_status_index', _m009_add_sync_status_index),
+    (10, 'create_grid_counts', _m010_create_grid_counts),
+    (11, 'add_qso_datetime_utc', _m011_add_qso_datetime_utc),
+    (12, 'normalize_qso_time', _m012_normalize_qso_time),
+    (13, 'add_band_index', _m013_add_band_index),
+    (14, 'qso_datetime_utc_not_null', _m014_qso_datetime_utc_not_null),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version():
+    """当前数据库结构版本，未执行过迁移时为0"""
+    try:
+        result = execute_query("SELECT MAX(version) AS version FROM schema_version", fetch=True)
+    except DatabaseError as err:
+        if err.errno == ER_NO_SUCH_TABLE:
+            return 0
+        raise
+    return result[0]['version'] or 0
+
+
+def migrate():
+    """
+    执行未执行的迁移
+    :return: 本次执行的迁移版本号列表
+    """
+    if get_schema_version() >= LATEST_VERSION:
+        return []
+
+    applied = []
+    # 命名锁属于会话，整个迁移过程固定使用同一个连接
+    with transaction() as cursor:
+        cursor.execute("SELECT GET_LOCK(%s, %s) AS locked", (LOCK_NAME, LOCK_TIMEOUT))
+        if not cursor.fetchone()['locked']:
+            raise RuntimeError("等待数据库迁移锁超时，可能有其他进程正在执行迁移")
+        try:
+            execute_query("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INT PRIMARY KEY,
+                    name VARCHAR(100) NOT NULL,
+                    applied_at DATETIME NOT NULL
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            """)
+            # 获得锁后重新读取版本，其他进程可能已经完成迁移
+            current = get_schema_version()
+            for version, name, func in MIGRATIONS:
+                if version <= current:
+                    continue
+                print(f"正在执行数据库迁移 {version}: {name}")
+                func()
+                execute_query(
+                    "INSERT INTO schema_version (version, name, applied_at) VALUES (%s, %s, NOW())",
+                    (version, name)
+                )
+                # DDL会隐式提交，这里同时提交版本记录，避免后续迁移失败时丢失
+                cursor.execute("COMMIT")
+                applied.append(version)
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+            cursor.fetchall()
+    return applied
+
+
+if __name__ == '__main__':
+    import sys
+    from db_utils import init_db_pool
+
+    init_db_pool()
+    if sys.argv[1:] == ['status']:
+        print(f"当前版本: {get_schema_version()}，最新版本: {LATEST_VERSION}")
+    else:
+        applied = migrate()
+        print(f"已执行迁移: {applied}" if applied else "数据库结构已是最新")
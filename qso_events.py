@@ -0,0 +1,59 @@
+"""
+QSO变更通知
+所有写 qso_log 的路径(新增、修改、删除、ADIF导入)都在写入所在的事务中调用 publish，
+由这里统一更新依赖日志数据的统计表和缓存
+
+内存索引在写入的进程中按变更前后的行增量更新；其他工作进程在使用索引时发现日志版本变化，
+只有新增时读取新增的行增量更新，有修改、删除时重新构建(见 log_version.py)
+"""
+
+from db_utils import on_commit
+import callsign_index
+import dupe_check
+import grids
+import log_version
+import qso_stats
+
+
+def publish(removed=(), added=()):
+    """
+    通知一次日志变更，需在 db_utils.transaction() 内调用
+    :param removed: 变更前的行(删除或修改前的完整行字典)
+    :param added: 变更后的行(新增或修改后的完整行字典)
+    修改记录时同一行会同时出现在 removed 和 added 中
+    """
+    removed, added = list(removed), list(added)
+    if not removed and not added:
+        return
+    # 统计表与日志数据在同一事务中提交或回滚
+    qso_stats.apply_changes(removed, added)
+    grids.apply_changes(removed, added)
+    # 内存索引和缓存只在事务提交后更新
+    on_commit(lambda: _after_commit(removed, added))
+
+
+def _inserted_ids(removed, added):
+    """
+    变更只包含新增(以及内容未变的行，如ADIF导入中重复的记录)时返回新增记录的id，否则返回 None
+    """
+    before = {row.get('id'): row for row in removed}
+    ids = []
+    for row in added:
+        if row.get('id') is None:
+            return None
+        if row['id'] in before:
+            if before.pop(row['id']) != row:
+                return None
+        else:
+            ids.append(row['id'])
+    return None if before else ids
+
+
+def _after_commit(removed, added):
+    callsign_index.apply_changes(removed, added)
+    dupe_check.apply_changes(removed, added)
+    # 更新日志版本，读接口的 ETag 和响应缓存随之失效；
+    # 期间没有其他进程写入时，已增量更新的索引直接对应新版本，不必重新构建
+    previous, version = log_version.advance(_inserted_ids(removed, added))
+    callsign_index.advance_version(previous, version)
+    dupe_check.advance_version(previous, version)
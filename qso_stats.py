@@ -0,0 +1,277 @@
+"""
+QSO统计模块
+qso_counts 表按 (波段, 模式, 年份) 维护记录数，随日志写入增量更新，
+总数和分组统计都只需读取这张小表，不再对 qso_log 执行 COUNT(*)
+
+奖状统计(DXCC、省份、网格)同样由汇总表增量维护:
+award_dxcc (dxcc, band, mode)、award_province (province, band)、award_grid (grid, band)
+每个键记录通联数、确认数和首次通联日期，通联数/确认数大于0即为已通联/已确认
+
+命令行用法: python qso_stats.py rebuild   (按 qso_log 重新计算统计表)
+"""
+
+from collections import Counter
+
+from db_utils import execute_query, transaction
+
+# 可用的分组维度
+COUNT_DIMENSIONS = ('band', 'mode', 'year')
+
+
+def _year_of(value):
+    """从 date 对象或 'YYYY-MM-DD' 字符串中取年份，无法识别时为0"""
+    if value is None:
+        return 0
+    if hasattr(value, 'year'):
+        return value.year
+    text = str(value)[:4]
+    return int(text) if text.isdigit() else 0
+
+
+def _count_key(row):
+    return ((row.get('band') or '')[:10], (row.get('mode') or '')[:10], _year_of(row.get('date')))
+
+
+def apply_changes(removed, added):
+    """按变更前后的行更新 qso_counts 和奖状汇总表，需在写入日志的同一事务中调用"""
+    _apply_count_changes(removed, added)
+    apply_award_changes(removed, added)
+
+
+def _apply_count_changes(removed, added):
+    deltas = Counter()
+    for row in removed:
+        deltas[_count_key(row)] -= 1
+    for row in added:
+        deltas[_count_key(row)] += 1
+    deltas = [(band, mode, year, delta) for (band, mode, year), delta in deltas.items() if delta]
+    if not deltas:
+        return
+
+    placeholders = ", ".join(["(%s, %s, %s, %s)"] * len(deltas))
+    execute_query(f"""
+        INSERT INTO qso_counts (band, mode, year, count) VALUES {placeholders}
+        ON DUPLICATE KEY UPDATE count = count + VALUES(count)
+    """, [value for delta in deltas for value in delta])
+
+
+# 奖状类型 -> (汇总表, 键列)，第一列为奖状实体，为空的日志不计入
+AWARD_TABLES = {
+    'dxcc': ('award_dxcc', ('dxcc', 'band', 'mode')),
+    'province': ('award_province', ('province', 'band')),
+    'grid': ('award_grid', ('grid', 'band')),
+}
+
+# 键列 -> (规范化函数, 重建时对应的SQL表达式)，两者必须得到相同的值
+_AWARD_COLUMNS = {
+    'dxcc': (lambda v: v.strip().upper()[:10], "UPPER(TRIM(dxcc))"),
+    'province': (lambda v: v.strip()[:20], "TRIM(province)"),
+    # 奖状按4位网格(如 OM89)统计
+    'grid': (lambda v: v.strip().upper()[:4], "UPPER(LEFT(TRIM(grid), 4))"),
+    'band': (lambda v: v.strip().lower()[:10], "COALESCE(LOWER(TRIM(band)), '')"),
+    'mode': (lambda v: v.strip().upper()[:10], "COALESCE(UPPER(TRIM(mode)), '')"),
+}
+
+
+def _award_key(columns, row):
+    """从日志行取汇总表的键，奖状实体为空(或网格不足4位)时返回 None"""
+    key = tuple(_AWARD_COLUMNS[c][0](str(row.get(c) or '')) for c in columns)
+    if not key[0] or (columns[0] == 'grid' and len(key[0]) < 4):
+        return None
+    return key
+
+
+def _date_of(value):
+    """统一为 'YYYY-MM-DD' 字符串，便于比较"""
+    if value is None:
+        return None
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()[:10]
+    return str(value)[:10] or None
+
+
+def _apply_award_changes(table, columns, removed, added):
+    # 键 -> [通联数增量, 确认数增量, 新增记录中最早的日期]
+    deltas = {}
+    # 键 -> 各日期的净删除数，修改记录时删除后又加回的日期相互抵消
+    date_changes = {}
+    for rows, sign in ((removed, -1), (added, 1)):
+        for row in rows:
+            key = _award_key(columns, row)
+            if key is None:
+                continue
+            date = _date_of(row.get('date'))
+            delta = deltas.setdefault(key, [0, 0, None])
+            delta[0] += sign
+            delta[1] += sign if row.get('confirmed') else 0
+            date_changes.setdefault(key, Counter())[date] -= sign
+            if sign > 0 and date and (delta[2] is None or date < delta[2]):
+                delta[2] = date
+    # 删除了某个日期的记录，首次通联日期可能改变，需要按 qso_log 重新计算
+    recompute = [key for key, dates in date_changes.items() if any(n > 0 for n in dates.values())]
+    # 统计键、日期和确认状态都不变的修改无需写入
+    values = [key + tuple(delta) for key, delta in deltas.items()
+              if delta[0] or delta[1] or any(n < 0 for n in date_changes[key].values())]
+    if values:
+        names = ", ".join(columns)
+        placeholders = ", ".join(["(" + ", ".join(["%s"] * (len(columns) + 3)) + ")"] * len(values))
+        execute_query(f"""
+            INSERT INTO {table} ({names}, qso_count, confirmed_count, first_qso_date) VALUES {placeholders}
+            ON DUPLICATE KEY UPDATE
+                qso_count = qso_count + VALUES(qso_count),
+                confirmed_count = confirmed_count + VALUES(confirmed_count),
+                first_qso_date = LEAST(COALESCE(first_qso_date, VALUES(first_qso_date)),
+                                       COALESCE(VALUES(first_qso_date), first_qso_date))
+        """, [value for row in values for value in row])
+    if recompute:
+        # 奖状实体列直接比较以使用索引，其余列与重建时的表达式一致
+        entity = columns[0]
+        match = [f"q.{entity} LIKE CONCAT(a.{entity}, '%%')" if entity == 'grid' else f"q.{entity} = a.{entity}"]
+        match += [f"{_AWARD_COLUMNS[c][1]} = a.{c}" for c in columns[1:]]
+        key_match = "(" + ", ".join(f"a.{c}" for c in columns) + ")"
+        placeholders = ", ".join(["(" + ", ".join(["%s"] * len(columns)) + ")"] * len(recompute))
+        execute_query(f"""
+            UPDATE {table} a SET first_qso_date = (
+                SELECT MIN(q.date) FROM qso_log q WHERE {" AND ".join(match)}
+            )
+            WHERE {key_match} IN ({placeholders})
+        """, [value for key in recompute for value in key])
+
+
+def apply_award_changes(removed, added):
+    """按变更前后的行更新各奖状汇总表，需在写入日志的同一事务中调用"""
+    for table, columns in AWARD_TABLES.values():
+        _apply_award_changes(table, columns, removed, added)
+
+
+def get_total():
+    """日志总数"""
+    result = execute_query("SELECT COALESCE(SUM(count), 0) AS total FROM qso_counts", fetch=True)
+    return int(result[0]['total'])
+
+
+def get_counts(by):
+    """
+    按维度分组的记录数
+    :param by: COUNT_DIMENSIONS 中一个或多个维度组成的序列
+    :return: [{维度: 值, ..., 'count': 记录数}, ...]
+    """
+    columns = [c for c in by if c in COUNT_DIMENSIONS]
+    if not columns or len(columns) != len(by):
+        raise ValueError(f"分组维度必须是 {', '.join(COUNT_DIMENSIONS)} 之一")
+    group = ", ".join(columns)
+    rows = execute_query(f"""
+        SELECT {group}, SUM(count) AS count FROM qso_counts
+        GROUP BY {group} HAVING SUM(count) > 0 ORDER BY {group}
+    """, fetch=True)
+    for row in rows:
+        row['count'] = int(row['count'])
+    return rows
+
+
+def _award_table(kind):
+    if kind not in AWARD_TABLES:
+        raise ValueError(f"统计类型必须是 {', '.join(AWARD_TABLES)} 之一")
+    return AWARD_TABLES[kind]
+
+
+def _award_filters(columns, band=None, mode=None):
+    conditions, params = ["qso_count > 0"], []
+    for column, value in (('band', band), ('mode', mode)):
+        if not value:
+            continue
+        if column not in columns:
+            raise ValueError(f"该统计不支持按 {column} 筛选")
+        conditions.append(f"{column} = %s")
+        params.append(_AWARD_COLUMNS[column][0](value))
+    return " AND ".join(conditions), params
+
+
+def get_award(kind, band=None, mode=None):
+    """
+    奖状进度
+    :param kind: AWARD_TABLES 中的奖状类型
+    :param band: 只统计指定波段
+    :param mode: 只统计指定模式(仅 dxcc)
+    :return: {'worked': 已通联数, 'confirmed': 已确认数, 'items': [{实体, qso_count, confirmed, first_qso_date}, ...]}
+    """
+    table, columns = _award_table(kind)
+    entity = columns[0]
+    where, params = _award_filters(columns, band, mode)
+    rows = execute_query(f"""
+        SELECT {entity}, SUM(qso_count) AS qso_count, SUM(confirmed_count) AS confirmed_count,
+               MIN(first_qso_date) AS first_qso_date
+        FROM {table} WHERE {where}
+        GROUP BY {entity} ORDER BY {entity}
+    """, params, fetch=True)
+    items = [{
+        entity: row[entity],
+        'qso_count': int(row['qso_count']),
+        'confirmed': int(row['confirmed_count']) > 0,
+        'first_qso_date': _date_of(row['first_qso_date']),
+    } for row in rows]
+    return {
+        'worked': len(items),
+        'confirmed': sum(1 for item in items if item['confirmed']),
+        'items': items,
+    }
+
+
+def get_award_progress(kind, by='band'):
+    """
+    按波段(或模式)统计的奖状进度
+    :return: [{band: 波段, 'worked': 已通联数, 'confirmed': 已确认数}, ...]
+    """
+    table, columns = _award_table(kind)
+    if by not in columns[1:]:
+        raise ValueError(f"该统计只能按 {', '.join(columns[1:])} 分组")
+    entity = columns[0]
+    rows = execute_query(f"""
+        SELECT {by}, COUNT(DISTINCT {entity}) AS worked,
+               COUNT(DISTINCT CASE WHEN confirmed_count > 0 THEN {entity} END) AS confirmed
+        FROM {table} WHERE qso_count > 0
+        GROUP BY {by} ORDER BY {by}
+    """, fetch=True)
+    return [{by: row[by], 'worked': int(row['worked']), 'confirmed': int(row['confirmed'])} for row in rows]
+
+
+def rebuild_awards():
+    """按 qso_log 全量重新计算奖状汇总表"""
+    with transaction():
+        for table, columns in AWARD_TABLES.values():
+            expressions = [_AWARD_COLUMNS[c][1] for c in columns]
+            condition = f"{expressions[0]} IS NOT NULL AND {expressions[0]} <> ''"
+            if columns[0] == 'grid':
+                condition += " AND CHAR_LENGTH(TRIM(grid)) >= 4"
+            execute_query(f"DELETE FROM {table}")
+            execute_query(f"""
+                INSERT INTO {table} ({", ".join(columns)}, qso_count, confirmed_count, first_qso_date)
+                SELECT {", ".join(expressions)}, COUNT(*), SUM(CASE WHEN confirmed THEN 1 ELSE 0 END), MIN(date)
+                FROM qso_log
+                WHERE {condition}
+                GROUP BY {", ".join(str(i + 1) for i in range(len(columns)))}
+            """)
+
+
+def rebuild_counts():
+    """按 qso_log 全量重新计算统计表(用于初始化或修复)"""
+    with transaction():
+        execute_query("DELETE FROM qso_counts")
+        execute_query("""
+            INSERT INTO qso_counts (band, mode, year, count)
+            SELECT COALESCE(LEFT(band, 10), ''), COALESCE(LEFT(mode, 10), ''), COALESCE(YEAR(date), 0), COUNT(*)
+            FROM qso_log
+            GROUP BY 1, 2, 3
+        """)
+
+
+if __name__ == '__main__':
+    import sys
+    from db_utils import init_db_pool
+
+    if sys.argv[1:] != ['rebuild']:
+        raise SystemExit("用法: python qso_stats.py rebuild")
+    init_db_pool()
+    rebuild_counts()
+    rebuild_awards()
+    print(f"统计表已重建，共 {get_total()} 条日志")
@@ -0,0 +1,149 @@
+"""
+QSO时间
+qso_log 的 time 列是自由格式的字符串(HH:MM、HH:MM:SS、HHMM 等)，按 (date, time) 排序和范围查询
+只能比较字符串。qso_datetime_utc 列保存 date + time 规范化后的时间(与ADIF、LOTW一致，按UTC记录)，
+列表、呼号历史、查重时段和ADIF导出都按该列排序和筛选，索引见 migrations.py
+
+写入日志时由 fill 计算；time 无法识别时取当天 00:00，date 为空或无效时为 UNKNOWN_UTC
+(早于所有记录，倒序列表中排在最后)，该列不为空，按 (qso_datetime_utc, id) 的查询条件可以直接使用索引。
+fill 同时把 time 列规范化为 HH:MM(与ADIF导入、LOTW报告一致)，手工录入的 "1230"、"12:30:00"
+与LOTW报告中的 "12:30" 对应同一个QSO唯一键(uq_qso_log_identity)，秒只保留在 qso_datetime_utc 中
+存量记录由迁移14调用 backfill 填充后该列改为 NOT NULL；记录很多时可以在升级前先在命令行执行 backfill
+(按 id 分批，每批一个短事务，填充期间日志可以正常读写)，缩短迁移时间
+
+命令行用法: python qso_time.py backfill
+"""
+
+import datetime
+import re
+import time
+
+from db_utils import transaction
+import log_version
+
+# HH:MM[:SS]、HHMM[SS]、H:MM
+_TIME_PATTERN = re.compile(r'(\d{1,2}):?(\d{2})(?::?(\d{2}))?')
+
+# date 为空或无效的记录的 qso_datetime_utc(MySQL DATETIME 的最小值)
+UNKNOWN_UTC = datetime.datetime(1000, 1, 1)
+
+
+def parse_time(value):
+    """
+    解析自由格式的时间字符串
+    :return: datetime.time，无法识别时返回 None
+    """
+    if isinstance(value, datetime.timedelta):
+        value = str(value)
+    match = _TIME_PATTERN.fullmatch(str(value or '').strip())
+    if not match:
+        return None
+    hour, minute, second = (int(v) if v else 0 for v in match.groups())
+    if hour > 23 or minute > 59 or second > 59:
+        return None
+    return datetime.time(hour, minute, second)
+
+
+def normalize_time(value):
+    """
+    time 列的规范格式 HH:MM
+    :return: 规范化后的字符串，无法识别时返回去掉首尾空格的原值
+    """
+    parsed = parse_time(value)
+    if parsed is None:
+        return value.strip() if isinstance(value, str) else value
+    return parsed.strftime('%H:%M')
+
+
+def _parse_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    try:
+        return datetime.date.fromisoformat(str(value or '').strip()[:10])
+    except ValueError:
+        return None
+
+
+def to_utc(date, time_value):
+    """
+    :param date: date 对象或 'YYYY-MM-DD'
+    :param time_value: time 列的值
+    :return: datetime(不带时区)，date 无效时返回 None
+    """
+    date = _parse_date(date)
+    if date is None:
+        return None
+    return datetime.datetime.combine(date, parse_time(time_value) or datetime.time())
+
+
+def column_value(date, time_value):
+    """qso_datetime_utc 列的值，date 无效时为 UNKNOWN_UTC"""
+    return to_utc(date, time_value) or UNKNOWN_UTC
+
+
+def of_row(row):
+    """
+    日志行的UTC时间，行中没有 qso_datetime_utc(或为空)时按 date、time 计算
+    :return: datetime，时间未知(UNKNOWN_UTC)时返回 None
+    """
+    value = row.get('qso_datetime_utc')
+    if value and not isinstance(value, datetime.datetime):
+        value = datetime.datetime.fromisoformat(str(value))
+    if not value:
+        return to_utc(row.get('date'), row.get('time'))
+    return value if value != UNKNOWN_UTC else None
+
+
+def fill(row):
+    """按行中的 date、time 设置 qso_datetime_utc，并规范化 time(直接修改传入的行字典)"""
+    row['qso_datetime_utc'] = column_value(row.get('date'), row.get('time'))
+    if 'time' in row:
+        row['time'] = normalize_time(row['time'])
+    return row
+
+
+def backfill(batch_size=1000, pause=0.05):
+    """
+    填充 qso_datetime_utc 为空的记录，按 id 分批，每批一个事务，批之间暂停 pause 秒
+    多个进程同时执行时结果相同(只更新仍为空的记录)
+    :return: 填充的记录数
+    """
+    filled = 0
+    last_id = 0
+    while True:
+        with transaction() as cursor:
+            cursor.execute("""
+                SELECT id, date, time FROM qso_log
+                WHERE qso_datetime_utc IS NULL AND id > %s
+                ORDER BY id LIMIT %s FOR UPDATE
+            """, (last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1]['id']
+            values = [(row['id'], column_value(row['date'], row['time'])) for row in rows]
+            cases = " ".join(["WHEN %s THEN %s"] * len(values))
+            cursor.execute(f"""
+                UPDATE qso_log SET qso_datetime_utc = CASE id {cases} END
+                WHERE id IN ({", ".join(["%s"] * len(values))})
+            """, [v for pair in values for v in pair] + [log_id for log_id, _ in values])
+            filled += len(values)
+        if pause:
+            time.sleep(pause)
+    if filled:
+        # 列表排序随之改变，使响应缓存失效
+        log_version.bump()
+    return filled
+
+
+if __name__ == '__main__':
+    import sys
+    from db_utils import init_db_pool
+
+    if sys.argv[1:] == ['backfill']:
+        init_db_pool()
+        print(f"填充完成: {backfill()} 条")
+    else:
+        raise SystemExit("用法: python qso_time.py backfill")
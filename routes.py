@@ -1,9 +1,191 @@
 
-from flask import render_template, request, jsonify
+from flask import render_template, request, jsonify, Response, stream_with_context, current_app
 from forms import QSOForm
-from db_utils import execute_query, get_db_connection
+from db_utils import execute_query, get_db_connection, stream_query, get_pool_stats, transaction, DatabaseError
+from http_cache import conditional
+import adif_export
+import callsign_index
+import callsign_resolver
+import dupe_check
+import grids
+import log_encoding
+import log_filters
+import metrics
+import lotw_uploader
+import write_behind
+import qso_events
+import qso_stats
+import qso_time
+from adif_import import import_adif
+from lotw_handler import LOTWHandler
+import base64
+import datetime
 import json
 
+# 分页接口每页最大记录数
+MAX_PAGE_SIZE = 500
+
+# 唯一键存在重复值(SQLite后端的异常使用相同的错误码)
+ER_DUP_ENTRY = 1062
+DUPLICATE_MESSAGE = "修改后与已有日志重复(呼号、日期、时间、波段、模式都相同)"
+
+# 日志列表的排序键，游标分页依赖 idx_qso_log_utc_id 索引
+LOG_ORDER_COLUMNS = ('qso_datetime_utc', 'id')
+LOG_ORDER = "qso_datetime_utc DESC, id DESC"
+
+
+def _encode_cursor(row, direction):
+    """将排序键编码为不透明的游标字符串"""
+    key = []
+    for column in LOG_ORDER_COLUMNS:
+        value = row[column]
+        if isinstance(value, datetime.datetime):
+            value = value.isoformat(' ')
+        key.append(value)
+    payload = json.dumps({"k": key, "d": direction}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(token):
+    """解析游标字符串，返回 (排序键, 方向)，格式错误时抛出 ValueError"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        key, direction = payload['k'], payload['d']
+        if direction not in ('next', 'prev') or len(key) != len(LOG_ORDER_COLUMNS):
+            raise ValueError
+        # 时间转换回 datetime，两种后端都按时间比较
+        key = [datetime.datetime.fromisoformat(key[0]), int(key[1])]
+    except Exception:
+        raise ValueError("无效的分页游标")
+    return key, direction
+
+
+def _cursor_condition(key, direction):
+    """
+    游标定位条件。列表按 qso_datetime_utc DESC, id DESC 排序(该列不为空，见 qso_time.py)
+    展开为单列比较，MySQL可以按 (qso_datetime_utc, id) 及各筛选列开头的索引做范围查找，
+    行构造器比较在部分版本中不能使用索引
+    :return: (条件, 参数)
+    """
+    utc, log_id = key
+    operator = '<' if direction == 'next' else '>'
+    return (f"(qso_datetime_utc {operator} %s OR (qso_datetime_utc = %s AND id {operator} %s))",
+            [utc, utc, log_id])
+
+
+def _json_response(data, status=200):
+    """用 log_encoding 编码的JSON响应(日志列表等大响应)"""
+    return current_app.response_class(log_encoding.dumps(data), status=status, mimetype='application/json')
+
+
+# 批量操作一次最多处理的记录数
+MAX_BATCH_SIZE = 1000
+
+# 批量修改允许的字段及类型转换
+EDITABLE_FIELDS = {
+    'callsign': str, 'frequency': float, 'mode': str, 'equipment': str,
+    'antenna': str, 'power': float, 'date': str, 'time': str, 'notes': str,
+    'dxcc': str, 'grid': str, 'province': str, 'band': str,
+    'qslcard': int, 'confirmed': lambda value: 1 if value else 0
+}
+
+
+def _parse_ids(values):
+    """将id列表(或逗号分隔的字符串)转换为去重后的整数列表，格式错误时抛出 ValueError"""
+    if isinstance(values, str):
+        values = [v for v in values.split(',') if v.strip()]
+    if not isinstance(values, list):
+        raise ValueError("ids 必须是列表")
+    ids = list(dict.fromkeys(int(v) for v in values))
+    if not ids:
+        raise ValueError("未指定要操作的日志")
+    if len(ids) > MAX_BATCH_SIZE:
+        raise ValueError(f"一次最多操作 {MAX_BATCH_SIZE} 条日志")
+    return ids
+
+
+def _parse_patch(patch):
+    """校验并转换要修改的字段，格式错误时抛出 ValueError"""
+    if not isinstance(patch, dict) or not patch:
+        raise ValueError("修改内容不能为空")
+    unknown = set(patch) - set(EDITABLE_FIELDS)
+    if unknown:
+        raise ValueError(f"不允许修改的字段: {', '.join(sorted(unknown))}")
+    for field in ('callsign', 'mode'):
+        if field in patch and not patch[field]:
+            raise ValueError(f"字段 {field} 不能为空")
+    return {field: EDITABLE_FIELDS[field](value) for field, value in patch.items()}
+
+
+def _is_duplicate(error):
+    """是否为违反QSO唯一键(uq_qso_log_identity)的错误"""
+    return isinstance(error, DatabaseError) and getattr(error, 'errno', None) == ER_DUP_ENTRY
+
+
+def _lock_rows(ids):
+    """在当前事务中锁定并读取指定id的记录"""
+    placeholders = ", ".join(["%s"] * len(ids))
+    rows = execute_query(f"SELECT * FROM qso_log WHERE id IN ({placeholders}) FOR UPDATE", ids, fetch=True)
+    return {row['id']: row for row in rows}
+
+
+def _batch_results(ids, found, message):
+    return [
+        {"id": log_id, "success": True, "message": message} if log_id in found
+        else {"id": log_id, "success": False, "message": "日志不存在"}
+        for log_id in ids
+    ]
+
+
+def _batch_delete(ids):
+    """在一个事务中删除多条日志，返回逐条结果"""
+    with transaction():
+        old = _lock_rows(ids)
+        if old:
+            placeholders = ", ".join(["%s"] * len(old))
+            execute_query(f"DELETE FROM qso_log WHERE id IN ({placeholders})", list(old))
+            qso_events.publish(removed=old.values())
+    return _batch_results(ids, old, "删除成功")
+
+
+def _batch_update(items):
+    """
+    在一个事务中修改多条日志
+    :param items: [(id, 字段字典), ...]，字段相同的记录合并为一条 UPDATE ... WHERE id IN (...)
+    :return: 逐条结果
+    """
+    ids = [log_id for log_id, _ in items]
+    with transaction():
+        old = _lock_rows(ids)
+        groups = {}
+        for log_id, patch in items:
+            if log_id in old and ('date' in patch or 'time' in patch):
+                # 修改日期或时间时按修改后的值重新计算UTC时间
+                merged = {**old[log_id], **patch}
+                patch = {**patch, 'qso_datetime_utc': qso_time.column_value(merged['date'], merged['time'])}
+                if 'time' in patch:
+                    patch['time'] = qso_time.normalize_time(patch['time'])
+            key = tuple(sorted(patch.items()))
+            groups.setdefault(key, []).append(log_id)
+
+        added = []
+        for key, group_ids in groups.items():
+            group_ids = [log_id for log_id in group_ids if log_id in old]
+            if not group_ids:
+                continue
+            patch = dict(key)
+            assignments = ", ".join(f"{field} = %s" for field in patch)
+            placeholders = ", ".join(["%s"] * len(group_ids))
+            execute_query(
+                f"UPDATE qso_log SET {assignments} WHERE id IN ({placeholders})",
+                [*patch.values(), *group_ids]
+            )
+            added.extend({**old[log_id], **patch} for log_id in group_ids)
+        qso_events.publish(removed=[old[row['id']] for row in added], added=added)
+    return _batch_results(ids, old, "修改成功")
+
+
 def init_routes(app):
     # 页面路由
     @app.route('/')
@@ -24,21 +206,43 @@ def init_routes(app):
         form = QSOForm()
         if form.validate_on_submit():
             try:
+                row = {
+                    'callsign': form.callsign.data, 'frequency': form.frequency.data,
+                    'mode': form.mode.data, 'equipment': form.equipment.data,
+                    'antenna': form.antenna.data, 'power': form.power.data,
+                    'date': form.date.data, 'time': form.time.data, 'notes': form.notes.data,
+                    'dxcc': form.dxcc.data, 'grid': form.grid.data, 'province': form.province.data,
+                    'band': form.band.data, 'qslcard': int(form.qslcard.data)
+                }
+                if write_behind.writer.is_running():
+                    # 比赛模式: 写入本地日志文件并排队，由后台线程批量写入数据库
+                    depth = write_behind.writer.enqueue(row)
+                    return jsonify({
+                        "success": True,
+                        "message": "日志已加入写入队列",
+                        "data": {
+                            "callsign": form.callsign.data,
+                            "frequency": form.frequency.data,
+                            "mode": form.mode.data,
+                            "queued": True,
+                            "queue_depth": depth
+                        }
+                    }), 202
+                qso_time.fill(row)
                 query = """
                 INSERT INTO qso_log (
                     callsign, frequency, mode, equipment, 
                     antenna, power, date, time, notes,
-                    dxcc, grid, province, band, qslcard
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """
-                params = (
-                    form.callsign.data, form.frequency.data, form.mode.data,
-                    form.equipment.data, form.antenna.data, form.power.data,
-                    form.date.data, form.time.data, form.notes.data,
-                    form.dxcc.data, form.grid.data, form.province.data,
-                    form.band.data, int(form.qslcard.data)
+                    dxcc, grid, province, band, qslcard, qso_datetime_utc
+                ) VALUES (
+                    %(callsign)s, %(frequency)s, %(mode)s, %(equipment)s,
+                    %(antenna)s, %(power)s, %(date)s, %(time)s, %(notes)s,
+                    %(dxcc)s, %(grid)s, %(province)s, %(band)s, %(qslcard)s, %(qso_datetime_utc)s
                 )
-                execute_query(query, params)
+                """
+                with transaction():
+                    log_id = execute_query(query, row)
+                    qso_events.publish(added=[{'id': log_id, **row}])
                 return jsonify({
                     "success": True,
                     "message": "日志添加成功",
@@ -63,61 +267,206 @@ def init_routes(app):
 
     # API路由
     @app.route('/api/logs/count', methods=['GET'])
+    @conditional
     def get_log_count():
         try:
-            result = execute_query("SELECT COUNT(*) as count FROM qso_log", fetch=True)
-            return jsonify({"success": True, "count": result[0]['count']})
+            # 读取增量维护的统计表，by=band,mode,year 返回分组统计
+            by = request.args.get('by')
+            response = {"success": True, "count": qso_stats.get_total()}
+            if by:
+                response["data"] = qso_stats.get_counts([c.strip() for c in by.split(',')])
+            return jsonify(response)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        except Exception as e:
+            return jsonify({"success": False, "message": str(e)}), 500
+
+    @app.route('/api/stats/summary', methods=['GET'])
+    @conditional
+    def get_stats_summary():
+        try:
+            data = {"total": qso_stats.get_total()}
+            for kind in qso_stats.AWARD_TABLES:
+                award = qso_stats.get_award(kind)
+                data[kind] = {"worked": award["worked"], "confirmed": award["confirmed"]}
+            return jsonify({"success": True, "data": data})
+        except Exception as e:
+            return jsonify({"success": False, "message": str(e)}), 500
+
+    @app.route('/api/stats/<kind>', methods=['GET'])
+    @conditional
+    def get_award_stats(kind):
+        # 奖状进度(dxcc/province/grid)，可按 band、mode 筛选
+        try:
+            data = qso_stats.get_award(kind, band=request.args.get('band'), mode=request.args.get('mode'))
+            return jsonify({"success": True, "data": data})
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        except Exception as e:
+            return jsonify({"success": False, "message": str(e)}), 500
+
+    @app.route('/api/stats/<kind>/progress', methods=['GET'])
+    @conditional
+    def get_award_progress(kind):
+        # 按波段(dxcc 还可按模式, by=mode)统计的已通联/已确认数
+        try:
+            data = qso_stats.get_award_progress(kind, by=request.args.get('by', 'band'))
+            return jsonify({"success": True, "data": data})
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        except Exception as e:
+            return jsonify({"success": False, "message": str(e)}), 500
+
+    @app.route('/api/grids', methods=['GET'])
+    @conditional
+    def get_grids():
+        # 网格地图: ?bbox=west,south,east,north&zoom=5，可选 precision(2/4/6)、band、mode、confirmed=true
+        try:
+            data = grids.aggregate(
+                bbox=grids.parse_bbox(request.args.get('bbox')),
+                zoom=request.args.get('zoom', 2, type=int),
+                precision=request.args.get('precision', type=int),
+                band=request.args.get('band'),
+                mode=request.args.get('mode'),
+                confirmed=request.args.get('confirmed', 'false').lower() == 'true'
+            )
+            return jsonify({"success": True, "data": data})
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
         except Exception as e:
             return jsonify({"success": False, "message": str(e)}), 500
 
     @app.route('/api/logs', methods=['GET'])
+    @conditional
     def get_logs():
+        # ?fields= 指定返回的列，?format=columns 按列返回，见 log_encoding.py
         try:
             all_records = request.args.get('all', 'false').lower() == 'true'
-            
+            # 筛选条件适用于以下三种获取方式，见 log_filters.py
+            try:
+                filters = log_filters.parse_filters(request.args)
+                columns = log_encoding.parse_fields(request.args.get('fields'))
+                ndjson = all_records and request.args.get('format') == 'ndjson'
+                fmt = 'rows' if ndjson else log_encoding.parse_format(request.args.get('format'))
+                if all_records and fmt == 'columns':
+                    raise ValueError("全量获取不支持 columns 格式，请使用 format=ndjson")
+                for name in ('size', 'page'):
+                    if not request.args.get(name, '1').strip().isdigit():
+                        raise ValueError(f"{name} 必须是正整数")
+                size = min(max(int(request.args.get('size', 25)), 1), MAX_PAGE_SIZE)
+                page = max(int(request.args.get('page', 1)), 1)
+            except ValueError as e:
+                return jsonify({"success": False, "message": str(e)}), 400
+            conditions, filter_params = log_filters.build_conditions(filters)
+            select = ", ".join(columns)
+
             if all_records:
-                # 全量获取
-                query = "SELECT * FROM qso_log ORDER BY date DESC, time DESC"
-                logs = execute_query(query, fetch=True)
-                return jsonify({
-                    "success": True,
-                    "data": logs,
-                    "total": len(logs)
-                })
+                # 全量获取：服务端非缓冲游标 + 分块流式输出，内存占用恒定
+                query = f"""
+                SELECT {select} FROM qso_log {log_filters.where_clause(conditions)}
+                ORDER BY {LOG_ORDER}
+                """
+                if ndjson:
+                    def generate():
+                        # 每行一个 JSON 对象
+                        for rows in stream_query(query, filter_params):
+                            yield b"".join(log_encoding.dumps(row) + b"\n" for row in rows)
+                    mimetype = 'application/x-ndjson'
+                else:
+                    def generate():
+                        # 与原响应结构一致，total 在数组写完后输出
+                        total = 0
+                        yield b'{"success":true,"data":['
+                        for rows in stream_query(query, filter_params):
+                            chunk = log_encoding.dumps(rows)[1:-1]
+                            yield (b"," if total else b"") + chunk
+                            total += len(rows)
+                        yield b'],"total":%d}' % total
+                    mimetype = 'application/json'
+                return Response(
+                    stream_with_context(generate()),
+                    mimetype=mimetype,
+                    headers={"X-Accel-Buffering": "no"}
+                )
+
+            # 无筛选条件时读取统计表；有筛选条件时按索引计数，超过上限只返回下限
+            if filters:
+                total, total_exact = log_filters.count_matches(filters)
             else:
-                # 分页获取
-                page = int(request.args.get('page', 1))
-                size = int(request.args.get('size', 25))
+                total, total_exact = qso_stats.get_total(), True
+
+            if 'page' in request.args:
+                # 兼容模式：按页码分页(OFFSET 越大越慢)
                 offset = (page - 1) * size
 
-                query = """
-                SELECT * FROM qso_log 
-                ORDER BY date DESC, time DESC 
+                query = f"""
+                SELECT {select} FROM qso_log {log_filters.where_clause(conditions)}
+                ORDER BY {LOG_ORDER}
                 LIMIT %s OFFSET %s
                 """
-                logs = execute_query(query, (size, offset), fetch=True)
+                logs = execute_query(query, (*filter_params, size, offset), fetch=True)
 
-                # 获取总数
-                count_result = execute_query("SELECT COUNT(*) as total FROM qso_log", fetch=True)
-                
-                return jsonify({
-                    "success": True,
-                    "data": logs,
-                    "total": count_result[0]['total'],
-                    "pages": (count_result[0]['total'] + size - 1) // size,
-                    "current_page": page
-                })
+                return _json_response(log_encoding.payload(
+                    logs, columns, fmt,
+                    total=total,
+                    total_exact=total_exact,
+                    pages=(total + size - 1) // size,
+                    current_page=page
+                ))
+            else:
+                # 游标分页：按 (qso_datetime_utc, id) 定位，耗时与翻页深度无关
+                # 游标不包含筛选条件，翻页时需带上相同的筛选参数
+                token = request.args.get('cursor')
+                try:
+                    key, direction = _decode_cursor(token) if token else (None, 'next')
+                except ValueError as e:
+                    return jsonify({"success": False, "message": str(e)}), 400
+
+                where, params = list(conditions), list(filter_params)
+                if key:
+                    condition, key_params = _cursor_condition(key, direction)
+                    where.append(condition)
+                    params.extend(key_params)
+                order = ", ".join(f"{c} {'DESC' if direction == 'next' else 'ASC'}" for c in LOG_ORDER_COLUMNS)
+
+                query = f"SELECT {select} FROM qso_log {log_filters.where_clause(where)} ORDER BY {order} LIMIT %s"
+                logs = execute_query(query, (*params, size + 1), fetch=True)
+                has_more = len(logs) > size
+                logs = logs[:size]
+
+                next_cursor = prev_cursor = None
+                if direction == 'next':
+                    if logs and has_more:
+                        next_cursor = _encode_cursor(logs[-1], 'next')
+                    if logs and key:
+                        prev_cursor = _encode_cursor(logs[0], 'prev')
+                else:
+                    logs.reverse()
+                    if logs and has_more:
+                        prev_cursor = _encode_cursor(logs[0], 'prev')
+                    if logs:
+                        next_cursor = _encode_cursor(logs[-1], 'next')
+
+                return _json_response(log_encoding.payload(
+                    logs, columns, fmt,
+                    total=total,
+                    total_exact=total_exact,
+                    size=size,
+                    next=next_cursor,
+                    prev=prev_cursor
+                ))
         except Exception as e:
             return jsonify({"success": False, "message": str(e)}), 500
 
     @app.route('/api/logs/<int:log_id>', methods=['GET'])
+    @conditional
     def get_log(log_id):
         try:
-            query = "SELECT * FROM qso_log WHERE id = %s"
+            query = f"SELECT {', '.join(log_encoding.LOG_COLUMNS)} FROM qso_log WHERE id = %s"
             log = execute_query(query, (log_id,), fetch=True)
             if not log:
                 return jsonify({"success": False, "message": "日志不存在"}), 404
-            return jsonify({"success": True, "data": log[0]})
+            return _json_response({"success": True, "data": log[0]})
         except Exception as e:
             return jsonify({"success": False, "message": str(e)}), 500
 
@@ -154,6 +503,7 @@ def init_routes(app):
                 'band': data.get('band', ''),
                 'qslcard': int(data.get('qslcard', 0))
             }
+            qso_time.fill(update_data)
 
             query = """
             UPDATE qso_log SET
@@ -170,14 +520,20 @@ def init_routes(app):
                 grid = %(grid)s,
                 province = %(province)s,
                 band = %(band)s,
-                qslcard = %(qslcard)s
+                qslcard = %(qslcard)s,
+                qso_datetime_utc = %(qso_datetime_utc)s
             WHERE id = %(id)s
             """
             params = {'id': log_id, **update_data}
             
             # 执行更新并记录
             app.logger.info(f"更新日志 {log_id}: {params}")
-            execute_query(query, params)
+            with transaction():
+                old = execute_query("SELECT * FROM qso_log WHERE id = %s FOR UPDATE", (log_id,), fetch=True)
+                if not old:
+                    return jsonify({"success": False, "message": "日志不存在"}), 404
+                execute_query(query, params)
+                qso_events.publish(removed=old, added=[{**old[0], **update_data}])
             
             return jsonify({
                 "success": True,
@@ -190,6 +546,8 @@ def init_routes(app):
                 "message": f"数据格式错误: {str(e)}"
             }), 400
         except Exception as e:
+            if _is_duplicate(e):
+                return jsonify({"success": False, "message": DUPLICATE_MESSAGE, "error": "DUPLICATE_QSO"}), 409
             app.logger.error(f"更新日志 {log_id} 失败: {str(e)}")
             return jsonify({
                 "success": False,
@@ -200,27 +558,84 @@ def init_routes(app):
     @app.route('/api/logs/del', methods=['GET'])
     def delete_logs():
         try:
-            log_id = request.args.get('id', type=int)
-            if not log_id:
+            id_param = request.args.get('id', '')
+            if not id_param.strip():
                 return jsonify({"success": False, "message": "未指定要删除的日志"}), 400
-            
-            query = "DELETE FROM qso_log WHERE id = %s"
-            execute_query(query, (log_id,))
-            return jsonify({"success": True, "message": "日志删除成功"})
+            try:
+                ids = _parse_ids(id_param)
+            except ValueError as e:
+                return jsonify({"success": False, "message": str(e)}), 400
+
+            results = _batch_delete(ids)
+            if not any(r["success"] for r in results):
+                return jsonify({"success": False, "message": "日志不存在", "data": results}), 404
+            return jsonify({"success": True, "message": "日志删除成功", "data": results})
         except Exception as e:
             return jsonify({"success": False, "message": str(e)}), 500
 
+    @app.route('/api/logs/batch', methods=['POST'])
+    def batch_logs():
+        """
+        批量删除或修改日志，所有改动在一个事务中完成
+        删除: {"action": "delete", "ids": [1, 2, 3]}
+        统一修改: {"action": "update", "ids": [1, 2, 3], "patch": {"qslcard": 1}}
+        逐条修改: {"action": "update", "items": [{"id": 1, "band": "20m"}, ...]}
+        """
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"success": False, "message": "请求数据不能为空"}), 400
+
+        action = data.get('action')
+        try:
+            if action == 'delete':
+                results = _batch_delete(_parse_ids(data.get('ids')))
+                message = "批量删除完成"
+            elif action == 'update':
+                if 'items' in data:
+                    if not isinstance(data['items'], list):
+                        raise ValueError("items 必须是列表")
+                    items = [
+                        (int(item['id']), _parse_patch({k: v for k, v in item.items() if k != 'id'}))
+                        for item in data['items']
+                    ]
+                    if len(_parse_ids([log_id for log_id, _ in items])) != len(items):
+                        raise ValueError("items 中的 id 不能重复")
+                else:
+                    patch = _parse_patch(data.get('patch'))
+                    items = [(log_id, patch) for log_id in _parse_ids(data.get('ids'))]
+                results = _batch_update(items)
+                message = "批量修改完成"
+            else:
+                return jsonify({"success": False, "message": "action 必须是 delete 或 update"}), 400
+        except (ValueError, TypeError, KeyError) as e:
+            return jsonify({
+                "success": False,
+                "message": f"数据格式错误: {str(e)}",
+                "error": "VALIDATION_ERROR"
+            }), 400
+        except Exception as e:
+            if _is_duplicate(e):
+                # 整批回滚
+                return jsonify({"success": False, "message": DUPLICATE_MESSAGE, "error": "DUPLICATE_QSO"}), 409
+            app.logger.error(f"批量操作失败: {str(e)}")
+            return jsonify({
+                "success": False,
+                "message": f"服务器错误: {str(e)}",
+                "error": "SERVER_ERROR"
+            }), 500
+
+        succeeded = sum(1 for r in results if r["success"])
+        return jsonify({
+            "success": succeeded == len(results),
+            "message": f"{message}: 成功 {succeeded} 条，失败 {len(results) - succeeded} 条",
+            "data": results
+        })
+
     @app.route('/api/history/<callsign>', methods=['GET'])
+    @conditional
     def get_history_by_callsign(callsign):
         try:
-            query = """
-            SELECT date, time, frequency, mode 
-            FROM qso_log 
-            WHERE callsign = %s
-            ORDER BY date DESC, time DESC
-            LIMIT 10
-            """
-            history = execute_query(query, (callsign,), fetch=True)
+            history = callsign_index.get_history(callsign.strip())
             return jsonify({
                 "success": True,
                 "data": history
@@ -231,3 +646,187 @@ def init_routes(app):
                 "message": str(e),
                 "error": "DATABASE_ERROR"
             }), 500
+
+    @app.route('/api/callsigns/suggest', methods=['GET'])
+    @conditional
+    def suggest_callsigns():
+        try:
+            prefix = request.args.get('prefix', '').strip()
+            limit = min(request.args.get('limit', 10, type=int), 50)
+            if not prefix:
+                return jsonify({"success": True, "data": []})
+            return jsonify({
+                "success": True,
+                "data": callsign_index.suggest(prefix, limit)
+            })
+        except Exception as e:
+            return jsonify({
+                "success": False,
+                "message": str(e),
+                "error": "DATABASE_ERROR"
+            }), 500
+
+    @app.route('/api/dupe', methods=['GET'])
+    def check_dupe():
+        """
+        比赛查重(读取内存索引，不访问数据库)
+        ?callsign=BY1AA&band=20m&mode=FT8
+        """
+        try:
+            callsign = request.args.get('callsign', '').strip()
+            if not callsign:
+                return jsonify({"success": False, "message": "callsign 不能为空"}), 400
+            result = dupe_check.check(callsign, request.args.get('band'), request.args.get('mode'))
+            return jsonify({"success": True, "data": result})
+        except Exception as e:
+            return jsonify({"success": False, "message": str(e)}), 500
+
+    @app.route('/api/callsign/resolve', methods=['GET'])
+    def resolve_callsign():
+        """
+        呼号 -> DXCC实体和省份(录入表单自动填充)，无法解析时 data 为 null
+        ?callsign=BG1ABC
+        """
+        try:
+            callsign = request.args.get('callsign', '').strip()
+            if not callsign:
+                return jsonify({"success": False, "message": "callsign 不能为空"}), 400
+            return jsonify({"success": True, "data": callsign_resolver.resolve(callsign)})
+        except Exception as e:
+            return jsonify({"success": False, "message": str(e)}), 500
+
+    @app.route('/api/callsign/resolve', methods=['POST'])
+    def resolve_callsigns():
+        """批量解析: {"callsigns": ["BG1ABC", ...]}，返回与输入顺序对应的列表"""
+        try:
+            callsigns = (request.get_json(silent=True) or {}).get('callsigns')
+            if not isinstance(callsigns, list):
+                return jsonify({"success": False, "message": "callsigns 必须是数组"}), 400
+            return jsonify({"success": True, "data": callsign_resolver.resolve_many(map(str, callsigns))})
+        except Exception as e:
+            return jsonify({"success": False, "message": str(e)}), 500
+
+    @app.route('/api/dupe/stats', methods=['GET'])
+    def get_dupe_stats():
+        """查重索引的查重时段、规模和内存占用"""
+        try:
+            return jsonify({"success": True, "data": dupe_check.stats()})
+        except Exception as e:
+            return jsonify({"success": False, "message": str(e)}), 500
+
+    @app.route('/api/logs/queue', methods=['GET'])
+    def get_write_queue_status():
+        """写入队列(比赛模式)的队列长度和写入统计"""
+        try:
+            return jsonify({"success": True, "data": write_behind.writer.status()})
+        except Exception as e:
+            return jsonify({"success": False, "message": str(e)}), 500
+
+    @app.route('/api/import/adif', methods=['POST'])
+    def import_adif_file():
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            return jsonify({"success": False, "message": "未上传ADI文件"}), 400
+        try:
+            batch_size = request.form.get('batch_size', type=int)
+            stats = import_adif(upload.stream, batch_size=batch_size)
+            return jsonify({
+                "success": True,
+                "message": f"导入完成，新增 {stats['added']} 条，更新 {stats['updated']} 条",
+                "data": stats
+            })
+        except UnicodeDecodeError as e:
+            return jsonify({
+                "success": False,
+                "message": f"文件编码错误: {str(e)}",
+                "error": "VALIDATION_ERROR"
+            }), 400
+        except Exception as e:
+            app.logger.error(f"ADIF导入失败: {str(e)}")
+            return jsonify({
+                "success": False,
+                "message": str(e),
+                "error": "DATABASE_ERROR"
+            }), 500
+
+    @app.route('/api/export.adi', methods=['GET'])
+    @conditional
+    def export_adi_file():
+        # 流式导出ADI文件，筛选参数与 /api/logs 相同
+        try:
+            filters = log_filters.parse_filters(request.args)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        filename = f"qso_log_{datetime.date.today().strftime('%Y%m%d')}.adi"
+        return Response(
+            stream_with_context(adif_export.export_adi(filters)),
+            mimetype='application/x-arrl-adif',
+            headers={
+                "Content-Disposition": f"attachment; filename={filename}",
+                "X-Accel-Buffering": "no"
+            }
+        )
+
+    @app.route('/api/lotw/sync', methods=['POST'])
+    def lotw_sync():
+        try:
+            incremental = request.args.get('full', 'false').lower() != 'true'
+            result = LOTWHandler().sync(incremental=incremental)
+            data = {
+                name: {"success": r[0], "message": r[1], "added": r[2], "updated": r[3]}
+                for name, r in result.items()
+            }
+            return jsonify({
+                "success": all(r[0] for r in result.values()),
+                "data": data
+            })
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+        except Exception as e:
+            app.logger.error(f"LOTW同步失败: {str(e)}")
+            return jsonify({"success": False, "message": str(e)}), 500
+
+    @app.route('/api/lotw/upload', methods=['POST'])
+    def lotw_upload():
+        # 只唤醒后台上传线程，不等待LOTW响应；retry_failed=true 时先将上传失败的记录重新加入队列
+        try:
+            requeued = 0
+            if request.args.get('retry_failed', 'false').lower() == 'true':
+                requeued = lotw_uploader.retry_failed()
+            if not lotw_uploader.uploader.is_running():
+                return jsonify({
+                    "success": False,
+                    "message": "LOTW后台上传未启用，请在config.ini中设置 upload_enabled = true"
+                }), 503
+            lotw_uploader.uploader.wake()
+            return jsonify({
+                "success": True,
+                "message": "已开始上传",
+                "data": {"requeued": requeued, "queue": lotw_uploader.get_queue_status()}
+            }), 202
+        except Exception as e:
+            app.logger.error(f"LOTW上传失败: {str(e)}")
+            return jsonify({"success": False, "message": str(e)}), 500
+
+    @app.route('/api/lotw/upload', methods=['GET'])
+    def lotw_upload_status():
+        try:
+            return jsonify({
+                "success": True,
+                "data": {
+                    "running": lotw_uploader.uploader.is_running(),
+                    "queue": lotw_uploader.get_queue_status(),
+                    "worker": dict(lotw_uploader.uploader.stats)
+                }
+            })
+        except Exception as e:
+            return jsonify({"success": False, "message": str(e)}), 500
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        """Prometheus 文本格式的运行指标(见 metrics.py)"""
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+    @app.route('/api/db/pool', methods=['GET'])
+    def get_db_pool_stats():
+        return jsonify({"success": True, "data": get_pool_stats()})
@@ -0,0 +1,171 @@
+"""
+应用工厂与工作进程初始化(生产环境多进程部署)
+
+create_app 只创建 Flask 应用、注册路由和请求钩子，不连接数据库；
+init_worker 在每个进程中调用一次: 初始化本进程的连接池、预热连接和内存索引、启动后台线程。
+gunicorn 预加载应用后 fork 出多个工作进程，fork 之前建立的连接不能被子进程共用，
+所以连接池在 fork 之后由 post_fork 钩子创建(见 gunicorn.conf.py)，数据库迁移在主进程中只执行一次
+呼号索引和查重索引在每个进程中各有一份，其他进程写入后按共享的日志版本(log_version)和变更记录增量更新，有修改、删除时重新构建
+
+部署: gunicorn -c gunicorn.conf.py wsgi:app
+开发: python app.py (单进程，导入时即初始化)
+"""
+
+import atexit
+import time
+
+from flask import Flask
+
+import db_utils
+from db_utils import config, init_db_pool, init_app
+from routes import init_routes
+import compression
+import metrics
+
+# MySQL连接池的连接数上限(mysql.connector.pooling.CNX_POOL_MAXSIZE)
+MYSQL_POOL_MAX = 32
+# 主进程执行迁移的连接数: migrate 在事务中占用一个连接(持有迁移锁)，
+# 迁移中重新计算统计表(如 grids.rebuild)用 stream_query 另占一个
+MIGRATION_POOL_SIZE = 2
+
+
+def create_app():
+    """创建应用(不连接数据库，可在 fork 之前调用)"""
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = config.get('SERVER', 'secret_key', fallback='dev-secret-key')
+    # 请求内共用一个连接，请求结束时归还
+    init_app(app)
+    # 接口耗时统计(/metrics)
+    metrics.init_app(app)
+    # 按 Accept-Encoding 压缩响应(gzip/br)
+    compression.init_app(app)
+    init_routes(app)
+    return app
+
+
+def _background_threads():
+    """后台线程各自占用的连接数"""
+    count = 0
+    if config.getboolean('LOTW', 'upload_enabled', fallback=False):
+        from lotw_uploader import WORKERS
+        count += WORKERS
+    if config.getboolean('WRITE_BEHIND', 'enabled', fallback=False):
+        count += 1
+    return count
+
+
+def pool_size_for(workers, threads):
+    """
+    每个工作进程的连接数: 每个请求线程一个连接，流式读取(ADIF导出、全量获取)另占一个，
+    再加上后台线程；配置了 [SERVER] db_connections(数据库允许本服务使用的总连接数)时按进程数平分
+    :param workers: 工作进程数
+    :param threads: 每个进程的请求线程数
+    :return: 连接数
+    """
+    size = threads * 2 + _background_threads()
+    budget = config.getint('SERVER', 'db_connections', fallback=0)
+    if budget:
+        # 超出部分在 _checkout 中等待空闲连接
+        size = min(size, max(budget // max(workers, 1), 2))
+    if db_utils.BACKEND == 'mysql':
+        size = min(size, MYSQL_POOL_MAX)
+    return size
+
+
+def run_migrations(strict=False):
+    """
+    更新数据库表结构(已是最新版本时只需一次查询)
+    :param strict: 迁移失败时抛出异常(gunicorn 主进程中失败时不启动工作进程)
+    """
+    try:
+        from migrations import migrate
+        applied = migrate()
+        if applied:
+            print(f"数据库表结构更新成功，已执行迁移: {applied}")
+    except Exception as e:
+        print(f"数据库表结构更新失败: {str(e)}")
+        if strict:
+            raise
+
+
+def prepare_master():
+    """gunicorn 主进程在 fork 之前执行迁移，用完即关闭临时连接池；迁移失败时抛出异常，服务不启动"""
+    init_db_pool(pool_size=MIGRATION_POOL_SIZE)
+    try:
+        run_migrations(strict=True)
+    finally:
+        db_utils.close_db_pool()
+
+
+def warmup():
+    """
+    预热: 连接池中每个连接执行一次查询，构建呼号列表、查重索引和前缀表，
+    读取统计表，使第一批请求不必等待建立连接和构建索引
+    :return: {项目: 耗时(秒)}
+    """
+    import callsign_index
+    import callsign_resolver
+    import dupe_check
+    import qso_stats
+
+    steps = [
+        ('connections', db_utils.prime_pool),
+        ('callsign_index', callsign_index.load),
+        ('dupe_check', dupe_check.load),
+        ('callsign_resolver', callsign_resolver.load),
+        ('qso_stats', qso_stats.get_total),
+    ]
+    timings = {}
+    for name, func in steps:
+        started = time.perf_counter()
+        try:
+            func()
+        except Exception as e:
+            # 索引在首次使用时重新构建
+            print(f"预热 {name} 失败，将在首次使用时重试: {str(e)}")
+            continue
+        timings[name] = round(time.perf_counter() - started, 3)
+    return timings
+
+
+def start_background():
+    """启动LOTW上传线程和写入队列(按配置)，退出时写完队列中的记录"""
+    # LOTW后台上传线程(config.ini 中 [LOTW] upload_enabled = true 时启动)
+    if config.getboolean('LOTW', 'upload_enabled', fallback=False):
+        from lotw_uploader import uploader
+        uploader.start()
+
+    # 写入队列(config.ini 中 [WRITE_BEHIND] enabled = true 时启动)
+    # 日志文件加锁，多进程部署时只有第一个启动的工作进程启用，其他进程直接写入数据库
+    if config.getboolean('WRITE_BEHIND', 'enabled', fallback=False):
+        from write_behind import writer
+        try:
+            recovered = writer.start()
+            atexit.register(writer.stop)
+            print(f"写入队列已启动，从本地日志文件恢复 {recovered} 条记录")
+        except Exception as e:
+            print(f"写入队列启动失败，新增日志将直接写入数据库: {str(e)}")
+
+
+def stop_background():
+    """工作进程退出前停止后台线程，写完队列中的记录"""
+    from lotw_uploader import uploader
+    from write_behind import writer
+
+    if writer.is_running():
+        writer.stop()
+    if uploader.is_running():
+        uploader.stop(timeout=10)
+
+
+def init_worker(pool_size=None, migrate=True):
+    """
+    初始化当前进程: 连接池、迁移、预热、后台线程
+    :param pool_size: 连接数，默认为 [DB_CONFIG] pool_size
+    :param migrate: 是否执行迁移(gunicorn 已在主进程中执行)
+    """
+    init_db_pool(pool_size)
+    if migrate:
+        run_migrations()
+    print(f"预热完成: {warmup()}")
+    start_background()
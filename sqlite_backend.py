@@ -0,0 +1,439 @@
+"""
+SQLite存储后端
+没有MySQL服务器的环境(野外、便携电脑)使用单个数据库文件保存日志，
+在 config.ini 中设置 [DB_CONFIG] backend = sqlite 启用
+
+连接池、连接和游标提供与 mysql.connector 连接池相同的接口
+(get_connection / cursor(dictionary=True) / commit / rollback / in_transaction)，
+db_utils 和业务代码中的SQL语句无需修改，执行前由 translate 转换为SQLite语法。
+转换只覆盖本项目用到的MySQL语法，新增SQL时注意在两种后端下都能执行
+
+- WAL模式：读不阻塞写，写入时其他连接仍可读取
+- 写语句和 SELECT ... FOR UPDATE 以 BEGIN IMMEDIATE 开始事务，同一时间只有一个写事务，
+  其他写入方最多等待 busy_timeout 秒；只读语句以自动提交方式执行，每次读到最新数据
+- 转换结果按原语句缓存，相同语句总是得到相同的SQL文本，命中 sqlite3 的预编译语句缓存
+"""
+
+import datetime
+import functools
+import os
+import re
+import sqlite3
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# 省略冲突目标的 ON CONFLICT DO UPDATE 需要 SQLite 3.35
+MIN_SQLITE_VERSION = (3, 35, 0)
+
+# 与MySQL相同的错误码，调用方可以按同样的方式处理
+ER_NO_SUCH_TABLE = 1146
+ER_DUP_ENTRY = 1062
+
+
+class Error(sqlite3.DatabaseError):
+    """数据库错误，与 mysql.connector.Error 一样带有 errno 和 msg 属性"""
+
+    def __init__(self, msg, errno=None):
+        super().__init__(msg)
+        self.msg = msg
+        self.errno = errno
+
+
+class PoolError(Error):
+    """连接池中没有空闲连接"""
+
+
+class DataError(Error):
+    """数据本身的错误(违反约束、值无效)，重试也不会成功"""
+
+
+def _wrap_error(error):
+    msg = str(error)
+    errno = None
+    if msg.startswith('no such table'):
+        errno = ER_NO_SUCH_TABLE
+    elif isinstance(error, sqlite3.IntegrityError) and msg.startswith('UNIQUE'):
+        errno = ER_DUP_ENTRY
+    if isinstance(error, (sqlite3.IntegrityError, sqlite3.DataError)):
+        return DataError(msg, errno)
+    return Error(msg, errno)
+
+
+# DATE/DATETIME 列以ISO格式文本保存，读取时与MySQL一样转换为 date/datetime
+
+def _convert_date(value):
+    text = value.decode()
+    try:
+        return datetime.date.fromisoformat(text[:10])
+    except ValueError:
+        return text
+
+
+def _convert_datetime(value):
+    text = value.decode()
+    try:
+        return datetime.datetime.fromisoformat(text)
+    except ValueError:
+        return text
+
+
+sqlite3.register_adapter(datetime.date, lambda value: value.isoformat())
+sqlite3.register_adapter(datetime.datetime, lambda value: value.isoformat(' ', 'seconds'))
+sqlite3.register_converter('DATE', _convert_date)
+sqlite3.register_converter('DATETIME', _convert_datetime)
+
+
+# SQLite没有的MySQL函数
+
+def _year(value):
+    return int(str(value)[:4]) if value else None
+
+
+def _left(value, length):
+    if value is None or length is None:
+        return None
+    return str(value)[:int(length)]
+
+
+def _concat(*values):
+    if any(value is None for value in values):
+        return None
+    return "".join(str(value) for value in values)
+
+
+def _char_length(value):
+    return None if value is None else len(str(value))
+
+
+# ---- SQL转换 ----
+
+_PLACEHOLDER = re.compile(r"%\((\w+)\)s|%s|%%")
+_FOR_UPDATE = re.compile(r"\s+FOR\s+UPDATE\s*$", re.I)
+_UPSERT = re.compile(r"\bON\s+DUPLICATE\s+KEY\s+UPDATE\b", re.I)
+_UPSERT_VALUES = re.compile(r"\bVALUES\((\w+)\)", re.I)
+_TABLE_DDL = re.compile(r"^\s*(CREATE|ALTER)\s+TABLE\b", re.I)
+_TABLE_CONSTRAINT = re.compile(r"^(PRIMARY\s+KEY|UNIQUE|CONSTRAINT)\b", re.I)
+
+# 建表和加列语句
+_DDL_REWRITES = [
+    (re.compile(r"\s*\bENGINE\s*=\s*\w+", re.I), ""),
+    (re.compile(r"\s*\bDEFAULT\s+CHARSET\s*=\s*\w+", re.I), ""),
+    (re.compile(r"\s*\bCOMMENT\s+'(?:[^']|'')*'", re.I), ""),
+    (re.compile(r"\bINT\s+AUTO_INCREMENT\s+PRIMARY\s+KEY\b", re.I), "INTEGER PRIMARY KEY AUTOINCREMENT"),
+    # MySQL utf8mb4 默认排序规则不区分大小写，比较、唯一键和 LIKE 与之保持一致
+    (re.compile(r"\b(VARCHAR\(\d+\)|TEXT)", re.I), r"\1 COLLATE NOCASE"),
+]
+
+_REWRITES = [
+    (re.compile(r"\bNOW\(\)\s*-\s*INTERVAL\s+(\?|:\w+|\d+)\s+SECOND\b", re.I),
+     r"datetime('now', 'localtime', '-' || \1 || ' seconds')"),
+    (re.compile(r"\bNOW\(\)", re.I), "datetime('now', 'localtime')"),
+    (re.compile(r"\bIF\(", re.I), "IIF("),
+    (re.compile(r"\bGREATEST\(", re.I), "MAX("),
+    (re.compile(r"\bLEAST\(", re.I), "MIN("),
+    # LEFT 在SQLite中是关键字，不能作为函数名
+    (re.compile(r"\bLEFT\(", re.I), "MYSQL_LEFT("),
+    (re.compile(r"\bINSERT\s+IGNORE\b", re.I), "INSERT OR IGNORE"),
+    (re.compile(r"^\s*TRUNCATE\s+TABLE\b", re.I), "DELETE FROM"),
+    (re.compile(r"\bUPDATE\s+(\w+)\s+(?!SET\b)(\w+)\s+SET\b", re.I), r"UPDATE \1 AS \2 SET"),
+    # 行构造器 IN 列表: (a, b) IN ((?, ?), ...) -> (a, b) IN (VALUES (?, ?), ...)
+    (re.compile(r"\)\s+IN\s+\(\s*\("), ") IN (VALUES ("),
+    # MySQL的 LIKE 默认以反斜杠转义通配符
+    (re.compile(r"\bLIKE\s+(\?|:\w+)", re.I), r"LIKE \1 ESCAPE '\\'"),
+]
+
+
+def _placeholder(match):
+    if match.group(1):
+        return ':' + match.group(1)
+    return '?' if match.group(0) == '%s' else '%'
+
+
+def _split_top_level(text):
+    """按最外层的逗号拆分列表"""
+    parts, depth, quoted, start = [], 0, False, 0
+    for i, char in enumerate(text):
+        if char == "'":
+            quoted = not quoted
+        elif quoted:
+            continue
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return [part.strip() for part in parts if part.strip()]
+
+
+def _translate_upsert(sql):
+    """
+    INSERT ... ON DUPLICATE KEY UPDATE -> INSERT ... ON CONFLICT DO UPDATE
+    与MySQL一样，没有任何列发生变化的记录不写入，也不计入受影响行数
+    """
+    head, tail = _UPSERT.split(sql, maxsplit=1)
+    tail = _UPSERT_VALUES.sub(r"excluded.\1", tail)
+    assignments = _split_top_level(tail)
+    columns, expressions = [], []
+    for assignment in assignments:
+        column, expression = assignment.split('=', 1)
+        columns.append(column.strip())
+        expressions.append(expression.strip())
+    return (f"{head.rstrip()} ON CONFLICT DO UPDATE SET {', '.join(assignments)} "
+            f"WHERE ({', '.join(columns)}) IS NOT ({', '.join(expressions)})")
+
+
+def _reorder_constraints(sql):
+    """SQLite要求表约束写在所有列之后，MySQL没有这个限制"""
+    start, end = sql.find('('), sql.rfind(')')
+    if not sql.upper().startswith('CREATE') or start < 0:
+        return sql
+    items = _split_top_level(sql[start + 1:end])
+    ordered = sorted(items, key=lambda item: bool(_TABLE_CONSTRAINT.match(item)))
+    if ordered == items:
+        return sql
+    return f"{sql[:start + 1]}\n    {', '.join(ordered)}\n{sql[end:]}"
+
+
+@functools.lru_cache(maxsize=1024)
+def translate(query):
+    """
+    将MySQL语法的语句转换为SQLite语法
+    :return: (SQL, 类型)，类型为 read、write、lock(SELECT ... FOR UPDATE)、commit、rollback
+    """
+    sql = _PLACEHOLDER.sub(_placeholder, query).strip()
+    keyword = sql.split(None, 1)[0].upper() if sql else ''
+    if keyword in ('COMMIT', 'ROLLBACK'):
+        return sql, keyword.lower()
+    if _TABLE_DDL.match(sql):
+        for pattern, replacement in _DDL_REWRITES:
+            sql = pattern.sub(replacement, sql)
+        return _reorder_constraints(sql), 'write'
+
+    kind = 'read' if keyword in ('SELECT', 'WITH', 'PRAGMA') else 'write'
+    if kind == 'read' and _FOR_UPDATE.search(sql):
+        sql = _FOR_UPDATE.sub("", sql)
+        kind = 'lock'
+    if _UPSERT.search(sql):
+        sql = _translate_upsert(sql)
+    for pattern, replacement in _REWRITES:
+        sql = pattern.sub(replacement, sql)
+    return sql, kind
+
+
+# ---- 连接池 ----
+
+def _dict_row(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+def _lock_file(f):
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+
+
+def _unlock_file(f):
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class SQLiteCursor:
+    """接口与 mysql.connector 游标相同，执行前转换SQL"""
+
+    def __init__(self, connection, dictionary=False):
+        self._connection = connection
+        self._cursor = connection.raw.cursor()
+        if dictionary:
+            self._cursor.row_factory = _dict_row
+
+    def execute(self, query, params=()):
+        sql, kind = translate(query)
+        if kind == 'commit':
+            return self._connection.commit()
+        if kind == 'rollback':
+            return self._connection.rollback()
+        try:
+            if kind != 'read' and not self._connection.in_transaction:
+                # 事务开始时就获取写锁，先读后写的事务不会在升级锁时失败
+                self._cursor.execute("BEGIN IMMEDIATE")
+            self._cursor.execute(sql, params or ())
+        except sqlite3.Error as e:
+            raise _wrap_error(e) from e
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size=1):
+        return self._cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    """连接池中的连接，close() 时归还连接池"""
+
+    # sqlite3 游标按需读取，没有需要丢弃的未读结果
+    unread_result = False
+
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self.raw = raw
+        # 命名锁(GET_LOCK)属于连接: 锁名 -> 锁文件
+        self._named_locks = {}
+        raw.create_function('GET_LOCK', 2, self._get_lock)
+        raw.create_function('RELEASE_LOCK', 1, self._release_lock)
+
+    @property
+    def in_transaction(self):
+        return self.raw.in_transaction
+
+    def cursor(self, dictionary=False, buffered=None):
+        return SQLiteCursor(self, dictionary)
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def consume_results(self):
+        pass
+
+    def close(self):
+        if self.raw.in_transaction:
+            self.raw.rollback()
+        self._pool.release(self)
+
+    def _get_lock(self, name, timeout):
+        """与MySQL的 GET_LOCK 相同，用锁文件实现，同一台机器上的进程之间互斥"""
+        if name in self._named_locks:
+            return 1
+        f = open(f"{self._pool.path}.{name}.lock", 'a+b')
+        deadline = time.monotonic() + timeout if timeout is not None and timeout >= 0 else None
+        while True:
+            try:
+                _lock_file(f)
+                break
+            except OSError:
+                if deadline is not None and time.monotonic() >= deadline:
+                    f.close()
+                    return 0
+                time.sleep(0.05)
+        self._named_locks[name] = f
+        return 1
+
+    def _release_lock(self, name):
+        f = self._named_locks.pop(name, None)
+        if f is None:
+            return 0
+        try:
+            _unlock_file(f)
+        finally:
+            f.close()
+        return 1
+
+
+class SQLiteConnectionPool:
+    """
+    固定大小的连接池，初始化时创建全部连接
+    :param path: 数据库文件路径，所在目录不存在时自动创建
+    :param synchronous: WAL模式下 NORMAL 只在检查点时同步磁盘，断电最多丢失最近提交的事务
+    :param cache_size_mb: 每个连接的页缓存大小
+    :param mmap_size_mb: 内存映射读取的大小，0为不使用
+    :param busy_timeout: 等待其他连接释放写锁的最长时间(秒)
+    :param statement_cache_size: 每个连接缓存的预编译语句数
+    """
+
+    def __init__(self, path, pool_size=5, synchronous='NORMAL', cache_size_mb=64, mmap_size_mb=256,
+                 busy_timeout=10, statement_cache_size=256):
+        if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+            raise Error(f"SQLite版本过低: {sqlite3.sqlite_version}，"
+                        f"需要 {'.'.join(map(str, MIN_SQLITE_VERSION))} 以上")
+        self.path = path
+        self.pool_size = pool_size
+        self._settings = {
+            'synchronous': synchronous,
+            'cache_size_mb': cache_size_mb,
+            'mmap_size_mb': mmap_size_mb,
+            'busy_timeout': busy_timeout,
+            'statement_cache_size': statement_cache_size,
+        }
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._idle = [self._connect() for _ in range(pool_size)]
+
+    def _connect(self):
+        settings = self._settings
+        raw = sqlite3.connect(
+            self.path,
+            timeout=settings['busy_timeout'],
+            # 事务由 SQLiteCursor 显式开始
+            isolation_level=None,
+            # 连接会被不同线程先后使用，同一时间只属于一个线程
+            check_same_thread=False,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            cached_statements=settings['statement_cache_size'],
+        )
+        raw.execute("PRAGMA journal_mode = WAL")
+        raw.execute(f"PRAGMA synchronous = {settings['synchronous']}")
+        raw.execute(f"PRAGMA cache_size = {-int(settings['cache_size_mb'] * 1024)}")
+        raw.execute(f"PRAGMA mmap_size = {int(settings['mmap_size_mb'] * 1024 * 1024)}")
+        raw.execute("PRAGMA temp_store = MEMORY")
+        raw.create_function('YEAR', 1, _year, deterministic=True)
+        raw.create_function('MYSQL_LEFT', 2, _left, deterministic=True)
+        raw.create_function('CONCAT', -1, _concat, deterministic=True)
+        raw.create_function('CHAR_LENGTH', 1, _char_length, deterministic=True)
+        return SQLiteConnection(self, raw)
+
+    def get_connection(self):
+        with self._lock:
+            if not self._idle:
+                raise PoolError("连接池已耗尽")
+            return self._idle.pop()
+
+    def release(self, connection):
+        with self._lock:
+            if not self._closed:
+                self._idle.append(connection)
+                return
+        connection.raw.close()
+
+    def close(self):
+        """关闭空闲连接，借出的连接归还时关闭"""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.raw.close()
@@ -10,9 +10,17 @@ function initPage() {
 
 let currentPage = 1;
 let totalRecords = 0;
+const PAGE_SIZE = 25;
+// 当前页游标以及服务端返回的前后翻页游标
+let currentCursor = null;
+let pageCursors = { next: null, prev: null };
+// 当前筛选条件(由服务端按索引筛选)，翻页时随游标一起提交
+let currentFilters = {};
+// 列表显示的列，服务端只查询并返回这些列(按列组织，见 log_encoding.py)
+const LIST_FIELDS = 'id,date,time,callsign,frequency,mode,equipment,antenna,power,dxcc,grid,province,band,qslcard,notes';
 
-// 加载日志数据(带分页)
-function loadLogs(page = 1) {
+// 加载日志数据(游标分页)
+function loadLogs(cursor = null, page = 1) {
     const tbody = document.querySelector('#log-table tbody');
     if (!tbody) return;
     
@@ -22,7 +30,11 @@ function loadLogs(page = 1) {
     tbody.innerHTML = '';
     tbody.appendChild(loadingRow);
     
-    fetch(`/api/logs?page=${page}&size=25`)
+    const params = new URLSearchParams({ size: PAGE_SIZE, format: 'columns', fields: LIST_FIELDS });
+    if (cursor) params.set('cursor', cursor);
+    Object.entries(currentFilters).forEach(([name, value]) => params.set(name, value));
+    
+    fetch(`/api/logs?${params.toString()}`)
         .then(response => {
             if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
             return response.json();
@@ -30,11 +42,13 @@ function loadLogs(page = 1) {
         .then(data => {
             if (data.success) {
                 currentPage = page;
+                currentCursor = cursor;
                 totalRecords = data.total;
+                pageCursors = { next: data.next, prev: data.prev };
                 // 清除加载状态
                 tbody.innerHTML = '';
                 renderLogData(data);
-                updatePaginationInfo(data.total, page);
+                updatePaginationInfo(data.total, page, data.total_exact !== false);
             }
         })
         .catch(error => {
@@ -46,44 +60,49 @@ function loadLogs(page = 1) {
 // 初始化页面
 function initPage() {
     try {
-        loadLogs(1);
+        loadLogs();
     } catch (e) {
         console.error('加载日志失败:', e);
     }
 }
 
-// 渲染日志数据
+// 渲染日志数据(format=columns: columns 为列名，data[i] 为第i列各条记录的值)
 function renderLogData(response) {
     const tbody = document.querySelector('#log-table tbody');
     if (!tbody) return;
 
-    response.data.forEach(log => {
+    const column = {};
+    response.columns.forEach((name, i) => { column[name] = response.data[i]; });
+    const count = column.id ? column.id.length : 0;
+
+    for (let i = 0; i < count; i++) {
+        const value = name => (column[name] ? column[name][i] : null) ?? '';
         const row = document.createElement('tr');
         row.innerHTML = `
-            <td><input type="checkbox" class="log-checkbox" data-id="${log.id}"></td>
-            <td>${formatDate(log.date) || ''}</td>
-            <td>${log.time || ''}</td>
-            <td>${log.callsign || ''}</td>
-            <td>${log.frequency || ''}</td>
-            <td>${log.mode || ''}</td>
-            <td>${log.equipment || ''}</td>
-            <td>${log.antenna || ''}</td>
-            <td>${log.power || ''}</td>
-            <td>${log.dxcc || ''}</td>
-            <td>${log.grid || ''}</td>
-            <td>${log.province || ''}</td>
-            <td>${log.band || ''}</td>
-            <td>${getQSLStatusText(log.qslcard)}</td>
-            <td>${log.notes || ''}</td>
-            <td>${log.status || ''}</td>
+            <td><input type="checkbox" class="log-checkbox" data-id="${value('id')}"></td>
+            <td>${formatDate(value('date')) || ''}</td>
+            <td>${value('time')}</td>
+            <td>${value('callsign')}</td>
+            <td>${value('frequency') || ''}</td>
+            <td>${value('mode')}</td>
+            <td>${value('equipment')}</td>
+            <td>${value('antenna')}</td>
+            <td>${value('power') || ''}</td>
+            <td>${value('dxcc')}</td>
+            <td>${value('grid')}</td>
+            <td>${value('province')}</td>
+            <td>${value('band')}</td>
+            <td>${getQSLStatusText(value('qslcard'))}</td>
+            <td>${value('notes')}</td>
+            <td></td>
             <td>
-                <button class="btn btn-sm btn-outline-primary edit-btn" data-id="${log.id}">
+                <button class="btn btn-sm btn-outline-primary edit-btn" data-id="${value('id')}">
                     <i class="bi bi-pencil"></i>
                 </button>
             </td>
         `;
         tbody.appendChild(row);
-    });
+    }
 
     // 初始化复选框事件监听
     const checkboxes = document.querySelectorAll('.log-checkbox');
@@ -97,9 +116,6 @@ function renderLogData(response) {
             updateButtonStates();
         });
     });
-
-    // 更新分页信息
-    updatePaginationInfo(response.total);
 }
 
 // 更新按钮状态
@@ -133,31 +149,106 @@ function getQSLStatusText(status) {
 }
 
 // 更新分页信息
-function updatePaginationInfo(total, currentPage) {
-    const totalPages = Math.ceil(total / 25);
+function updatePaginationInfo(total, currentPage, totalExact = true) {
+    const totalPages = Math.max(1, Math.ceil(total / PAGE_SIZE));
     const prevPage = document.getElementById('prev-page');
     const nextPage = document.getElementById('next-page');
     const pageInfo = document.getElementById('page-info');
     
     // 更新按钮状态
-    prevPage.classList.toggle('disabled', currentPage <= 1);
-    nextPage.classList.toggle('disabled', currentPage >= totalPages);
+    prevPage.classList.toggle('disabled', !pageCursors.prev);
+    nextPage.classList.toggle('disabled', !pageCursors.next);
     
     // 更新分页信息显示
     if (pageInfo) {
-        pageInfo.textContent = `第 ${currentPage} 页，共 ${totalPages} 页 (${total} 条记录)`;
+        pageInfo.textContent = totalExact
+            ? `第 ${currentPage} 页，共 ${totalPages} 页 (${total} 条记录)`
+            : `第 ${currentPage} 页 (超过 ${total} 条记录)`;
     }
     
     // 添加分页按钮事件
     prevPage.onclick = () => {
-        if (currentPage > 1) loadLogs(currentPage - 1);
+        if (pageCursors.prev) loadLogs(pageCursors.prev, Math.max(1, currentPage - 1));
     };
     
     nextPage.onclick = () => {
-        if (currentPage < totalPages) loadLogs(currentPage + 1);
+        if (pageCursors.next) loadLogs(pageCursors.next, currentPage + 1);
     };
 }
 
+// 初始化搜索和筛选
+function initFilters() {
+    const callsignInput = document.getElementById('search-callsign');
+    const searchButton = document.getElementById('search-button');
+    const confirmedFilter = document.getElementById('filter-confirmed');
+    const recentFilter = document.getElementById('filter-recent');
+
+    const applyFilters = () => {
+        const filters = {};
+        const callsign = callsignInput ? callsignInput.value.trim() : '';
+        if (callsign) filters.callsign = callsign;
+        if (confirmedFilter && confirmedFilter.checked) filters.confirmed = 'true';
+        if (recentFilter && recentFilter.checked) {
+            const since = new Date(Date.now() - 30 * 24 * 3600 * 1000);
+            filters.date_from = since.toISOString().slice(0, 10);
+        }
+        currentFilters = filters;
+        loadLogs();
+    };
+
+    if (searchButton) searchButton.addEventListener('click', applyFilters);
+    if (callsignInput) {
+        callsignInput.addEventListener('keydown', e => {
+            if (e.key === 'Enter') applyFilters();
+        });
+    }
+    [confirmedFilter, recentFilter].forEach(checkbox => {
+        if (checkbox) checkbox.addEventListener('change', applyFilters);
+    });
+}
+
+// 导出ADI文件(使用当前筛选条件，由服务端流式生成)
+function initExportButton() {
+    const exportButton = document.getElementById('export-log');
+    if (!exportButton) return;
+    exportButton.addEventListener('click', () => {
+        const params = new URLSearchParams(currentFilters);
+        window.location.href = `/api/export.adi?${params.toString()}`;
+    });
+}
+
+// LOTW上传：只通知服务端后台上传线程开始处理，不等待上传完成
+function initLotwButtons() {
+    const uploadButton = document.getElementById('upload-to-lotw');
+    const statusButton = document.getElementById('check-sync-status');
+
+    if (uploadButton) {
+        uploadButton.addEventListener('click', () => {
+            fetch('/api/lotw/upload?retry_failed=true', { method: 'POST' })
+                .then(response => response.json())
+                .then(data => {
+                    if (!data.success) throw new Error(data.message);
+                    alert(`已开始上传，待上传 ${data.data.queue.pending} 条`);
+                })
+                .catch(error => alert('上传失败: ' + error.message));
+        });
+    }
+
+    if (statusButton) {
+        statusButton.addEventListener('click', () => {
+            fetch('/api/lotw/upload')
+                .then(response => response.json())
+                .then(data => {
+                    if (!data.success) throw new Error(data.message);
+                    const queue = data.data.queue;
+                    alert(`未同步 ${queue.pending} 条，同步中 ${queue.uploading} 条，` +
+                          `已同步 ${queue.uploaded} 条，同步失败 ${queue.failed} 条`);
+                })
+                .catch(error => alert('获取同步状态失败: ' + error.message));
+        });
+    }
+}
+
 // 初始化全选功能
 function initSelectAll() {
     const selectAll = document.getElementById('select-all');
@@ -172,6 +263,52 @@ function initSelectAll() {
     }
 }
 
+// 编辑框中的字段及提交时的类型转换
+const EDIT_FIELDS = {
+    callsign: value => value, frequency: parseFloat, mode: value => value,
+    equipment: value => value, antenna: value => value, power: parseFloat,
+    dxcc: value => value, grid: value => value, province: value => value, band: value => value,
+    qslcard: value => parseInt(value), notes: value => value, date: value => value, time: value => value
+};
+// 多选时不能统一修改的字段(每条记录各不相同，统一修改后QSO唯一键会重复)
+const PER_RECORD_FIELDS = ['callsign', 'date', 'time'];
+// 单条编辑时载入的原值，只提交改动的字段；多选时为 null
+let editOriginal = null;
+
+// 读取编辑框中各字段的值(去掉首尾空格的字符串)
+function readEditForm() {
+    const values = {};
+    Object.keys(EDIT_FIELDS).forEach(field => {
+        values[field] = document.getElementById(`edit-${field}`).value.trim();
+    });
+    return values;
+}
+
+function showEditModal() {
+    // 尝试两种方式显示模态框
+    try {
+        // 方式1: 使用Bootstrap原生JS
+        const editModal = new bootstrap.Modal(document.getElementById('editModal'));
+        editModal.show();
+    } catch (e) {
+        console.log('Bootstrap JS方式失败，尝试jQuery方式:', e);
+        // 方式2: 使用jQuery作为备选
+        $('#editModal').modal('show');
+    }
+}
+
+// 多选时清空编辑框，只修改填写的字段，呼号、日期、时间不可修改
+function setBatchEditMode(count) {
+    const batch = count > 1;
+    document.querySelector('#editModal .modal-title').textContent = batch ? `批量修改 ${count} 条记录` : '编辑记录';
+    Object.keys(EDIT_FIELDS).forEach(field => {
+        const input = document.getElementById(`edit-${field}`);
+        input.disabled = batch && PER_RECORD_FIELDS.includes(field);
+        input.required = !batch && ['callsign', 'frequency', 'mode', 'date', 'time'].includes(field);
+        if (batch) input.value = '';
+    });
+}
+
 // 初始化编辑按钮
 function initEditButtons() {
     // 确保使用正确的按钮选择器
@@ -183,12 +320,14 @@ function initEditButtons() {
                 alert('请至少选择一条记录');
                 return;
             }
+            setBatchEditMode(selectedIds.length);
             if (selectedIds.length > 1) {
-                alert('一次只能编辑一条记录，请取消多余选择');
+                editOriginal = null;
+                showEditModal();
                 return;
             }
             
-            // 加载第一条选中记录的数据用于编辑
+            // 加载选中记录的数据用于编辑
             fetch(`/api/logs/${selectedIds[0]}`)
                 .then(response => response.json())
                 .then(data => {
@@ -218,17 +357,8 @@ function initEditButtons() {
                         const hours = String(timeObj.getHours()).padStart(2, '0');
                         const minutes = String(timeObj.getMinutes()).padStart(2, '0');
                         document.getElementById('edit-time').value = `${hours}:${minutes}`;
-                        
-                        // 尝试两种方式显示模态框
-                        try {
-                            // 方式1: 使用Bootstrap原生JS
-                            const editModal = new bootstrap.Modal(document.getElementById('editModal'));
-                            editModal.show();
-                        } catch (e) {
-                            console.log('Bootstrap JS方式失败，尝试jQuery方式:', e);
-                            // 方式2: 使用jQuery作为备选
-                            $('#editModal').modal('show');
-                        }
+                        editOriginal = readEditForm();
+                        showEditModal();
                     }
                 });
         });
@@ -262,23 +392,47 @@ function getSelectedLogIds() {
     return Array.from(checkboxes).map(checkbox => checkbox.dataset.id);
 }
 
+// 调用批量接口，所有改动在一个事务中完成
+function postBatch(payload) {
+    return fetch('/api/logs/batch', {
+        method: 'POST',
+        body: JSON.stringify(payload),
+        headers: {
+            'Content-Type': 'application/json',
+            'Accept': 'application/json'
+        }
+    })
+    .then(async response => {
+        const data = await response.json();
+        if (!response.ok && !data.data) {
+            throw new Error(data.message || `HTTP error! status: ${response.status}`);
+        }
+        return data;
+    });
+}
+
+// 汇总批量接口返回的失败记录
+function describeFailures(results) {
+    return results
+        .filter(result => !result.success)
+        .map(result => `记录 ${result.id}: ${result.message}`)
+        .join('\n');
+}
+
 // 删除选中的记录
 function deleteSelectedLogs(ids) {
-    // 将ID数组转换为逗号分隔的字符串
-    const idParam = ids.join(',');
-    fetch(`/api/logs/del?id=${idParam}`)
-    .then(response => response.json())
+    postBatch({ action: 'delete', ids: ids.map(Number) })
     .then(data => {
         if (data.success) {
             alert('删除成功');
-            initPage(); // 刷新列表
         } else {
-            alert('删除失败: ' + data.message);
+            alert(`${data.message}\n${describeFailures(data.data)}`);
         }
+        loadLogs(currentCursor, currentPage); // 刷新列表
     })
     .catch(error => {
         console.error('删除错误:', error);
-        alert('删除过程中发生错误');
+        alert('删除过程中发生错误: ' + error.message);
     });
 }
 
@@ -305,6 +459,9 @@ document.addEventListener('DOMContentLoaded', function() {
         .then(() => {
             try {
                 initPage();
+                initFilters();
+                initLotwButtons();
+                initExportButton();
                 initSelectAll();
                 initEditButtons();
                 initDeleteButton();
@@ -320,48 +477,35 @@ document.addEventListener('DOMContentLoaded', function() {
     // 初始化模态框保存按钮
     document.getElementById('save-changes')?.addEventListener('click', function() {
         const selectedIds = getSelectedLogIds();
-        // 准备表单数据并进行基本处理
-        const formData = {
-            callsign: document.getElementById('edit-callsign').value.trim(),
-            frequency: parseFloat(document.getElementById('edit-frequency').value) || 0,
-            mode: document.getElementById('edit-mode').value.trim(),
-            equipment: document.getElementById('edit-equipment').value.trim(),
-            antenna: document.getElementById('edit-antenna').value.trim(),
-            power: parseFloat(document.getElementById('edit-power').value) || 0,
-            dxcc: document.getElementById('edit-dxcc').value.trim(),
-            grid: document.getElementById('edit-grid').value.trim(),
-            province: document.getElementById('edit-province').value.trim(),
-            band: document.getElementById('edit-band').value.trim(),
-            qslcard: parseInt(document.getElementById('edit-qslcard').value) || 0,
-            notes: document.getElementById('edit-notes').value.trim(),
-            date: document.getElementById('edit-date').value.trim(),
-            time: document.getElementById('edit-time').value.trim()
-        };
+        // 只提交改动的字段: 单条编辑时与载入的原值比较，多选时为填写了的字段
+        const values = readEditForm();
+        const patch = {};
+        Object.keys(EDIT_FIELDS).forEach(field => {
+            const unchanged = editOriginal
+                ? values[field] === editOriginal[field]
+                : values[field] === '' || PER_RECORD_FIELDS.includes(field);
+            if (!unchanged) patch[field] = EDIT_FIELDS[field](values[field]);
+        });
 
+        if (Object.keys(patch).length === 0) {
+            alert('没有修改任何字段');
+            return;
+        }
         // 验证必填字段
-        if (!formData.callsign || !formData.mode || isNaN(formData.frequency)) {
-            alert('呼号、频率和模式是必填字段，且频率必须是数字');
+        if (('callsign' in patch && !patch.callsign) || ('mode' in patch && !patch.mode)
+            || ['frequency', 'power', 'qslcard'].some(field => field in patch && isNaN(patch[field]))) {
+            alert('呼号、频率和模式是必填字段，且频率、功率必须是数字');
             return;
         }
 
         // 批量更新选中的记录
-        Promise.all(selectedIds.map(id => {
-            return fetch(`/api/logs/${id}`, {
-                method: 'PUT',
-                body: JSON.stringify(formData),
-                headers: {
-                    'Content-Type': 'application/json',
-                    'Accept': 'application/json'
-                }
-            })
-            .then(async response => {
-                const data = await response.json();
-                if (!response.ok || !data.success) {
-                    throw new Error(data.message || `记录 ${id} 更新失败`);
-                }
-                return data;
-            });
-        }))
+        postBatch({ action: 'update', ids: selectedIds.map(Number), patch: patch })
+        .then(data => {
+            if (!data.success) {
+                throw new Error(`${data.message}\n${describeFailures(data.data || [])}`);
+            }
+            return data;
+        })
         .then(() => {
             alert('更新成功');
             try {
@@ -374,7 +518,7 @@ document.addEventListener('DOMContentLoaded', function() {
             } catch (e) {
                 console.error('关闭模态框失败:', e);
             }
-            loadLogs(currentPage); // 刷新当前页列表
+            loadLogs(currentCursor, currentPage); // 刷新当前页列表
         })
         .catch(error => {
             console.error('更新错误:', error);
@@ -0,0 +1,76 @@
+"""
+测试夹具
+每个测试使用临时目录中的新SQLite数据库(不需要MySQL服务器)，日志版本文件也放在临时目录，
+进程内的索引和缓存在测试之间清空
+运行: python -m pytest tests
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import db_utils
+import log_version
+
+
+def _reset_memory_state():
+    import callsign_index
+    import dupe_check
+    import http_cache
+
+    callsign_index._callsigns = None
+    callsign_index._counts = {}
+    callsign_index._history.clear()
+    callsign_index._version = None
+    dupe_check._index = None
+    dupe_check._version = None
+    http_cache._cache.clear()
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """空的SQLite数据库(未执行迁移)，测试结束后关闭连接池"""
+    monkeypatch.setattr(db_utils, 'BACKEND', 'sqlite')
+    monkeypatch.setitem(db_utils.sqlite_config, 'path', str(tmp_path / 'qso_log.db'))
+    monkeypatch.setitem(db_utils.sqlite_config, 'pool_size', 5)
+    monkeypatch.setattr(log_version, 'VERSION_FILE', str(tmp_path / 'log_version'))
+    monkeypatch.setattr(log_version, 'CHANGES_FILE', str(tmp_path / 'log_changes'))
+    _reset_memory_state()
+    yield tmp_path
+    db_utils.close_db_pool()
+    _reset_memory_state()
+
+
+@pytest.fixture
+def migrated(database):
+    """执行全部迁移后的数据库"""
+    from migrations import migrate
+
+    db_utils.init_db_pool()
+    migrate()
+    return database
+
+
+@pytest.fixture
+def client(migrated):
+    import server
+
+    app = server.create_app()
+    app.config['TESTING'] = True
+    app.config['WTF_CSRF_ENABLED'] = False
+    return app.test_client()
+
+
+@pytest.fixture
+def add_qso(client):
+    """通过 /log/new 录入一条日志"""
+    def add(**fields):
+        data = {'callsign': 'BG1AA', 'frequency': 14.074, 'mode': 'FT8', 'date': '2024-01-01',
+                'time': '12:00', 'band': '20m', 'qslcard': '0', 'power': '5'}
+        data.update(fields)
+        response = client.post('/log/new', data=data)
+        assert response.status_code == 201, response.get_json()
+    return add
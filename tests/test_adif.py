@@ -0,0 +1,58 @@
+import io
+
+from adif import read_adi_records
+from db_utils import execute_query
+
+ADI = """Test log
+<ADIF_VER:5>3.1.4 <EOH>
+<CALL:6>JA1XYZ <QSO_DATE:8>20240105 <TIME_ON:6>123045 <BAND:3>20M <MODE:3>FT8 <FREQ:6>14.074 <EOR>
+<CALL:5>BG1AA <QSO_DATE:8>20240106 <TIME_ON:4>0800 <BAND:3>40m <MODE:2>CW <FREQ:5>7.020
+<LOTW_QSL_RCVD:1>Y <EOR>
+<CALL:4>W1AW <QSO_DATE:8>2024011 <TIME_ON:4>0800 <BAND:3>40m <MODE:2>CW <EOR>
+"""
+
+
+def _import(client, text):
+    response = client.post('/api/import/adif', data={'file': (io.BytesIO(text.encode('utf-8')), 'log.adi')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['data']
+
+
+def test_import_skips_invalid_records_and_normalizes(client):
+    stats = _import(client, ADI)
+    assert (stats['added'], stats['updated']) == (2, 0)
+    rows = execute_query("SELECT callsign, date, time, band, confirmed, qso_datetime_utc FROM qso_log ORDER BY id",
+                         fetch=True)
+    assert [(r['callsign'], str(r['date']), r['time'], r['band'], r['confirmed']) for r in rows] == [
+        ('JA1XYZ', '2024-01-05', '12:30', '20m', 0),
+        ('BG1AA', '2024-01-06', '08:00', '40m', 1),
+    ]
+    # 秒只保留在 qso_datetime_utc 中
+    assert str(rows[0]['qso_datetime_utc']) == '2024-01-05 12:30:45'
+
+
+def test_reimport_matches_existing_records(client, add_qso):
+    # 手工录入的时间格式不同(1230)，与导入的同一QSO按唯一键合并
+    add_qso(callsign='JA1XYZ', date='2024-01-05', time='1230', band='20m', mode='FT8')
+    assert _import(client, ADI)['added'] == 1
+    stats = _import(client, ADI)
+    assert (stats['added'], stats['updated']) == (0, 0)
+    assert client.get('/api/logs/count').get_json()['count'] == 2
+    assert client.get('/api/dupe?callsign=JA1XYZ&band=20m&mode=FT8').get_json()['data']['dupe'] is True
+
+
+def test_export_round_trip(client):
+    _import(client, ADI)
+    response = client.get('/api/export.adi')
+    assert response.status_code == 200
+    records = list(read_adi_records(io.BytesIO(response.data), 'utf-8'))
+    assert [(r['CALL'], r['QSO_DATE'], r['BAND'].lower(), r['MODE']) for r in records] == [
+        ('JA1XYZ', '20240105', '20m', 'FT8'),
+        ('BG1AA', '20240106', '40m', 'CW'),
+    ]
+    assert records[1].get('LOTW_QSL_RCVD') == 'Y'
+
+    # 导出的文件再次导入时全部识别为已有记录
+    stats = _import(client, response.data.decode('utf-8'))
+    assert (stats['added'], stats['updated']) == (0, 0)
@@ -0,0 +1,86 @@
+from unittest import mock
+
+import callsign_index
+import dupe_check
+import log_version
+from db_utils import execute_query
+
+OTHER_PID = 1
+
+
+def _foreign_insert(callsign, band='40m', mode='CW'):
+    """模拟其他工作进程写入: 直接插入并以其他进程号记录日志版本"""
+    log_id = execute_query(
+        "INSERT INTO qso_log (callsign, frequency, mode, date, time, band, qslcard, qso_datetime_utc) "
+        "VALUES (%s, 7.0, %s, '2024-02-01', '10:00', %s, 0, '2024-02-01 10:00:00')",
+        (callsign, mode, band))
+    with mock.patch('os.getpid', return_value=OTHER_PID):
+        log_version.advance([log_id])
+    return log_id
+
+
+def _foreign_delete(log_id):
+    execute_query("DELETE FROM qso_log WHERE id = %s", (log_id,))
+    with mock.patch('os.getpid', return_value=OTHER_PID):
+        log_version.advance()
+
+
+def _count_loads(monkeypatch):
+    loads = []
+    for module in (callsign_index, dupe_check):
+        original = module.load
+        monkeypatch.setattr(module, 'load', lambda original=original, name=module.__name__: (
+            loads.append(name), original())[1])
+    return loads
+
+
+def test_foreign_inserts_are_applied_without_rebuild(client, add_qso, monkeypatch):
+    add_qso(callsign='BG1AA')
+    assert dupe_check.check('BG1AA', '20m', 'FT8')['dupe']
+    assert callsign_index.suggest('JA') == []
+    loads = _count_loads(monkeypatch)
+
+    _foreign_insert('JA1XYZ')
+    assert callsign_index.suggest('JA') == [{'callsign': 'JA1XYZ', 'count': 1}]
+    assert dupe_check.check('JA1XYZ', '40m', 'CW')['dupe']
+    # 本进程的写入与其他进程的新增交替
+    add_qso(callsign='JA1XYZ')
+    _foreign_insert('JA1XYZ', band='15m')
+    assert callsign_index.suggest('JA') == [{'callsign': 'JA1XYZ', 'count': 3}]
+    assert dupe_check.check('JA1XYZ', '15m', 'CW')['dupe']
+    assert loads == []
+
+
+def test_foreign_delete_rebuilds(client, add_qso, monkeypatch):
+    add_qso(callsign='BG1AA')
+    log_id = _foreign_insert('JA1XYZ')
+    assert dupe_check.check('JA1XYZ', '40m', 'CW')['dupe']
+    assert callsign_index.suggest('JA')
+    loads = _count_loads(monkeypatch)
+
+    _foreign_delete(log_id)
+    assert not dupe_check.check('JA1XYZ', '40m', 'CW')['dupe']
+    assert callsign_index.suggest('JA') == []
+    assert sorted(loads) == ['callsign_index', 'dupe_check']
+
+
+def test_local_delete_of_unseen_foreign_row_rebuilds(client, add_qso):
+    add_qso(callsign='BG1AA')
+    assert callsign_index.suggest('K1') == []
+    assert not dupe_check.check('K1ABC', '40m', 'CW')['dupe']
+
+    # 本进程在索引应用其他进程的新增之前删除了该记录
+    log_id = _foreign_insert('K1ABC')
+    assert client.get(f'/api/logs/del?id={log_id}').status_code == 200
+    assert callsign_index.suggest('K1') == []
+    assert not dupe_check.check('K1ABC', '40m', 'CW')['dupe']
+
+
+def test_trimmed_change_log_falls_back_to_rebuild(client, add_qso, monkeypatch):
+    add_qso(callsign='BG1AA')
+    assert callsign_index.suggest('BG')
+    monkeypatch.setattr(log_version, 'CHANGES_MAX_BYTES', 200)
+    for i in range(5):
+        _foreign_insert(f'JA{i}XYZ')
+    assert log_version.changes_since(callsign_index._version)[1] is None
+    assert len(callsign_index.suggest('JA')) == 5
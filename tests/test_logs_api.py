@@ -0,0 +1,99 @@
+from db_utils import execute_query
+import routes
+
+
+def _ids(query="SELECT id FROM qso_log ORDER BY qso_datetime_utc DESC, id DESC"):
+    return [row['id'] for row in execute_query(query, fetch=True)]
+
+
+def _add_logs(add_qso, count):
+    # 同一时间多条记录，翻页时按 id 区分先后
+    for i in range(count):
+        add_qso(callsign=f"BG{i}AA", date=f"2024-01-{i % 5 + 1:02d}", time=f"{i % 3:02d}:00",
+                band='20m' if i % 2 else '40m')
+
+
+def _walk(client, query, direction='next', token=None):
+    ids = []
+    while True:
+        url = f"/api/logs?{query}" + (f"&cursor={token}" if token else "")
+        response = client.get(url)
+        assert response.status_code == 200
+        body = response.get_json()
+        page = [row['id'] for row in body['data']]
+        ids = ids + page if direction == 'next' else page + ids
+        token = body[direction]
+        if not token:
+            return ids, body
+
+
+def test_cursor_pages_follow_list_order(client, add_qso):
+    _add_logs(add_qso, 23)
+    forward, last_page = _walk(client, "size=5")
+    assert forward == _ids()
+    # 从最后一页向前翻回第一页
+    backward, _ = _walk(client, "size=5", 'prev', last_page['prev'])
+    assert backward + [row['id'] for row in last_page['data']] == forward
+
+
+def test_cursor_with_band_filter(client, add_qso):
+    _add_logs(add_qso, 12)
+    forward, _ = _walk(client, "size=4&band=20m")
+    assert forward == _ids("SELECT id FROM qso_log WHERE band = '20m' ORDER BY qso_datetime_utc DESC, id DESC")
+
+
+def test_invalid_cursor_is_rejected(client):
+    response = client.get("/api/logs?cursor=not-a-cursor")
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+
+
+def test_cursor_condition_uses_column_comparisons():
+    condition, params = routes._cursor_condition(['2024-01-01 00:00:00', 5], 'next')
+    assert 'IS NULL' not in condition and '(qso_datetime_utc, id)' not in condition
+    assert params == ['2024-01-01 00:00:00', '2024-01-01 00:00:00', 5]
+
+
+def test_batch_update_reports_missing_ids(client, add_qso):
+    _add_logs(add_qso, 3)
+    ids = _ids()
+    response = client.post('/api/logs/batch', json={'action': 'update', 'ids': ids + [9999],
+                                                   'patch': {'qslcard': 1}})
+    body = response.get_json()
+    assert response.status_code == 200 and body['success'] is False
+    assert [r['success'] for r in body['data']] == [True, True, True, False]
+    assert _ids("SELECT id FROM qso_log WHERE qslcard = 1") == sorted(ids)
+
+
+def test_batch_update_duplicate_rolls_back(client, add_qso):
+    add_qso(callsign='BG1AA', time='10:00')
+    add_qso(callsign='BG1AA', time='11:00')
+    first, second = sorted(_ids())
+    response = client.post('/api/logs/batch', json={'action': 'update', 'items': [
+        {'id': first, 'notes': 'changed'},
+        {'id': second, 'time': '10:00'},
+    ]})
+    assert response.status_code == 409
+    assert response.get_json()['error'] == 'DUPLICATE_QSO'
+    # 整批回滚，第一条的修改也没有写入
+    rows = execute_query("SELECT notes FROM qso_log WHERE id = %s", (first,), fetch=True)
+    assert rows[0]['notes'] is None
+
+
+def test_batch_delete_updates_count_and_dupe(client, add_qso):
+    _add_logs(add_qso, 4)
+    assert client.get('/api/dupe?callsign=BG0AA&band=40m&mode=FT8').get_json()['data']['dupe'] is True
+    target = _ids("SELECT id FROM qso_log WHERE callsign = 'BG0AA'")
+    response = client.post('/api/logs/batch', json={'action': 'delete', 'ids': target})
+    assert response.get_json()['success'] is True
+    assert client.get('/api/logs/count').get_json()['count'] == 3
+    assert client.get('/api/dupe?callsign=BG0AA&band=40m&mode=FT8').get_json()['data']['dupe'] is False
+
+
+def test_batch_rejects_repeated_item_ids(client, add_qso):
+    _add_logs(add_qso, 1)
+    log_id = _ids()[0]
+    response = client.post('/api/logs/batch', json={'action': 'update', 'items': [
+        {'id': log_id, 'notes': 'a'}, {'id': log_id, 'notes': 'b'}]})
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'VALIDATION_ERROR'
@@ -0,0 +1,58 @@
+import sqlite3
+
+import pytest
+
+import db_utils
+import migrations
+import server
+
+
+def _connect(path):
+    conn = sqlite3.connect(str(path / 'qso_log.db'), isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def test_fresh_database_reaches_latest_version(database):
+    db_utils.init_db_pool()
+    applied = migrations.migrate()
+    assert applied == [version for version, _, _ in migrations.MIGRATIONS]
+    assert migrations.get_schema_version() == migrations.LATEST_VERSION
+    # 已是最新版本时不再执行
+    assert migrations.migrate() == []
+
+
+def test_prepare_master_migrates_with_its_own_pool(database):
+    server.prepare_master()
+    assert db_utils.db_pool is None
+    db_utils.init_db_pool()
+    assert migrations.get_schema_version() == migrations.LATEST_VERSION
+
+
+def test_prepare_master_aborts_when_migration_fails(database, monkeypatch):
+    # 单个连接时迁移中的 stream_query 取不到连接，主进程应抛出异常而不是继续启动
+    monkeypatch.setattr(server, 'MIGRATION_POOL_SIZE', 1)
+    monkeypatch.setattr(db_utils, 'pool_timeout', 0.1)
+    with pytest.raises(Exception):
+        server.prepare_master()
+    assert db_utils.db_pool is None
+
+
+def test_upgrade_fills_qso_datetime_utc(database):
+    db_utils.init_db_pool()
+    previous = [m for m in migrations.MIGRATIONS if m[0] < 14]
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(migrations, 'MIGRATIONS', previous)
+        patch.setattr(migrations, 'LATEST_VERSION', previous[-1][0])
+        migrations.migrate()
+
+    conn = _connect(database)
+    rows = [('BA1X', '2024-03-01', '1230'), ('BA2X', None, '0800'), ('BA3X', '2024-03-02', 'bad')]
+    for callsign, date, time in rows:
+        conn.execute("INSERT INTO qso_log (callsign, frequency, mode, date, time, band, qslcard) "
+                     "VALUES (?, 7.0, 'CW', ?, ?, '40m', 0)", (callsign, date, time))
+
+    assert migrations.migrate() == [14]
+    values = {row['callsign']: row['qso_datetime_utc']
+              for row in conn.execute("SELECT callsign, qso_datetime_utc FROM qso_log")}
+    assert values == {'BA1X': '2024-03-01 12:30:00', 'BA2X': '1000-01-01 00:00:00', 'BA3X': '2024-03-02 00:00:00'}
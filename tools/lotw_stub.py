@@ -0,0 +1,130 @@
+"""
+本地LOTW模拟服务，用于在不访问 lotw.arrl.org 的情况下调试同步功能
+GET 返回ADIF报告，支持 qso_qslsince / qso_qsorxsince 过滤；POST 接收上传并返回XML状态
+
+用法: python tools/lotw_stub.py [--port 8765] [--records 1000] [--adi 文件路径]
+然后将 config.ini 中 [LOTW] url 改为 http://127.0.0.1:8765/lotwreport.adi
+"""
+
+import argparse
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from adif import read_adi_records  # noqa: E402
+
+
+def _field(name, value):
+    value = str(value)
+    return f"<{name}:{len(value.encode('utf-8'))}>{value}"
+
+
+def generate_records(count, seed=0):
+    """生成带有LOTW接收时间的模拟记录"""
+    rng = random.Random(seed)
+    bands = [('40m', 7.074), ('20m', 14.074), ('15m', 21.074), ('10m', 28.074), ('6m', 50.313)]
+    start = datetime(2024, 1, 1)
+    records = []
+    for i in range(count):
+        qso_time = start + timedelta(minutes=7 * i)
+        band, freq = rng.choice(bands)
+        confirmed = rng.random() < 0.4
+        record = {
+            'CALL': f"B{rng.choice('DGHY')}{rng.randint(0, 9)}{''.join(rng.choices('ABCDEFGHIJKLMNOPQRSTUVWXYZ', k=3))}",
+            'BAND': band,
+            'FREQ': f"{freq:.6f}",
+            'MODE': rng.choice(['FT8', 'CW', 'SSB']),
+            'QSO_DATE': qso_time.strftime('%Y%m%d'),
+            'TIME_ON': qso_time.strftime('%H%M%S'),
+            'APP_LOTW_RXQSO': (qso_time + timedelta(hours=1)).strftime('%Y-%m-%d %H:%M:%S'),
+            'QSL_RCVD': 'Y' if confirmed else 'N',
+        }
+        if confirmed:
+            record['LOTW_QSL_RCVD'] = 'Y'
+            record['APP_LOTW_RXQSL'] = (qso_time + timedelta(days=2)).strftime('%Y-%m-%d %H:%M:%S')
+        records.append(record)
+    return records
+
+
+class LOTWStubHandler(BaseHTTPRequestHandler):
+    records = []
+    uploads = []
+    # 前若干次上传返回失败，用于测试重试
+    fail_uploads = 0
+
+    def do_GET(self):
+        query = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        records = self.records
+        if query.get('qso_qsl', 'yes') != 'no':
+            records = [r for r in records if r.get('LOTW_QSL_RCVD') == 'Y']
+            since = query.get('qso_qslsince')
+            if since:
+                records = [r for r in records if r.get('APP_LOTW_RXQSL', '') >= since]
+        since = query.get('qso_qsorxsince')
+        if since:
+            records = [r for r in records if r.get('APP_LOTW_RXQSO', '') >= since]
+
+        body = "LOTW stub report\n" + _field('PROGRAMID', 'LoTW') + "<EOH>\n"
+        body += "".join("".join(_field(k, v) for k, v in r.items()) + "<EOR>\n" for r in records)
+        data = body.encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-arrl-adif')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.uploads.append(self.rfile.read(length))
+        cls = type(self)
+        if cls.fail_uploads > 0:
+            cls.fail_uploads -= 1
+            status, code = 'ERROR', 503
+        else:
+            status, code = 'OK', 200
+        data = f"<response><status>{status}</status></response>".encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=8765, records=None, fail_uploads=0):
+    """创建模拟服务，调用 serve_forever() 开始处理请求"""
+    LOTWStubHandler.records = records if records is not None else generate_records(1000)
+    LOTWStubHandler.fail_uploads = fail_uploads
+    server = ThreadingHTTPServer(('127.0.0.1', port), LOTWStubHandler)
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地LOTW模拟服务")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--records', type=int, default=1000, help="生成的模拟记录数")
+    parser.add_argument('--adi', help="使用指定ADI文件中的记录代替模拟记录")
+    parser.add_argument('--fail-uploads', type=int, default=0, help="前N次上传返回失败")
+    args = parser.parse_args(argv)
+
+    records = list(read_adi_records(args.adi)) if args.adi else generate_records(args.records)
+    server = serve(args.port, records, args.fail_uploads)
+    print(f"LOTW模拟服务: http://127.0.0.1:{args.port}/lotwreport.adi ({len(records)} 条记录)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
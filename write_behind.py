@@ -0,0 +1,319 @@
+"""
+写入队列(比赛模式)
+多个席位高速录入时，每条日志单独提交一次事务，磁盘同步的延迟限制了录入速度。
+开启后 /log/new 校验表单后只把记录追加到本地日志文件并放入队列就返回，
+后台线程每凑满 batch_size 条或最早的记录等待超过 interval_ms 毫秒时，
+用一条多行 INSERT 在一个事务中写入一批
+
+持久性:
+    - 记录先写入本地日志文件(journal)再入队，进程崩溃后下次启动时重新写入数据库；
+      fsync = true 时每条记录都同步到磁盘，断电也不丢失
+    - 正常退出时(server.py 注册了 atexit)写完队列中的全部记录
+    - 数据本身有错误(违反约束、值过长等)的批次逐条重新写入，仍然失败的记录转入死信文件
+      (dead_letter，每行一个 {"row": 记录, "error": 错误, "rejected_at": 时间})，不阻塞后面的记录；
+      连接中断等其他错误整批按退避时间重试
+    - 每批提交后记录日志文件中已提交部分的长度: 队列为空时截断日志文件；已提交部分超过一半时
+      把未提交的记录写入临时文件后替换原文件，持续高负载、队列一直不为空时日志文件也不会无限增长；
+      重放时已写入的记录按QSO唯一键(uq_qso_log_identity)跳过
+
+队列在进程内，锁文件(日志文件名加 .lock)加锁，只有一个进程能启用写入队列
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from db_utils import config, transaction, DataError
+import metrics
+import qso_events
+import qso_time
+
+try:
+    import fcntl
+except ImportError:  # Windows 上不加锁
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = config.getint('WRITE_BEHIND', 'batch_size', fallback=200)
+INTERVAL_MS = config.getfloat('WRITE_BEHIND', 'interval_ms', fallback=50)
+JOURNAL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            config.get('WRITE_BEHIND', 'journal', fallback=os.path.join('instance', 'write_behind.journal')))
+DEAD_LETTER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                config.get('WRITE_BEHIND', 'dead_letter',
+                                           fallback=os.path.join('instance', 'write_behind.rejected')))
+FSYNC = config.getboolean('WRITE_BEHIND', 'fsync', fallback=False)
+# 写入失败后第n次重试前等待 retry_delay * 2^(n-1) 秒，最长 MAX_RETRY_DELAY 秒
+RETRY_DELAY = config.getfloat('WRITE_BEHIND', 'retry_delay', fallback=1)
+MAX_RETRY_DELAY = 30
+
+# 与 /log/new 表单写入的列一致(qso_datetime_utc 在写入时按 date、time 计算，不写入本地日志文件)
+COLUMNS = (
+    'callsign', 'frequency', 'mode', 'equipment', 'antenna', 'power',
+    'date', 'time', 'notes', 'dxcc', 'grid', 'province', 'band', 'qslcard', 'qso_datetime_utc'
+)
+IDENTITY_COLUMNS = ('callsign', 'date', 'time', 'band', 'mode')
+
+
+def insert_batch(rows):
+    """
+    在一个事务中写入一批记录，与已有记录QSO唯一键相同的跳过
+    :return: 实际新增的行
+    """
+    key_placeholders = "(" + ", ".join(["%s"] * len(IDENTITY_COLUMNS)) + ")"
+    key_query = (
+        f"SELECT * FROM qso_log "
+        f"WHERE ({', '.join(IDENTITY_COLUMNS)}) IN ({', '.join([key_placeholders] * len(rows))})"
+    )
+    # 按规范化后的 time 查找已有记录
+    values = [qso_time.fill(dict(row)) for row in rows]
+    key_params = [row.get(c) for row in values for c in IDENTITY_COLUMNS]
+    row_placeholders = "(" + ", ".join(["%s"] * len(COLUMNS)) + ")"
+
+    with transaction() as cursor:
+        cursor.execute(key_query + " FOR UPDATE", key_params)
+        existing = {row['id'] for row in cursor.fetchall()}
+        cursor.execute(
+            f"INSERT INTO qso_log ({', '.join(COLUMNS)}) "
+            f"VALUES {', '.join([row_placeholders] * len(rows))} "
+            f"ON DUPLICATE KEY UPDATE id = id",
+            [row.get(c) for row in values for c in COLUMNS]
+        )
+        cursor.execute(key_query, key_params)
+        added = [row for row in cursor.fetchall() if row['id'] not in existing]
+        qso_events.publish(added=added)
+    return added
+
+
+class WriteBehindWriter:
+    """写入队列和后台写入线程"""
+
+    def __init__(self, batch_size=BATCH_SIZE, interval_ms=INTERVAL_MS, journal_path=JOURNAL_PATH,
+                 fsync=FSYNC, retry_delay=RETRY_DELAY, dead_letter_path=DEAD_LETTER_PATH):
+        self.batch_size = batch_size
+        self.interval = interval_ms / 1000
+        self.journal_path = journal_path
+        self.dead_letter_path = dead_letter_path
+        self.fsync = fsync
+        self.retry_delay = retry_delay
+        self._journal = None
+        self._lock_file = None
+        self._thread = None
+        self._stop = False
+        self._cond = threading.Condition()
+        # [(入队时间, 行, 日志文件中的一行)]，写入成功后才从队列中移除
+        self._pending = []
+        # 日志文件的长度(字符数)及其中已提交记录的长度
+        self._journal_size = 0
+        self._committed_size = 0
+        self.stats = {'queued': 0, 'written': 0, 'duplicates': 0, 'rejected': 0, 'batches': 0, 'failures': 0,
+                      'recovered': 0, 'max_depth': 0, 'compactions': 0, 'last_error': None}
+
+    def _read_journal(self):
+        """:return: [(行, 日志文件中的一行)]"""
+        entries = []
+        self._journal.seek(0)
+        for line in self._journal:
+            line = line.rstrip("\n")
+            try:
+                entries.append((json.loads(line), line))
+            except ValueError:
+                # 崩溃时写了一半的最后一行
+                logger.warning("写入队列日志文件中有不完整的记录，已忽略")
+        return entries
+
+    def _compact(self):
+        """
+        删除日志文件中已提交的记录(调用方持有 self._cond)
+        先写临时文件再替换，替换前崩溃时原日志文件仍然完整
+        """
+        self._committed_size = 0
+        if not self._pending:
+            self._journal.truncate(0)
+            self._journal_size = 0
+            return
+        tmp_path = f"{self.journal_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.writelines(line + "\n" for _, _, line in self._pending)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+        self._journal.close()
+        self._journal = open(self.journal_path, 'a+', encoding='utf-8')
+        self._journal_size = sum(len(line) + 1 for _, _, line in self._pending)
+        self.stats['compactions'] += 1
+
+    def start(self):
+        """
+        启动写入线程，并重新写入上次未写完的记录
+        :return: 从日志文件恢复的记录数
+        """
+        if self._thread:
+            return 0
+        os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+        # 日志文件压缩时会被替换，进程间的锁加在单独的锁文件上
+        lock_file = open(f"{self.journal_path}.lock", 'a')
+        if fcntl:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                raise RuntimeError(f"写入队列日志文件被其他进程占用: {self.journal_path}")
+        self._lock_file = lock_file
+        self._journal = open(self.journal_path, 'a+', encoding='utf-8')
+        recovered = self._read_journal()
+        now = time.monotonic()
+        with self._cond:
+            self._stop = False
+            self._pending.extend((now, row, line) for row, line in recovered)
+            self._journal_size = sum(len(line) + 1 for _, line in recovered)
+            self._committed_size = 0
+            self.stats['recovered'] += len(recovered)
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        logger.info(f"写入队列已启动，恢复 {len(recovered)} 条记录")
+        return len(recovered)
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def enqueue(self, row):
+        """
+        记录写入日志文件后入队
+        :return: 当前队列长度
+        """
+        line = json.dumps({c: row.get(c) for c in COLUMNS}, ensure_ascii=False, default=str)
+        with self._cond:
+            if self._stop or self._journal is None:
+                raise RuntimeError("写入队列未启动")
+            self._journal.write(line + "\n")
+            self._journal_size += len(line) + 1
+            self._journal.flush()
+            if self.fsync:
+                os.fsync(self._journal.fileno())
+            self._pending.append((time.monotonic(), row, line))
+            depth = len(self._pending)
+            self.stats['queued'] += 1
+            self.stats['max_depth'] = max(self.stats['max_depth'], depth)
+            if depth == 1 or depth >= self.batch_size:
+                self._cond.notify()
+        return depth
+
+    def depth(self):
+        with self._cond:
+            return len(self._pending)
+
+    def _next_batch(self):
+        """等待凑满一批或最早的记录超时；停止且队列为空时返回 None"""
+        with self._cond:
+            while not self._pending:
+                if self._stop:
+                    return None
+                self._cond.wait()
+            deadline = self._pending[0][0] + self.interval
+            while len(self._pending) < self.batch_size and not self._stop:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return [row for _, row, _ in self._pending[:self.batch_size]]
+
+    def _dead_letter(self, rejected):
+        """写入死信文件，写入失败时抛出 OSError(记录仍在队列中，按退避时间重试)"""
+        os.makedirs(os.path.dirname(self.dead_letter_path), exist_ok=True)
+        rejected_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+        with open(self.dead_letter_path, 'a', encoding='utf-8') as f:
+            for row, error in rejected:
+                f.write(json.dumps({'row': {c: row.get(c) for c in COLUMNS if c != 'qso_datetime_utc'},
+                                    'error': error, 'rejected_at': rejected_at},
+                                   ensure_ascii=False, default=str) + "\n")
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+    def _write(self, batch):
+        """
+        写入一批记录；数据错误时逐条写入，仍然失败的记录转入死信文件
+        :return: (新增的行, 被拒绝的记录数)
+        """
+        try:
+            return insert_batch(batch), 0
+        except DataError as e:
+            logger.warning(f"写入队列批量写入失败，改为逐条写入: {str(e)}")
+        added, rejected = [], []
+        for row in batch:
+            try:
+                added.extend(insert_batch([row]))
+            except DataError as e:
+                rejected.append((row, str(e)))
+        if rejected:
+            self._dead_letter(rejected)
+            logger.error(f"写入队列有 {len(rejected)} 条记录无法写入，已转入 {self.dead_letter_path}")
+        return added, len(rejected)
+
+    def _run(self):
+        failures = 0
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                added, rejected = self._write(batch)
+            except Exception as e:
+                failures += 1
+                logger.error(f"写入队列写入数据库失败: {str(e)}")
+                with self._cond:
+                    self.stats['failures'] += 1
+                    self.stats['last_error'] = str(e)
+                    if self._stop:
+                        # 退出时数据库不可用，记录保留在日志文件中，下次启动时写入
+                        return
+                    self._cond.wait(min(self.retry_delay * 2 ** (failures - 1), MAX_RETRY_DELAY))
+                continue
+            failures = 0
+            with self._cond:
+                self._committed_size += sum(len(line) + 1 for _, _, line in self._pending[:len(batch)])
+                del self._pending[:len(batch)]
+                self.stats['written'] += len(added)
+                self.stats['rejected'] += rejected
+                self.stats['duplicates'] += len(batch) - len(added) - rejected
+                self.stats['batches'] += 1
+                try:
+                    if not self._pending or self._committed_size * 2 >= self._journal_size:
+                        self._compact()
+                except OSError as e:
+                    # 未压缩时日志文件中多出已提交的记录，重放时按QSO唯一键跳过
+                    logger.error(f"写入队列压缩日志文件失败: {str(e)}")
+
+    def stop(self, timeout=None):
+        """写完队列中的记录后停止"""
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        with self._cond:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+
+    def status(self):
+        with self._cond:
+            return {
+                'running': self.is_running(),
+                'depth': len(self._pending),
+                'oldest_wait_ms': round((time.monotonic() - self._pending[0][0]) * 1000, 1) if self._pending else 0,
+                **self.stats,
+            }
+
+
+# 由 server.py 按配置启动
+writer = WriteBehindWriter()
+metrics.Callback("cnhamlog_write_queue_depth", "写入队列中等待写入数据库的记录数", lambda: writer.depth())
@@ -0,0 +1,9 @@
+"""
+WSGI入口(生产环境): gunicorn -c gunicorn.conf.py wsgi:app
+只创建应用，连接池和后台线程在每个工作进程 fork 之后初始化(gunicorn.conf.py 中的 post_fork)；
+使用其他WSGI服务器时，需在每个工作进程中调用一次 server.init_worker()
+"""
+
+from server import create_app
+
+app = create_app()